@@ -0,0 +1,180 @@
+"""
+Local stand-in for lsst.daf.butler.Butler that serves the task
+metadata, nImage, and mergeDet datasets written by
+synthetic.make_fake_repo, so that the Butler-based code can be
+benchmarked without a Gen3 repo.  Only the parts of the Butler
+interface used by desc.drp_tools are implemented.
+"""
+import os
+import sys
+import json
+import pickle
+import types
+import contextlib
+from unittest import mock
+import numpy as np
+import yaml
+
+__all__ = ['FakeButler', 'fake_butler']
+
+
+class DatasetType:
+    def __init__(self, name):
+        self.name = name
+
+
+class DatasetRef:
+    def __init__(self, dataset_id, dstype, data_id, path, run='fake_run'):
+        self.id = dataset_id
+        self.datasetType = DatasetType(dstype)
+        self.dataId = dict(data_id)
+        self.path = path
+        self.run = run
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return self.id == other.id
+
+
+class FakeURI:
+    """Minimal lsst.resources.ResourcePath for local files."""
+    def __init__(self, path):
+        self.ospath = path
+        self.path = path
+
+    def read(self, size=-1):
+        with open(self.ospath, 'rb') as fobj:
+            return fobj.read(size)
+
+    def size(self):
+        return os.path.getsize(self.ospath)
+
+    def getExtension(self):
+        return os.path.splitext(self.ospath)[1]
+
+    def __str__(self):
+        return f'file://{self.ospath}'
+
+
+class _Image:
+    def __init__(self, array):
+        self.array = array
+
+
+class _TaskMetadata:
+    """
+    Minimal lsst.pipe.base.TaskMetadata built from its serialization
+    layout of nested dicts with 'scalars', 'arrays', and 'metadata'
+    entries.  Array entries return their last value.
+    """
+    def __init__(self, md):
+        self._scalars = dict(md.get('scalars', {}))
+        self._arrays = dict(md.get('arrays', {}))
+        self._metadata = {key: _TaskMetadata(value) for key, value
+                          in md.get('metadata', {}).items()}
+
+    def keys(self):
+        return [*self._scalars, *self._arrays, *self._metadata]
+
+    def __getitem__(self, key):
+        if key in self._scalars:
+            return self._scalars[key]
+        if key in self._arrays:
+            return self._arrays[key][-1]
+        return self._metadata[key]
+
+
+class FakeRegistry:
+    """
+    Registry in which each dataset is in its run collection, and any
+    other collection name, e.g., that of a chained collection, contains
+    all of the datasets.
+    """
+    def __init__(self, dsrefs):
+        self._dsrefs = dsrefs
+        self._runs = {_.run for _ in dsrefs}
+
+    def queryDatasets(self, dstype, collections=None, **kwargs):
+        dsrefs = [_ for _ in self._dsrefs if _.datasetType.name == dstype]
+        if collections is None:
+            return dsrefs
+        if isinstance(collections, str):
+            collections = [collections]
+        if not set(collections).issubset(self._runs):
+            return dsrefs
+        return [_ for _ in dsrefs if _.run in collections]
+
+    def queryDatasetTypes(self, expression):
+        names = sorted({_.datasetType.name for _ in self._dsrefs})
+        return [DatasetType(_) for _ in names if expression.fullmatch(_)]
+
+    def getCollectionSummary(self, collection):
+        names = {_.datasetType.name for _ in self._dsrefs}
+        return types.SimpleNamespace(
+            dataset_types=types.SimpleNamespace(names=names))
+
+
+class FakeButler:
+    """
+    Butler for a repo directory written by synthetic.make_fake_repo.
+    See FakeRegistry for the collections that contain the datasets.
+    """
+    def __init__(self, repo, collections=None, **kwargs):
+        self.repo = repo
+        self.collections = collections
+        with open(os.path.join(repo, 'manifest.json')) as fobj:
+            self._dsrefs = [DatasetRef(_['id'], _['dstype'], _['data_id'],
+                                       _['path'], _.get('run', 'fake_run'))
+                            for _ in json.load(fobj)]
+        self.registry = FakeRegistry(self._dsrefs)
+        # No getManyURIs or getURIs, so dp_sizes falls back to getURI.
+        self.datastore = types.SimpleNamespace()
+
+    def getURI(self, dsref):
+        return FakeURI(os.path.join(self.repo, dsref.path))
+
+    def getDirect(self, dsref):
+        uri = self.getURI(dsref)
+        extension = uri.getExtension()
+        if extension == '.npy':
+            return _Image(np.load(uri.ospath))
+        if extension == '.fits':
+            # Read the whole table, independently of the header
+            # parsing in desc.drp_tools.fits_headers.
+            from astropy.table import Table
+            return Table.read(uri.ospath, hdu=1)
+        # Task metadata.
+        if extension == '.yaml':
+            md = yaml.safe_load(uri.read())
+        elif extension == '.pickle':
+            md = pickle.loads(uri.read())
+        else:
+            md = json.loads(uri.read())
+        return _TaskMetadata(md)
+
+
+@contextlib.contextmanager
+def fake_butler():
+    """
+    Context manager that replaces lsst.daf.butler.Butler with
+    FakeButler.  If the LSST stack isn't available, stand-in lsst,
+    lsst.daf, and lsst.daf.butler modules are installed.  This should
+    be entered before desc.drp_tools is imported.
+    """
+    try:
+        import lsst.daf.butler as daf_butler
+    except ImportError:
+        daf_butler = None
+    if daf_butler is not None:
+        with mock.patch.object(daf_butler, 'Butler', FakeButler):
+            yield FakeButler
+        return
+    lsst = types.ModuleType('lsst')
+    lsst.daf = types.ModuleType('lsst.daf')
+    lsst.daf.butler = types.ModuleType('lsst.daf.butler')
+    lsst.daf.butler.Butler = FakeButler
+    with mock.patch.dict(sys.modules, {'lsst': lsst, 'lsst.daf': lsst.daf,
+                                       'lsst.daf.butler': lsst.daf.butler}):
+        yield FakeButler
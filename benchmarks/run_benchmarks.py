@@ -0,0 +1,314 @@
+"""
+Benchmarks of the drp_tools hot paths on synthetic DC2-scale inputs.
+
+Each benchmark is run at each of the requested scales, i.e., numbers
+of visits, overlap rows, metadata files, or resource usage rows, and
+the results are appended to a JSON history file.  A result is flagged
+as a regression if its time exceeds the best previous time for that
+benchmark and scale by more than the threshold factor.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scales 1000 10000 100000 1000000
+"""
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import warnings
+import tempfile
+import platform
+import contextlib
+import subprocess
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_butler import fake_butler
+
+__all__ = ['BENCHMARKS', 'run_benchmarks', 'find_regressions']
+
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+
+
+class Timer:
+    """Context manager that records the elapsed time of its block."""
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.t0
+
+
+def bench_fill_visit_table(workdir, scale, options):
+    from desc.drp_tools.fill_tables import fill_visit_table
+    import synthetic
+    opsim_db = os.path.join(workdir, 'opsim.db')
+    synthetic.make_opsim_db(opsim_db, scale, synthetic.make_tract_grid())
+    db_file = os.path.join(workdir, 'visits.db')
+    with Timer() as timer:
+        fill_visit_table(db_file, opsim_db)
+    return scale, timer.elapsed
+
+
+def bench_fill_overlap_table(workdir, scale, options):
+    from desc.drp_tools.fill_tables import fill_visit_table, \
+        fill_tract_table, fill_overlap_table
+    from desc.drp_tools.skymap_cache import load_skymap_geometry
+    import synthetic
+    tract_grid = synthetic.make_tract_grid()
+    opsim_db = os.path.join(workdir, 'opsim.db')
+    synthetic.make_opsim_db(opsim_db, scale, tract_grid)
+    # There is no skymap file, so the cache file is used as is.
+    skymap_file = os.path.join(workdir, 'skyMap.pickle')
+    cache_file = os.path.join(workdir, 'skyMap_geometry.npz')
+    synthetic.write_skymap_cache(cache_file, tract_grid)
+    db_file = os.path.join(workdir, 'overlaps.db')
+    fill_visit_table(db_file, opsim_db)
+    fill_tract_table(db_file, skymap_file, tract_list=tract_grid[0].tolist(),
+                     cache_file=cache_file)
+    geometry = load_skymap_geometry(skymap_file, cache_file=cache_file)
+    with Timer() as timer:
+        fill_overlap_table(db_file, processes=options.processes,
+                           geometry=geometry)
+    return scale, timer.elapsed
+
+
+def bench_sfp_yaml_factory(workdir, scale, options):
+    from desc.drp_tools.sfp_utils import SfpYamlFactory
+    from desc.drp_tools.overlap_db import create_overlap_indexes
+    import synthetic
+    overlap_db = os.path.join(workdir, 'sfp_overlaps.db')
+    synthetic.make_overlaps_db(overlap_db, scale)
+    create_overlap_indexes(overlap_db, 'overlaps')
+    factory = SfpYamlFactory(overlap_db, workdir)
+    # The bps yaml files are written to the current directory.
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with Timer() as timer:
+            factory.create(list(range(10)), num_parts=10)
+    finally:
+        os.chdir(cwd)
+    return scale, timer.elapsed
+
+
+def _fake_repo(workdir, scale, options):
+    import synthetic
+    num_files = min(scale, options.max_files)
+    repo = os.path.join(workdir, 'repo')
+    synthetic.make_fake_repo(repo, num_files, num_tracts=1)
+    return repo, num_files
+
+
+def bench_get_resource_usage(workdir, scale, options):
+    from desc.drp_tools import get_resource_usage
+    repo, num_files = _fake_repo(workdir, scale, options)
+    with Timer() as timer:
+        get_resource_usage(repo, ['fake'], processes=options.processes)
+    return num_files, timer.elapsed
+
+
+def bench_get_nImage_stats(workdir, scale, options):
+    from desc.drp_tools import get_nImage_stats
+    repo, _ = _fake_repo(workdir, scale, options)
+    with Timer() as timer:
+        df = get_nImage_stats(repo, 'fake', processes=options.processes)
+    return len(df), timer.elapsed
+
+
+def bench_get_merged_det_stats(workdir, scale, options):
+    from desc.drp_tools import get_merged_det_stats
+    repo, _ = _fake_repo(workdir, scale, options)
+    with Timer() as timer:
+        df = get_merged_det_stats(repo, 'fake')
+    return len(df), timer.elapsed
+
+
+def bench_add_nImage_columns(workdir, scale, options):
+    from desc.drp_tools import add_nImage_columns, add_merged_det_column
+    import synthetic
+    df_coadd, df_nImage, df_merged_det = synthetic.make_coadd_frames(scale)
+    with Timer() as timer:
+        add_nImage_columns(df_coadd, df_nImage)
+        add_merged_det_column(df_coadd, df_merged_det)
+    return scale, timer.elapsed
+
+
+def bench_fit_coadd_resources(workdir, scale, options):
+    from desc.drp_tools import add_nImage_columns, fit_coadd_resources
+    import synthetic
+    df_coadd, df_nImage, _ = synthetic.make_coadd_frames(scale)
+    df_coadd = add_nImage_columns(df_coadd, df_nImage)
+    with Timer() as timer:
+        fit_coadd_resources(df_coadd)
+    return scale, timer.elapsed
+
+
+def bench_fit_visit_resources(workdir, scale, options):
+    from desc.drp_tools import fit_visit_resources
+    import synthetic
+    df_visit = synthetic.make_visit_frame(scale)
+    with Timer() as timer:
+        fit_visit_resources(df_visit)
+    return scale, timer.elapsed
+
+
+BENCHMARKS = {'fill_visit_table': bench_fill_visit_table,
+              'fill_overlap_table': bench_fill_overlap_table,
+              'SfpYamlFactory.create': bench_sfp_yaml_factory,
+              'get_resource_usage': bench_get_resource_usage,
+              'get_nImage_stats': bench_get_nImage_stats,
+              'get_merged_det_stats': bench_get_merged_det_stats,
+              'add_nImage_columns': bench_add_nImage_columns,
+              'fit_coadd_resources': bench_fit_coadd_resources,
+              'fit_visit_resources': bench_fit_visit_resources}
+
+
+def run_benchmarks(names, scales, options, workdir=None):
+    """
+    Run the named benchmarks at each scale, each in a fresh
+    subdirectory of workdir.  The output of the benchmarked functions
+    and any warnings are suppressed unless options.verbose is set.
+
+    Returns
+    -------
+    list of dicts with the benchmark name, scale, number of items
+    processed, and elapsed time (s).
+    """
+    results = []
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        for scale in scales:
+            for name in names:
+                bench_dir = os.path.join(workdir, f'{name}_{scale}')
+                shutil.rmtree(bench_dir, ignore_errors=True)
+                os.makedirs(bench_dir)
+                with contextlib.ExitStack() as quiet:
+                    if not options.verbose:
+                        quiet.enter_context(
+                            contextlib.redirect_stdout(io.StringIO()))
+                        quiet.enter_context(warnings.catch_warnings())
+                        warnings.simplefilter('ignore')
+                    num_items, elapsed = BENCHMARKS[name](bench_dir, scale,
+                                                          options)
+                shutil.rmtree(bench_dir, ignore_errors=True)
+                results.append(dict(name=name, scale=scale,
+                                    num_items=num_items, seconds=elapsed))
+                print(f'{name:25s} {scale:>9d} {num_items:>9d} '
+                      f'{elapsed:10.3f} s', flush=True)
+    return results
+
+
+def find_regressions(results, history, threshold=1.25, min_delta=0.05):
+    """
+    Compare results to the best previous times for the same benchmark
+    and scale in the history.  A result is a regression if it is slower
+    than threshold times the best time, and by more than min_delta s.
+
+    Returns
+    -------
+    list of (name, scale, seconds, best previous seconds) tuples.
+    """
+    best = {}
+    for entry in history:
+        for result in entry['results']:
+            key = result['name'], result['scale']
+            best[key] = min(best.get(key, np.inf), result['seconds'])
+    regressions = []
+    for result in results:
+        key = result['name'], result['scale']
+        if key not in best:
+            continue
+        if (result['seconds'] > threshold*best[key] and
+                result['seconds'] - best[key] > min_delta):
+            regressions.append((*key, result['seconds'], best[key]))
+    return regressions
+
+
+def git_commit():
+    """Current git commit of the repo, or None if unavailable."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True)\
+                         .stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(history_file):
+    if not os.path.isfile(history_file):
+        return []
+    with open(history_file) as fobj:
+        return json.load(fobj)
+
+
+def write_history(history_file, history):
+    tmp_file = history_file + '.tmp'
+    with open(tmp_file, 'w') as output:
+        json.dump(history, output, indent=2)
+    os.replace(tmp_file, history_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=DEFAULT_SCALES,
+                        help='problem sizes to run, e.g., 1000 1000000')
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS),
+                        help='benchmarks to run')
+    parser.add_argument('--history', default='benchmark_history.json',
+                        help='JSON file of previous results')
+    parser.add_argument('--workdir', default=None,
+                        help='directory for the synthetic inputs')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes for the parallel functions')
+    parser.add_argument('--max_files', type=int, default=10000,
+                        help='maximum number of metadata files to write')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown factor flagged as a regression')
+    parser.add_argument('--min_delta', type=float, default=0.05,
+                        help='minimum slowdown (s) flagged as a regression')
+    parser.add_argument('--no_record', action='store_true',
+                        help="don't append the results to the history")
+    parser.add_argument('--fail_on_regression', action='store_true',
+                        help='exit with status 1 if there are regressions')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show the output of the benchmarked functions')
+    options = parser.parse_args(argv)
+
+    history = read_history(options.history)
+    with fake_butler():
+        results = run_benchmarks(options.benchmarks, options.scales, options,
+                                 workdir=options.workdir)
+
+    regressions = find_regressions(results, history,
+                                   threshold=options.threshold,
+                                   min_delta=options.min_delta)
+    for name, scale, seconds, best in regressions:
+        print(f'REGRESSION: {name} at scale {scale}: {seconds:.3f} s vs. '
+              f'best {best:.3f} s', flush=True)
+
+    if not options.no_record:
+        history.append(dict(timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            commit=git_commit(),
+                            python=platform.python_version(),
+                            numpy=np.__version__, pandas=pd.__version__,
+                            processes=options.processes,
+                            results=results))
+        write_history(options.history, history)
+
+    if regressions and options.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
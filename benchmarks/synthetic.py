@@ -0,0 +1,272 @@
+"""
+Generators of synthetic DC2-scale inputs for the benchmarks: a tract
+grid in place of the skymap, an opsim db, an overlaps table, resource
+usage data frames, and a local Butler repo with task metadata, nImage,
+and mergeDet datasets.
+"""
+import os
+import json
+import pickle
+import sqlite3
+import uuid
+import numpy as np
+import pandas as pd
+import yaml
+
+__all__ = ['make_tract_grid', 'write_skymap_cache', 'make_opsim_db',
+           'make_overlaps_db', 'make_coadd_frames', 'make_visit_frame',
+           'make_fake_repo']
+
+
+BANDS = 'ugrizy'
+
+# Tract half-width and spacing in degrees, approximately those of the
+# DC2 rings skymap.
+TRACT_HALF_WIDTH = 0.85
+TRACT_SPACING = 1.5
+
+# Approximate extent of the DC2 region.
+DC2_RA_RANGE = (50., 75.)
+DC2_DEC_RANGE = (-45., -27.)
+
+
+def make_tract_grid(ra_range=DC2_RA_RANGE, dec_range=DC2_DEC_RANGE,
+                    spacing=TRACT_SPACING, half_width=TRACT_HALF_WIDTH):
+    """
+    Make a grid of square tracts covering a region of the sky, with
+    rings of constant declination.
+
+    Returns
+    -------
+    (np.array, np.array, np.array, np.array) Tract ids, center RAs and
+    Decs (degrees), and (num_tracts, 4, 3) arrays of vertex unit
+    vectors.
+    """
+    # Imported here, since desc.drp_tools needs lsst.daf.butler, which
+    # may be the stand-in from fake_butler.
+    from desc.drp_tools.sky_geometry import tangent_plane_polygons
+    ra, dec = [], []
+    for dec0 in np.arange(dec_range[0], dec_range[1] + spacing/2, spacing):
+        dra = spacing/np.cos(np.radians(dec0))
+        ra.extend(np.arange(ra_range[0], ra_range[1] + dra/2, dra))
+        dec.extend([dec0]*(len(ra) - len(dec)))
+    ra, dec = np.array(ra), np.array(dec)
+    offsets = half_width*np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)])
+    vertices = tangent_plane_polygons(ra, dec, offsets)
+    return np.arange(len(ra)), ra, dec, vertices
+
+
+def write_skymap_cache(cache_file, tract_grid):
+    """
+    Write a tract grid in the skymap_cache .npz format, so that it is
+    used by load_skymap_geometry in place of a pickled skymap.
+    """
+    tract_ids, ra, dec, vertices = tract_grid
+    np.savez(cache_file, tract_ids=tract_ids, ra=ra, dec=dec,
+             vertices=vertices, source_mtime=0., source_size=0,
+             source_sha256='')
+
+
+def make_opsim_db(db_file, num_visits, tract_grid, seed=0):
+    """
+    Write an opsim db with num_visits visits dithered over the tract
+    grid, with both the Summary table of the DC2 minion_1016 opsim
+    db and the observations table of the baseline_v2 opsim dbs.
+    """
+    rng = np.random.default_rng(seed)
+    _, tract_ra, tract_dec, _ = tract_grid
+    index = rng.integers(0, len(tract_ra), num_visits)
+    ra = tract_ra[index] + rng.uniform(-1, 1, num_visits)
+    dec = tract_dec[index] + rng.uniform(-1, 1, num_visits)
+    mjd = 59580 + np.sort(rng.uniform(0, 3650, num_visits))
+    band = np.array(list(BANDS))[rng.integers(0, 6, num_visits)]
+    visit = np.arange(num_visits)
+    with sqlite3.connect(db_file) as con:
+        pd.DataFrame(dict(obsHistID=visit, descDitheredRA=np.radians(ra),
+                          descDitheredDec=np.radians(dec), propID=54,
+                          expMJD=mjd, filter=band))\
+          .to_sql('Summary', con, index=False, if_exists='replace')
+        pd.DataFrame(dict(observationId=visit, fieldRA=ra, fieldDec=dec,
+                          proposalId=1, observationStartMJD=mjd,
+                          filter=band))\
+          .to_sql('observations', con, index=False, if_exists='replace')
+
+
+def make_overlaps_db(db_file, num_rows, num_tracts=40, seed=0):
+    """
+    Write an 'overlaps' table of (visit, detector, tract, patch) rows,
+    as used by SfpYamlFactory, with about 10 detector-patch rows per
+    visit.
+    """
+    rng = np.random.default_rng(seed)
+    num_visits = max(num_rows//10, 1)
+    df = pd.DataFrame(dict(visit=rng.integers(0, num_visits, num_rows),
+                           detector=rng.integers(0, 189, num_rows),
+                           tract=rng.integers(0, num_tracts, num_rows),
+                           patch=rng.integers(0, 49, num_rows)))
+    with sqlite3.connect(db_file) as con:
+        df.to_sql('overlaps', con, index=False, if_exists='replace')
+
+
+def make_coadd_frames(num_rows, num_tracts=3, seed=0):
+    """
+    Make a coadd-level resource usage data frame with num_rows rows,
+    and the matching nImage and merged detection data frames.
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame, pd.DataFrame) The coadd, nImage, and
+    merged detection data frames.
+    """
+    rng = np.random.default_rng(seed)
+    tracts = np.arange(3828, 3828 + num_tracts)
+    df_nImage = pd.DataFrame(
+        [(coadd_type, band, tract, patch, float(rng.integers(1, 40)),
+          int(rng.integers(1, 60)))
+         for coadd_type in ('deep', 'goodSeeing') for band in BANDS
+         for tract in tracts for patch in range(49)],
+        columns=['coadd_type', 'band', 'tract', 'patch', 'n_median',
+                 'n_max'])
+    df_merged_det = pd.DataFrame(
+        [(tract, patch, int(rng.integers(100, 5000)))
+         for tract in tracts for patch in range(49)],
+        columns=['tract', 'patch', 'n_det'])
+    tasks = np.array(['makeWarp', 'assembleCoadd', 'templateGen', 'deblend',
+                      'mergeDetections', 'healSparsePropertyMaps'],
+                     dtype=object)
+    task = tasks[rng.integers(0, len(tasks), num_rows)]
+    band = np.array(list(BANDS), dtype=object)[rng.integers(0, 6, num_rows)]
+    band[np.isin(task, ['deblend', 'mergeDetections'])] = None
+    patch = pd.array(rng.integers(0, 49, num_rows), dtype='Int64')
+    n_max = rng.integers(1, 60, num_rows).astype(float)
+    df_coadd = pd.DataFrame({
+        'tract': tracts[rng.integers(0, num_tracts, num_rows)],
+        'patch': patch,
+        'task': pd.Series(task, dtype=object),
+        'maxRSS (GB)': 0.1*n_max + rng.random(num_rows),
+        'wall_time': n_max*rng.random(num_rows),
+        'cpu_time (m)': n_max*rng.random(num_rows),
+        'band': pd.Series(band, dtype=object)})
+    return df_coadd, df_nImage, df_merged_det
+
+
+def make_visit_frame(num_rows, seed=0):
+    """Make a visit-level resource usage data frame."""
+    rng = np.random.default_rng(seed)
+    tasks = np.array(['isr', 'characterizeImage', 'calibrate'], dtype=object)
+    return pd.DataFrame({
+        'detector': pd.array(rng.integers(0, 189, num_rows), dtype='Int64'),
+        'visit': rng.integers(0, max(num_rows//189, 1), num_rows),
+        'task': pd.Series(tasks[rng.integers(0, 3, num_rows)], dtype=object),
+        'maxRSS (GB)': 1 + rng.random(num_rows),
+        'wall_time': 2*rng.random(num_rows),
+        'cpu_time (m)': 2*rng.random(num_rows),
+        'band': pd.Series(np.array(list(BANDS), dtype=object)
+                          [rng.integers(0, 6, num_rows)], dtype=object)})
+
+
+def _task_metadata(rng):
+    """Task metadata in the TaskMetadata JSON serialization layout."""
+    metadata = {}
+    for subtask in ('quantum', 'task', 'task:subtask'):
+        metadata[subtask] = dict(scalars={}, arrays={}, metadata={})
+    for subtask in ('task', 'task:subtask'):
+        metadata[subtask]['scalars'].update(
+            startMaxResidentSetSize=int(rng.integers(1, 4))*1024**3,
+            endMaxResidentSetSize=int(rng.integers(1, 8))*1024**3)
+    metadata['task']['arrays']['prepMaxResidentSetSize'] \
+        = [int(_)*1024**3 for _ in rng.integers(1, 9, 3)]
+    metadata['quantum']['scalars'].update(
+        startCpuTime=0., endCpuTime=float(rng.uniform(60, 600)),
+        startUserTime=0., endUserTime=float(rng.uniform(60, 600)),
+        endMaxResidentSetSize=int(rng.integers(1, 9))*1024**3)
+    return dict(scalars={}, arrays={}, metadata=metadata)
+
+
+def _fits_table(num_rows, row_size=8):
+    """
+    Bytes of a FITS file with an empty primary HDU and a binary table
+    of num_rows rows with a single 8-byte integer column.
+    """
+    def header(cards):
+        text = ''.join(f'{key:8s}= {value:>20}'.ljust(80)
+                       for key, value in cards) + 'END'.ljust(80)
+        return text.ljust(-(-len(text)//2880)*2880).encode('ascii')
+    primary = header([('SIMPLE', 'T'), ('BITPIX', 8), ('NAXIS', 0),
+                      ('EXTEND', 'T')])
+    table = header([('XTENSION', "'BINTABLE'"), ('BITPIX', 8),
+                    ('NAXIS', 2), ('NAXIS1', row_size),
+                    ('NAXIS2', num_rows), ('PCOUNT', 0), ('GCOUNT', 1),
+                    ('TFIELDS', 1), ('TTYPE1', "'id'"), ('TFORM1', "'K'")])
+    size = row_size*num_rows
+    return primary + table + bytes(size + (-size % 2880))
+
+
+def _serialize_metadata(md, ext):
+    """Serialize task metadata in the format given by the extension."""
+    if ext == '.yaml':
+        return yaml.safe_dump(md).encode()
+    if ext == '.pickle':
+        return pickle.dumps(md)
+    return json.dumps(md).encode()
+
+
+def make_fake_repo(repo, num_metadata, num_tracts=2, tasks=None, seed=0,
+                   nimage_shape=(100, 100), metadata_formats=('.json',),
+                   runs=('fake_run',)):
+    """
+    Write a local repo for FakeButler with num_metadata task metadata
+    datasets divided among the tasks, plus nImage and mergeDet
+    datasets for num_tracts tracts.  The metadata files cycle through
+    metadata_formats, e.g., ('.json', '.yaml', '.pickle'), where
+    .pickle files can only be read with FakeButler.getDirect.  The
+    metadata datasets are assigned to the run collections in runs in
+    turn.  The datasets are listed in a manifest.json file in the repo
+    directory.
+    """
+    if tasks is None:
+        tasks = {'isr': 'visit', 'calibrate': 'visit',
+                 'makeWarp': 'coadd', 'assembleCoadd': 'coadd'}
+    rng = np.random.default_rng(seed)
+    os.makedirs(repo, exist_ok=True)
+    datasets = []
+
+    def add(dstype, data_id, data, ext, run=runs[0]):
+        dataset_id = str(uuid.UUID(int=len(datasets) + 1))
+        path = os.path.join(dstype, f'{dataset_id}{ext}')
+        os.makedirs(os.path.join(repo, dstype), exist_ok=True)
+        full_path = os.path.join(repo, path)
+        if ext == '.npy':
+            np.save(full_path, data)
+        else:
+            with open(full_path, 'wb') as output:
+                output.write(data)
+        datasets.append(dict(id=dataset_id, dstype=dstype,
+                             data_id=data_id, path=path, run=run))
+
+    per_task = -(-num_metadata//len(tasks))
+    for task, frame in tasks.items():
+        for i in range(per_task):
+            if frame == 'visit':
+                data_id = dict(visit=i//189, detector=i % 189,
+                               band=BANDS[(i//189) % 6])
+            else:
+                data_id = dict(tract=3828 + (i//49) % num_tracts,
+                               patch=i % 49, band=BANDS[i % 6])
+            ext = metadata_formats[len(datasets) % len(metadata_formats)]
+            add(f'{task}_metadata', data_id,
+                _serialize_metadata(_task_metadata(rng), ext), ext,
+                run=runs[len(datasets) % len(runs)])
+    for tract in range(3828, 3828 + num_tracts):
+        for patch in range(49):
+            for coadd_type in ('deep', 'goodSeeing'):
+                for band in BANDS:
+                    image = rng.integers(0, rng.integers(2, 40),
+                                         size=nimage_shape, dtype=np.uint16)
+                    add(f'{coadd_type}Coadd_nImage',
+                        dict(tract=tract, patch=patch, band=band), image,
+                        '.npy')
+            add('deepCoadd_mergeDet', dict(tract=tract, patch=patch),
+                _fits_table(int(rng.integers(100, 5000))), '.fits')
+    with open(os.path.join(repo, 'manifest.json'), 'w') as output:
+        json.dump(datasets, output)
@@ -1,3 +1,16 @@
 from .sfp_utils import *
 from .get_resource_usage import *
 from .resource_usage_plots import *
+from .sky_geometry import *
+from .tract_index import *
+from .overlap_db import *
+from .skymap_cache import *
+from .resource_usage_cache import *
+from .columnar import *
+from .metadata_extraction import *
+from .fits_headers import *
+from .resource_fits import *
+from .dp_sizes import *
+from .storage_projection import *
+from .batch_driver import *
+from .resource_model import *
@@ -0,0 +1,191 @@
+"""
+Checkpointed driver for long-running batch computations, such as the
+overlap simulations, that produce a data frame per batch of items.
+Each batch is written as a parquet shard and recorded in a manifest,
+so that a re-run only processes the batches that are missing.
+"""
+import os
+import json
+import functools
+import multiprocessing
+import pandas as pd
+import pyarrow.parquet as pq
+from .overlap_db import bulk_load_connection, create_overlap_indexes, \
+    finalize_overlap_db
+
+__all__ = ['BatchManifest', 'run_batches', 'compact_shards']
+
+
+class BatchManifest:
+    """
+    JSON manifest of the shards written by run_batches.  Each entry,
+    keyed by shard file name, has the item range of the batch and the
+    number of rows in the shard.
+    """
+    def __init__(self, output_dir, filename='manifest.json'):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, filename)
+        self.shards = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as fobj:
+                self.shards = json.load(fobj)
+
+    def is_valid(self, shard, imin, imax):
+        """
+        Check if a shard for the batch [imin, imax) is in the manifest,
+        and that the file exists with the recorded number of rows.
+        """
+        entry = self.shards.get(shard, None)
+        if entry is None or (entry['imin'], entry['imax']) != (imin, imax):
+            return False
+        try:
+            num_rows = pq.ParquetFile(os.path.join(self.output_dir, shard))\
+                         .metadata.num_rows
+        except (OSError, ValueError):
+            return False
+        return num_rows == entry['num_rows']
+
+    def add(self, shard, imin, imax, num_rows):
+        """Add a shard and write the manifest."""
+        self.shards[shard] = dict(imin=imin, imax=imax, num_rows=num_rows)
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as output:
+            json.dump(self.shards, output, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.path)
+
+    def shard_files(self):
+        """Paths of the shard files in item order."""
+        return [os.path.join(self.output_dir, shard) for shard in
+                sorted(self.shards, key=lambda _: self.shards[_]['imin'])]
+
+
+def _shard_name(imin, imax):
+    return f'shard_{imin:08d}_{imax:08d}.parq'
+
+
+def _run_batch(func, output_dir, batch):
+    """
+    Process a batch of items and write the result to a parquet shard
+    under a temporary name that is renamed once it is complete.
+
+    Returns
+    -------
+    (str, int, int, int) The shard name, the item range, and the
+    number of rows, or (None, imin, imax, str) with the error message
+    if func raised an exception.
+    """
+    imin, imax, items = batch
+    try:
+        df = func(items)
+    except Exception as eobj:
+        # Let the other batches run, and report the failures at the end.
+        return None, imin, imax, repr(eobj)
+    shard = _shard_name(imin, imax)
+    tmp_file = os.path.join(output_dir, f'.{shard}.tmp')
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, os.path.join(output_dir, shard))
+    return shard, imin, imax, len(df)
+
+
+def run_batches(func, items, output_dir, batch_size=500, processes=1):
+    """
+    Apply func to consecutive batches of items in a pool of processes,
+    writing each resulting data frame to a parquet shard in output_dir.
+    Batches with valid shards in the manifest from a previous run are
+    skipped.  If any batches fail, a RuntimeError is raised after all
+    of the other batches have been processed.
+
+    Parameters
+    ----------
+    func : callable
+        Module-level function that takes a list of items and returns a
+        pd.DataFrame.
+    items : list
+        Items to process, e.g., visits.  The batches are defined by
+        the positions of the items, so the same list should be used
+        when resuming.
+    output_dir : str
+        Directory for the shards and manifest.
+    batch_size : int [500]
+        Number of items per batch.
+    processes : int [1]
+        Number of processes to use.
+
+    Returns
+    -------
+    BatchManifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BatchManifest(output_dir)
+    batches = []
+    for imin in range(0, len(items), batch_size):
+        imax = min(imin + batch_size, len(items))
+        if not manifest.is_valid(_shard_name(imin, imax), imin, imax):
+            batches.append((imin, imax, items[imin:imax]))
+    num_batches = (len(items) + batch_size - 1)//batch_size
+    print(f'{num_batches - len(batches)} of {num_batches} batches done, '
+          f'{len(batches)} to run', flush=True)
+
+    failures = []
+
+    def add_result(shard, imin, imax, value):
+        if shard is None:
+            failures.append((imin, imax))
+            print(f'batch [{imin}, {imax}) failed: {value}', flush=True)
+        else:
+            manifest.add(shard, imin, imax, value)
+            print(shard, flush=True)
+
+    run_batch = functools.partial(_run_batch, func, output_dir)
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes) as pool:
+            for result in pool.imap_unordered(run_batch, batches):
+                add_result(*result)
+    else:
+        for batch in batches:
+            add_result(*run_batch(batch))
+    if failures:
+        raise RuntimeError(f'{len(failures)} batches failed: {failures}. '
+                           'Re-run to process the missing batches.')
+    return manifest
+
+
+def compact_shards(output_dir, db_file, table='overlaps',
+                   index_columns=('tract', 'visit'), finalize=True):
+    """
+    Load the shards listed in the manifest into a single sqlite3 table,
+    replacing any existing table of that name, and index it.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory with the shards and manifest written by run_batches.
+    db_file : str
+        sqlite3 db file for the table.
+    table : str ['overlaps']
+        Name of the table.
+    index_columns : (str, str) [('tract', 'visit')]
+        Columns to index with create_overlap_indexes, or None for no
+        indexes.
+    finalize : bool [True]
+        Flag to run finalize_overlap_db on the db file.
+
+    Returns
+    -------
+    int The number of rows in the table.
+    """
+    manifest = BatchManifest(output_dir)
+    num_rows = 0
+    with bulk_load_connection(db_file) as con:
+        con.execute(f'drop table if exists {table}')
+        for shard_file in manifest.shard_files():
+            df = pd.read_parquet(shard_file)
+            df.to_sql(table, con, if_exists='append', index=False)
+            num_rows += len(df)
+    if index_columns is not None and manifest.shards:
+        create_overlap_indexes(db_file, table, columns=index_columns)
+    if finalize:
+        finalize_overlap_db(db_file)
+    print(f'{num_rows} rows in {table} from '
+          f'{len(manifest.shards)} shards', flush=True)
+    return num_rows
@@ -0,0 +1,164 @@
+"""
+Typed, preallocated column storage for accumulating table rows, and a
+parquet writer that appends data frames to a dataset directory as
+they are produced.
+"""
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+__all__ = ['ColumnAccumulator', 'ParquetPartWriter']
+
+
+# Mapping of the supported column dtypes to numpy storage dtypes and
+# arrow types.  'Int64' is the pandas nullable integer dtype.
+_NUMPY_DTYPES = {'int64': np.int64, 'Int64': np.int64, 'float64': np.float64,
+                 'object': object}
+_ARROW_TYPES = {'int64': pa.int64(), 'Int64': pa.int64(),
+                'float64': pa.float64(), 'object': pa.string()}
+
+
+class ColumnAccumulator:
+    """
+    Accumulate rows in preallocated numpy arrays with fixed dtypes,
+    one per column.  The arrays are doubled in size as needed.
+    Supported dtypes are 'int64', 'Int64' (nullable int64), 'float64'
+    (None is stored as NaN), and 'object' (for strings).
+    """
+    def __init__(self, dtypes, capacity=1024):
+        """
+        Parameters
+        ----------
+        dtypes : dict
+            Dictionary of dtypes keyed by column name, in column order.
+        capacity : int [1024]
+            Initial number of rows to allocate.
+        """
+        for column, dtype in dtypes.items():
+            if dtype not in _NUMPY_DTYPES:
+                raise ValueError(f'Unsupported dtype {dtype} for {column}')
+        self.dtypes = dict(dtypes)
+        self._initial_capacity = capacity
+        self.clear()
+
+    def clear(self):
+        """Remove all rows and release the storage."""
+        self.size = 0
+        self._capacity = self._initial_capacity
+        self._values = {column: np.empty(self._capacity,
+                                         dtype=_NUMPY_DTYPES[dtype])
+                        for column, dtype in self.dtypes.items()}
+        self._masks = {column: np.zeros(self._capacity, dtype=bool)
+                       for column, dtype in self.dtypes.items()
+                       if dtype == 'Int64'}
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        self._capacity *= 2
+        for column, values in self._values.items():
+            self._values[column] = np.resize(values, self._capacity)
+        for column, mask in self._masks.items():
+            self._masks[column] = np.resize(mask, self._capacity)
+
+    def append(self, row):
+        """Append a row, given as a sequence of values in column order."""
+        if self.size == self._capacity:
+            self._grow()
+        i = self.size
+        for column, value in zip(self.dtypes, row):
+            if column in self._masks:
+                self._masks[column][i] = value is None
+                self._values[column][i] = 0 if value is None else value
+            elif value is None and self.dtypes[column] == 'float64':
+                self._values[column][i] = np.nan
+            else:
+                self._values[column][i] = value
+        self.size += 1
+
+    def to_frame(self):
+        """Return a data frame with copies of the accumulated rows."""
+        data = {}
+        for column, dtype in self.dtypes.items():
+            values = self._values[column][:self.size].copy()
+            if column in self._masks:
+                mask = self._masks[column][:self.size].copy()
+                data[column] = pd.arrays.IntegerArray(values, mask)
+            else:
+                data[column] = values
+        return pd.DataFrame(data)
+
+    def arrow_schema(self):
+        """Arrow schema for the accumulated columns."""
+        return pa.schema([(column, _ARROW_TYPES[dtype])
+                          for column, dtype in self.dtypes.items()])
+
+
+class ParquetPartWriter:
+    """
+    Write data frames as numbered parquet files in a dataset directory.
+    Each part file is written under a hidden temporary name and then
+    renamed, so the directory can be read with pd.read_parquet at any
+    time while it is being written.
+    """
+    def __init__(self, directory, schema, append=False):
+        """
+        Parameters
+        ----------
+        directory : str
+            Output directory.
+        schema : pyarrow.Schema
+            Schema to use for all of the part files.
+        append : bool [False]
+            If True, keep the part files from previous runs and number
+            the new part files after them.  Otherwise, the existing
+            part files are removed.
+
+        Raises
+        ------
+        FileExistsError if directory is an existing file, e.g., a single
+        parquet file written by an earlier version of the code.
+        """
+        if os.path.isfile(directory):
+            raise FileExistsError(f'{directory} is a file, not a parquet '
+                                  'dataset directory.  Remove or rename it '
+                                  'to write the output.')
+        self.directory = directory
+        self.schema = schema
+        self.num_parts = 0
+        os.makedirs(directory, exist_ok=True)
+        for part_file in sorted(self.part_files()):
+            if append:
+                basename = os.path.basename(part_file)
+                self.num_parts = int(basename[len('part-'):-len('.parq')]) + 1
+            else:
+                os.remove(part_file)
+
+    def part_files(self):
+        """The part files currently in the output directory."""
+        return glob.glob(os.path.join(self.directory, 'part-*.parq'))
+
+    def read(self):
+        """
+        Read the part files into a data frame, which is empty if there
+        are no part files.
+        """
+        if not self.part_files():
+            return self.schema.empty_table().to_pandas()
+        return pd.read_parquet(self.directory)
+
+    def write(self, df):
+        """Write a data frame as the next part file."""
+        if len(df) == 0:
+            return
+        basename = f'part-{self.num_parts:05d}.parq'
+        tmp_file = os.path.join(self.directory, f'.{basename}.tmp')
+        table = pa.Table.from_pandas(df, schema=self.schema,
+                                     preserve_index=False)
+        pq.write_table(table, tmp_file)
+        os.replace(tmp_file, os.path.join(self.directory, basename))
+        self.num_parts += 1
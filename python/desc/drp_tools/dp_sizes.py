@@ -0,0 +1,266 @@
+"""
+Tools for tabulating the file sizes of the data products produced by
+the tasks in a QuantumGraph, using example files in a data repository.
+"""
+import json
+import random
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import lsst.daf.butler as daf_butler
+
+__all__ = ['SizeStats', 'output_dataset_types', 'dataset_uris',
+           'dataset_size_stats', 'size_stats_table',
+           'tabulate_data_product_sizes']
+
+
+class SizeStats:
+    """
+    Running statistics of a sequence of values.  The mean and variance
+    are accumulated with Welford's algorithm, and a fixed-size
+    reservoir sample of the values is kept for estimating quantiles.
+    NaN values are ignored.
+    """
+    def __init__(self, reservoir_size=1000, seed=None):
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self.reservoir_size = reservoir_size
+        self.reservoir = []
+        self._rng = random.Random(seed)
+
+    def add(self, value):
+        """Add a value to the statistics."""
+        if value != value:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self._m2 += delta*(value - self.mean)
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(value)
+        else:
+            index = self._rng.randrange(self.count)
+            if index < self.reservoir_size:
+                self.reservoir[index] = value
+
+    @property
+    def variance(self):
+        """
+        Sample variance of the values, as for np.var with ddof=1, or
+        NaN if there are fewer than two values.
+        """
+        if self.count < 2:
+            return np.nan
+        return self._m2/(self.count - 1)
+
+    @property
+    def std(self):
+        """
+        Sample standard deviation of the values, as for np.std with
+        ddof=1, or NaN if there are fewer than two values.
+        """
+        return np.sqrt(self.variance)
+
+    def quantiles(self, q):
+        """Estimates of the quantiles q from the reservoir sample."""
+        if not self.reservoir:
+            return np.full(len(q), np.nan)
+        return np.quantile(self.reservoir, q)
+
+
+def output_dataset_types(qgraph):
+    """
+    Find the output dataset types of each task in a QuantumGraph.
+
+    Returns
+    -------
+    dict of sets of dataset type names keyed by task label.
+    """
+    dstypes = defaultdict(set)
+    for node in qgraph:
+        task = node.taskDef.label
+        for dstype in node.quantum.outputs:
+            dstypes[task].add(dstype.name)
+    return dict(dstypes)
+
+
+def _artifact_uris(primary_uri, component_uris):
+    """
+    URIs of the files of a dataset: the primary URI, or the component
+    URIs if the dataset is a disassembled composite.
+    """
+    if primary_uri is not None:
+        return [primary_uri]
+    return list(component_uris.values())
+
+
+def dataset_uris(butler, dsrefs):
+    """
+    Resolve the URIs of the files for a list of dataset refs.  The
+    datastore is queried for all of the refs at once if it supports
+    getManyURIs.  Disassembled composites have no primary URI, so the
+    URIs of their component files are used.
+
+    Returns
+    -------
+    list of lists of URIs, one list per dataset ref.
+    """
+    get_many_uris = getattr(butler.datastore, 'getManyURIs', None)
+    if get_many_uris is not None:
+        uris = get_many_uris(dsrefs)
+        ref_uris = [uris[_] for _ in dsrefs]
+    elif hasattr(butler, 'getURIs'):
+        ref_uris = [butler.getURIs(_) for _ in dsrefs]
+    else:
+        return [[butler.getURI(_)] for _ in dsrefs]
+    return [_artifact_uris(*_) for _ in ref_uris]
+
+
+def _file_size(uris):
+    """
+    Total size in GB of the files of a dataset, or NaN if any of the
+    files are missing.
+    """
+    if not uris:
+        return np.nan
+    try:
+        return sum(_.size() for _ in uris)/1024**3
+    except FileNotFoundError:
+        return np.nan
+
+
+def dataset_size_stats(butler, dstypes, sample_size=None, threads=16,
+                       reservoir_size=1000, seed=None):
+    """
+    Compute file size statistics (GB) for each dataset type.
+
+    Parameters
+    ----------
+    butler : lsst.daf.butler.Butler
+        Butler pointing at the collection with the example files.
+    dstypes : dict
+        Sets of dataset type names keyed by task label.
+    sample_size : int [None]
+        Number of files to sample per dataset type.  If None, all of
+        the files are used.
+    threads : int [16]
+        Number of threads to use for getting the file sizes.
+    reservoir_size : int [1000]
+        Size of the reservoir sample kept for the quantile estimates.
+    seed : int [None]
+        Random number seed for the file and reservoir sampling.
+
+    Returns
+    -------
+    dict of SizeStats keyed by (task, dataset type).
+    """
+    rng = random.Random(seed)
+    stats = {}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for task, task_dstypes in dstypes.items():
+            for dstype in sorted(task_dstypes):
+                dsrefs = list(set(butler.registry.queryDatasets(dstype)))
+                if sample_size is not None and len(dsrefs) > sample_size:
+                    dsrefs = rng.sample(dsrefs, sample_size)
+                size_stats = SizeStats(reservoir_size=reservoir_size,
+                                       seed=rng.random())
+                for size in executor.map(_file_size,
+                                         dataset_uris(butler, dsrefs)):
+                    size_stats.add(size)
+                stats[(task, dstype)] = size_stats
+                print(task, dstype, size_stats.count, flush=True)
+    return stats
+
+
+def size_stats_table(stats, quantiles=(0.05, 0.5, 0.95)):
+    """
+    Convert a dictionary of SizeStats keyed by (task, dataset type) to
+    a data frame with the number of files and the mean, standard
+    deviation, and quantiles of the file sizes.
+    """
+    rows = []
+    for (task, dstype), size_stats in stats.items():
+        rows.append((task, dstype, size_stats.count, size_stats.mean,
+                     size_stats.std, *size_stats.quantiles(quantiles)))
+    columns = ['task', 'dataset_type', 'num_files', 'mean (GB)', 'std (GB)']
+    columns.extend(f'q{int(round(100*q)):02d} (GB)' for q in quantiles)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def qgraph_node_ids(qgraph_file):
+    """
+    Ids of the nodes in a QuantumGraph file, read from the file header,
+    or None if the file's save version doesn't have them.
+    """
+    # pipe_base is only needed for the QuantumGraph files, so import it
+    # on demand.
+    from lsst.pipe.base.graph import QuantumGraph
+    header = QuantumGraph.readHeader(qgraph_file)
+    if header is None:
+        return None
+    return [uuid.UUID(node_id) for node_id, _ in json.loads(header)['Nodes']]
+
+
+def load_qgraph(qgraph_file, batch_size=10000):
+    """
+    Generator of the QuantumNodes in a QuantumGraph file.  The node ids
+    are read from the file header, and the nodes are loaded batch_size
+    nodes at a time, so that only one batch is in memory at once.  If
+    batch_size is None, or the file header doesn't have the node ids,
+    the whole graph is loaded.
+    """
+    from lsst.pipe.base.graph import QuantumGraph
+    universe = daf_butler.DimensionUniverse()
+    node_ids = None if batch_size is None else qgraph_node_ids(qgraph_file)
+    if node_ids is None:
+        yield from QuantumGraph.loadUri(qgraph_file, universe)
+        return
+    for imin in range(0, len(node_ids), batch_size):
+        yield from QuantumGraph.loadUri(
+            qgraph_file, universe, nodes=node_ids[imin:imin + batch_size])
+
+
+def tabulate_data_product_sizes(qgraph_file, repo, collection,
+                                sample_size=None, threads=16, seed=None,
+                                quantiles=(0.05, 0.5, 0.95),
+                                batch_size=10000):
+    """
+    Tabulate the sizes of data products listed in a QuantumGraph
+    using files in a given repo and collection.
+
+    Parameters
+    ----------
+    qgraph_file : str
+        QuantumGraph file produced by `pipetask qgraph`.
+    repo : str
+        Path to data repository.
+    collection : str
+        Collection in repo to use for finding example data products.
+    sample_size : int [None]
+        Number of example files to use per dataset type.  If None, all
+        of the files are used.
+    threads : int [16]
+        Number of threads to use for getting the file sizes.
+    seed : int [None]
+        Random number seed for the sampling.
+    quantiles : tuple [(0.05, 0.5, 0.95)]
+        File size quantiles to include.
+    batch_size : int [10000]
+        Number of QuantumGraph nodes to load at a time.  See
+        load_qgraph.
+
+    Returns
+    -------
+    pd.DataFrame with the task, dataset type, number of example files,
+    and the mean, standard deviation, and quantiles of the file sizes
+    in GB.
+    """
+    dstypes = output_dataset_types(load_qgraph(qgraph_file,
+                                               batch_size=batch_size))
+    butler = daf_butler.Butler(repo, collections=[collection])
+    stats = dataset_size_stats(butler, dstypes, sample_size=sample_size,
+                               threads=threads, seed=seed)
+    return size_stats_table(stats, quantiles=quantiles)
@@ -3,14 +3,22 @@ Functions to fill visit tract overlap tables for organizing an
 image processing campaign.
 """
 import os
-import pickle
+import time
 import sqlite3
+import argparse
+import multiprocessing
 import numpy as np
 import pandas as pd
-import lsst.geom
+from .sky_geometry import focal_plane_polygons, convex_polygons_intersect
+from .tract_index import TractIndex
+from .skymap_cache import load_skymap_geometry
+from .overlap_db import bulk_load_connection, create_overlap_indexes, \
+    finalize_overlap_db
 
 __all__ = ['fill_visit_table', 'fill_tract_table', 'find_visit_tract_overlaps',
-           'fill_overlap_table', 'update_visit_table']
+           'refine_overlaps', 'fill_overlap_table',
+           'update_visit_table',
+           'find_new_visits', 'update_overlap_tables']
 
 # DC2 tracts, 151 total
 DC2_TRACTS = []
@@ -30,76 +38,112 @@ DC2_TRACTS.extend(range(5062, 5075))
 VISIT_TABLE = 'Visit'
 TRACT_TABLE = 'Tract'
 OVERLAP_TABLE = 'Overlap'
+OVERLAP_SHARD_TABLE = 'OverlapShard'
 
+VISIT_COLUMNS = ['id', 'ra', 'dec', 'band', 'nearest_tract', 'survey_id',
+                 'mjd']
 
-def max_tract_radius(tracts=DC2_TRACTS, skymap_file='/home/DC2/skyMap.pickle'):
+# Table schemas.  The Overlap table has indexes on (tract, visit) and
+# (visit, tract) that are created after the table is filled.
+VISIT_TABLE_SQL = ('create table if not exists {} '
+                   '(id INTEGER PRIMARY KEY, ra REAL, dec REAL, band TEXT, '
+                   'nearest_tract INTEGER, survey_id INT, mjd REAL)')
+OVERLAP_TABLE_SQL = ('create table if not exists {} '
+                     '(id INTEGER PRIMARY KEY, tract INTEGER, visit INTEGER)')
+
+OPSIM_DB = '/home/DC2/minion_1016_desc_dithered_v4_trimmed.db'
+
+
+def max_tract_radius(tracts=DC2_TRACTS, skymap_file='/home/DC2/skyMap.pickle',
+                     cache_file=None):
     """
     Maximum distance (in degrees) from vertex to tract center for the
     list of tracts supplied.  For DC2 tracts, this is 1.1 degrees.
+    The tract geometry is read from the skymap cache file, which is
+    created from the skymap file if needed.
     """
-    with open(skymap_file, 'rb') as fobj:
-        skymap = pickle.load(fobj)
-    max_radius = None
-    for tract_id in DC2_TRACTS:
-        tract = skymap[tract_id]
-        center = tract.ctr_coord
-        for vertex in tract.vertex_list:
-            sep = center.separation(vertex)
-            if max_radius is None or sep > max_radius:
-                max_radius = sep
-    return max_radius.asDegrees()
+    geometry = load_skymap_geometry(skymap_file, cache_file=cache_file)
+    return geometry.subset(tracts).max_radius
 
 
 def fill_tract_table(db_file, skymap_file='/home/DC2/skyMap.pickle',
-                     tract_table=TRACT_TABLE, tract_list=DC2_TRACTS):
+                     tract_table=TRACT_TABLE, tract_list=DC2_TRACTS,
+                     cache_file=None):
     """
     Fill the tract table with the tract ids and tract centers for the
-    provided tract_list.
+    provided tract_list.  The tract geometry is read from the skymap
+    cache file, which is created from the skymap file if needed.
     """
-    with open(skymap_file, 'rb') as fobj:
-        skymap = pickle.load(fobj)
+    geometry = load_skymap_geometry(skymap_file, cache_file=cache_file)\
+        .subset(tract_list)
 
     create_tract_table = (f'create table {tract_table} '
-                          '(id INTEGER, ra REAL, dec REAL)')
-    with sqlite3.connect(db_file) as con:
+                          '(id INTEGER PRIMARY KEY, ra REAL, dec REAL)')
+    with bulk_load_connection(db_file) as con:
         cursor = con.cursor()
         cursor.execute(create_tract_table)
         con.commit()
-        values = []
-        for tract_id in tract_list:
-            tract = skymap[tract_id]
-            coord = tract.getCtrCoord()
-            values.append((tract_id, coord.getLongitude().asDegrees(),
-                           coord.getLatitude().asDegrees()))
+        values = zip(geometry.tract_ids.tolist(), geometry.ra.tolist(),
+                     geometry.dec.tolist())
         cursor.executemany(f'insert into {tract_table} values (?, ?, ?)',
                            values)
         con.commit()
 
 
-def fill_visit_table(db_file, opsim_db='/home/DC2/minion_1016_desc_dithered_v4_trimmed.db', visit_table=VISIT_TABLE):
+def read_opsim_visits(opsim_db=OPSIM_DB, chunksize=100000):
+    """
+    Generator that reads the Summary table of the opsim db in chunks of
+    chunksize rows and yields data frames with the visit table columns.
+    """
+    query = '''select obsHistID, descDitheredRA, descDitheredDec,
+               propID, expMJD, filter from Summary'''
+    with sqlite3.connect(opsim_db) as con:
+        for df in pd.read_sql(query, con, chunksize=chunksize):
+            yield pd.DataFrame(dict(id=df['obsHistID'],
+                                    ra=df['descDitheredRA']*180/np.pi,
+                                    dec=df['descDitheredDec']*180/np.pi,
+                                    band=df['filter'], nearest_tract=0,
+                                    survey_id=df['propID'],
+                                    mjd=df['expMJD']))
+
+
+def fill_visit_table(db_file, opsim_db=OPSIM_DB, visit_table=VISIT_TABLE,
+                     chunksize=100000):
     """
     Fill the visit table with entries from the opsim db and
     provide a column for the nearest tract to use for partitioning
-    the visits for processing.
+    the visits for processing.  The opsim db is read in chunks of
+    chunksize rows, so memory use does not depend on the length of
+    the survey.
+
+    The id column of the visit table is its primary key, so each visit
+    is written once: visits that are already in the visit table, and
+    repeated entries for the same visit in the opsim db, are skipped.
+    The numbers of written and skipped visits are reported.  Previous
+    versions of this function wrote every opsim row.
     """
-    visit_table_sql = (f'create table {visit_table} '
-                       '(id INTEGER, ra REAL, dec REAL, band TEXT, '
-                       'nearest_tract INTEGER, survey_id INT, mjd REAL)')
+    t0 = time.time()
+    num_rows = 0
     with sqlite3.connect(opsim_db) as con:
-        df = pd.read_sql('''select obsHistID, descDitheredRA, descDitheredDec,
-                         propID, expMJD, filter from Summary''', con)
-    with sqlite3.connect(db_file) as con:
+        num_opsim_rows = con.execute('select count(*) from Summary')\
+                            .fetchone()[0]
+    con.close()
+    with bulk_load_connection(db_file) as con:
         cursor = con.cursor()
-        cursor.execute(visit_table_sql)
+        cursor.execute(VISIT_TABLE_SQL.format(visit_table))
         con.commit()
-        values = []
-        for i, row in df.iterrows():
-            values.append((row['obsHistID'], row['descDitheredRA']*180/np.pi,
-                           row['descDitheredDec']*180/np.pi, row['filter'],
-                           0, row['propID'], row['expMJD']))
-        cursor.executemany(f'insert into {visit_table} values '
-                           '(?, ?, ?, ?, ?, ?, ?)', values)
+        for df in iter_new_visits(db_file, opsim_db, visit_table=visit_table,
+                                  chunksize=chunksize):
+            cursor.executemany(f'insert into {visit_table} values '
+                               '(?, ?, ?, ?, ?, ?, ?)',
+                               df.itertuples(index=False, name=None))
+            num_rows += len(df)
         con.commit()
+    dt = time.time() - t0
+    print(f'{num_rows} visits written in {dt:.1f} s '
+          f'({num_rows/max(dt, 1e-6):.0f} rows/s), '
+          f'{num_opsim_rows - num_rows} existing or repeated opsim visits '
+          'skipped', flush=True)
 
 
 def find_visit_tract_overlaps(ra0, dec0, df_tracts, max_sep=3.15):
@@ -107,72 +151,188 @@ def find_visit_tract_overlaps(ra0, dec0, df_tracts, max_sep=3.15):
     Using the maximum separation between an overlapping visit and
     tract, find all tracts overlapping the visit whose center
     coordinate is provided. Also find the closest tract to that center
-    coordinate among all tracts in df_tracts.
-    """
-    dec_min, dec_max = dec0 - max_sep, dec0 + max_sep
-    ra_delta = max_sep/np.cos(dec0*np.pi/180.)
-    ra_min, ra_max = ra0 - ra_delta, ra0 + ra_delta
-    df = df_tracts.query(f'{ra_min} <= ra and ra <= {ra_max} and '
-                         f'{dec_min} <= dec and dec <= {dec_max}')
-    def make_sphere_point(ra, dec):
-        ra_angle = lsst.geom.Angle(ra, lsst.geom.degrees)
-        dec_angle = lsst.geom.Angle(dec, lsst.geom.degrees)
-        return lsst.geom.SpherePoint(ra_angle, dec_angle)
-    visit_center = make_sphere_point(ra0, dec0)
-    min_sep = None
-    tract_overlaps = set()
-    for i, row in df.iterrows():
-        tract_center = make_sphere_point(row.ra, row.dec)
-        sep = visit_center.separation(tract_center).asDegrees()
-        if min_sep is None or sep < min_sep:
-            min_sep = sep
-            closest_tract = row.id
-        if sep <= max_sep:
-            tract_overlaps.add(row.id)
-    if len(df) == 0:
-        for i, row in df_tracts.iterrows():
-            tract_center = make_sphere_point(row.ra, row.dec)
-            sep = visit_center.separation(tract_center).asDegrees()
-            if min_sep is None or sep < min_sep:
-                min_sep = sep
-                closest_tract = row.id
-    return tract_overlaps, closest_tract
+    coordinate among all tracts in df_tracts.  df_tracts may be a
+    TractIndex, which should be used when calling this function for
+    many visits.
+    """
+    if isinstance(df_tracts, TractIndex):
+        tract_index = df_tracts
+    else:
+        tract_index = TractIndex.from_dataframe(df_tracts)
+    _, index = tract_index.query_radius(ra0, dec0, max_sep)
+    tract_overlaps = set(tract_index.tract_ids[index].tolist())
+    closest = tract_index.nearest(ra0, dec0)[0][0]
+    return tract_overlaps, tract_index.tract_ids[closest].item()
+
+
+def refine_overlaps(visit_ra, visit_dec, visit_index, tract_index,
+                    tract_vertices, visit_rot=None, chunk_size=100000):
+    """
+    Apply an exact overlap test to candidate visit-tract pairs, such as
+    those found with TractIndex.find_overlaps, by intersecting the
+    visit focal plane footprints with the tract polygons.
+
+    Parameters
+    ----------
+    visit_ra, visit_dec : array-like
+        Visit center coordinates in degrees.
+    visit_index, tract_index : np.array
+        Indexes of the candidate pairs into the visit arrays and into
+        tract_vertices.
+    tract_vertices : np.array
+        (num_tracts, num_vertices, 3) array of tract vertex unit
+        vectors, e.g., from SkymapGeometry.vertices.
+    visit_rot : array-like [None]
+        Visit rotation angles in degrees.  If None, the footprints
+        enclose the LSSTCam focal plane at any rotation angle.
+    chunk_size : int [100000]
+        Number of pairs to test at a time.
+
+    Returns
+    -------
+    np.array of bools selecting the overlapping pairs.
+    """
+    footprints = focal_plane_polygons(visit_ra, visit_dec, rot=visit_rot)
+    keep = np.zeros(len(visit_index), dtype=bool)
+    for imin in range(0, len(visit_index), chunk_size):
+        imax = imin + chunk_size
+        keep[imin:imax] = convex_polygons_intersect(
+            footprints[visit_index[imin:imax]],
+            tract_vertices[tract_index[imin:imax]])
+    return keep
+
+
+# Tract index and tract vertices for the worker processes used by
+# fill_overlap_table.  These are set once per worker by the pool
+# initializer so that the tract arrays aren't sent along with each
+# shard of visits.
+_TRACT_INDEX = None
+_TRACT_VERTICES = None
+
+
+def _init_overlap_worker(tract_ids, tract_ra, tract_dec, tract_vertices):
+    global _TRACT_INDEX, _TRACT_VERTICES
+    _TRACT_INDEX = TractIndex(tract_ids, tract_ra, tract_dec)
+    _TRACT_VERTICES = tract_vertices
+
+
+def _find_shard_overlaps(shard_args):
+    """
+    Find the visit-tract overlaps for one shard of visits using the
+    worker's tract index, refining the overlaps with the tract polygons
+    if the worker has the tract vertices.
+    """
+    shard, visit_ra, visit_dec, max_sep = shard_args
+    t0 = time.time()
+    visit_index, tract_index, closest \
+        = _TRACT_INDEX.find_overlaps(visit_ra, visit_dec, max_sep=max_sep,
+                                     chunk_size=len(visit_ra))
+    num_candidates = len(visit_index)
+    if _TRACT_VERTICES is not None:
+        keep = refine_overlaps(visit_ra, visit_dec, visit_index,
+                               tract_index, _TRACT_VERTICES)
+        visit_index, tract_index = visit_index[keep], tract_index[keep]
+    return (shard, visit_index, tract_index, closest, num_candidates,
+            os.getpid(), time.time() - t0)
 
 
 def fill_overlap_table(db_file, overlap_table=OVERLAP_TABLE,
                        visit_table=VISIT_TABLE, tract_table=TRACT_TABLE,
-                       max_sep=3.15):
+                       max_sep=3.15, processes=1, shard_size=100000,
+                       shard_table=OVERLAP_SHARD_TABLE, geometry=None):
     """
     Fill the Overlap table which lists all of the potential overlapping
     visit-tract pairs.  Also provide the dict of closest tracts for each
     visit.
+
+    The visits are divided into shards of shard_size visits which are
+    distributed over a pool of processes.  Shard results are written in
+    shard order, so the overlap ids do not depend on the number of
+    processes.  The time spent on each shard is written to the
+    shard_table.
+
+    If the SkymapGeometry of the tracts is provided, the pairs with
+    centers within max_sep of each other are refined with an exact
+    test of the visit focal plane footprint against the tract polygon,
+    and the numbers of pairs before and after refinement are reported.
+
+    The overlap table must be empty or absent, since its ids start at
+    0.  Use update_overlap_tables to add overlaps for new visits to a
+    filled db.  A RuntimeError is raised if the table has rows.
     """
-    overlap_table_sql = (f'create table if not exists {overlap_table} '
-                         '(id INTEGER, tract INTEGER, visit INTEGER)')
-    with sqlite3.connect(db_file) as con:
-        df_visits = pd.read_sql(f'select * from {visit_table}', con)
-        df_tracts = pd.read_sql(f'select * from {tract_table}', con)
+    shard_table_sql = (f'create table {shard_table} '
+                       '(shard INTEGER PRIMARY KEY, '
+                       'first_visit_index INTEGER, '
+                       'num_visits INTEGER, num_candidates INTEGER, '
+                       'num_overlaps INTEGER, pid INTEGER, '
+                       'elapsed_time REAL)')
+    with bulk_load_connection(db_file) as con:
+        if (table_exists(con, overlap_table) and
+                con.execute(f'select 1 from {overlap_table} limit 1')
+                .fetchone() is not None):
+            raise RuntimeError(f'{overlap_table} table in {db_file} is not '
+                               'empty.  Use update_overlap_tables to add new '
+                               'visits, or drop the table to rebuild it.')
+        df_visits = pd.read_sql(f'select id, ra, dec from {visit_table}', con)
+        df_tracts = pd.read_sql(f'select id, ra, dec from {tract_table}', con)
         cursor = con.cursor()
-        cursor.execute(overlap_table_sql)
+        cursor.execute(OVERLAP_TABLE_SQL.format(overlap_table))
+        cursor.execute(f'drop table if exists {shard_table}')
+        cursor.execute(shard_table_sql)
         con.commit()
-        values = []
-        id_ = 0
+        visit_ids = df_visits['id'].to_numpy()
+        tract_ids = df_tracts['id'].to_numpy()
+        visit_ra = df_visits['ra'].to_numpy()
+        visit_dec = df_visits['dec'].to_numpy()
+        tract_vertices = None if geometry is None \
+            else geometry.subset(tract_ids.tolist()).vertices
+        initargs = (tract_ids, df_tracts['ra'].to_numpy(),
+                    df_tracts['dec'].to_numpy(), tract_vertices)
+        shards = [(shard, visit_ra[imin:imin + shard_size],
+                   visit_dec[imin:imin + shard_size], max_sep)
+                  for shard, imin in
+                  enumerate(range(0, len(visit_ids), shard_size))]
+
         closest_tracts = dict()
-        num_visits = len(df_visits)
-        for i, visit in df_visits.iterrows():
-            if i % (num_visits//5) == 0:
-                print('!', end='', flush=True)
-            elif i % (num_visits//20) == 0:
-                print('.', end='', flush=True)
-            tract_overlaps, closest_tract \
-                = find_visit_tract_overlaps(visit['ra'], visit['dec'],
-                                            df_tracts, max_sep=max_sep)
-            closest_tracts[visit['id']] = closest_tract
-            for tract in tract_overlaps:
-                values.append((id_, tract, visit['id']))
-                id_ += 1
-        cursor.executemany((f'insert into {overlap_table} values '
-                           '(?, ?, ?)'), values)
+        id_ = 0
+        total_candidates = 0
+        def insert_shard(shard, visit_index, tract_index, closest,
+                         num_candidates, pid, elapsed_time):
+            nonlocal id_, total_candidates
+            imin = shard*shard_size
+            shard_visits = visit_ids[imin:imin + shard_size]
+            closest_tracts.update(zip(shard_visits.tolist(),
+                                      tract_ids[closest].tolist()))
+            num_overlaps = len(visit_index)
+            values = zip(range(id_, id_ + num_overlaps),
+                         tract_ids[tract_index].tolist(),
+                         shard_visits[visit_index].tolist())
+            cursor.executemany((f'insert into {overlap_table} values '
+                               '(?, ?, ?)'), values)
+            cursor.execute(f'insert into {shard_table} values '
+                           '(?, ?, ?, ?, ?, ?, ?)',
+                           (shard, imin, len(shard_visits), num_candidates,
+                            num_overlaps, pid, elapsed_time))
+            id_ += num_overlaps
+            total_candidates += num_candidates
+            print(f'shard {shard}: {len(shard_visits)} visits, '
+                  f'{num_overlaps} overlaps, {elapsed_time:.2f} s',
+                  flush=True)
+
+        if processes > 1:
+            with multiprocessing.Pool(processes=processes,
+                                      initializer=_init_overlap_worker,
+                                      initargs=initargs) as pool:
+                for result in pool.imap(_find_shard_overlaps, shards):
+                    insert_shard(*result)
+        else:
+            _init_overlap_worker(*initargs)
+            for shard_args in shards:
+                insert_shard(*_find_shard_overlaps(shard_args))
+    if geometry is not None:
+        print(f'{total_candidates} visit-tract pairs within {max_sep} deg, '
+              f'{id_} after polygon refinement', flush=True)
+    create_overlap_indexes(db_file, overlap_table)
     return closest_tracts
 
 
@@ -180,20 +340,154 @@ def update_visit_table(db_file, closest_tracts, visit_table=VISIT_TABLE):
     """
     Update the visit table with the closest tracts.
     """
-    with sqlite3.connect(db_file) as con:
+    with bulk_load_connection(db_file) as con:
         sql = f'update {visit_table} set nearest_tract=? where id=?'
         values = [(tract, visit) for visit, tract in closest_tracts.items()]
         con.cursor().executemany(sql, values)
         con.commit()
 
 
+def table_exists(con, table):
+    """Check if a table exists in the db for the sqlite3 connection."""
+    query = "select name from sqlite_master where type='table' and name=?"
+    return con.execute(query, (table,)).fetchone() is not None
+
+
+def iter_new_visits(db_file, opsim_db=OPSIM_DB, visit_table=VISIT_TABLE,
+                    chunksize=100000):
+    """
+    Generator that yields data frames, with the visit table columns,
+    of the visits in the opsim db that are not yet in the visit table.
+    Repeated entries for the same visit in the opsim db are skipped.
+    """
+    with sqlite3.connect(db_file) as con:
+        if table_exists(con, visit_table):
+            visits = pd.read_sql(f'select id from {visit_table}',
+                                 con)['id'].to_numpy(dtype=np.int64)
+        else:
+            visits = np.array([], dtype=np.int64)
+    for df in read_opsim_visits(opsim_db, chunksize=chunksize):
+        df = df[~np.isin(df['id'].to_numpy(), visits)]\
+            .drop_duplicates(subset='id')
+        if len(df) > 0:
+            visits = np.concatenate((visits, df['id'].to_numpy()))
+            yield df
+
+
+def find_new_visits(db_file, opsim_db=OPSIM_DB, visit_table=VISIT_TABLE):
+    """
+    Find the visits in the opsim db that are not yet in the visit
+    table, returning them as a data frame with the visit table
+    columns.
+    """
+    dfs = list(iter_new_visits(db_file, opsim_db, visit_table=visit_table))
+    if not dfs:
+        return pd.DataFrame(columns=VISIT_COLUMNS)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def update_overlap_tables(db_file, opsim_db=OPSIM_DB, batch_size=10000,
+                          overlap_table=OVERLAP_TABLE, visit_table=VISIT_TABLE,
+                          tract_table=TRACT_TABLE, max_sep=3.15,
+                          geometry=None):
+    """
+    Add the visits in the opsim db that are missing from the visit
+    table, computing the overlaps and nearest tracts for those visits
+    only.  The tract table must already be filled.
+
+    The opsim db is read, and the new visits are processed, in batches
+    of batch_size.  Each batch of visits is written to the visit table
+    along with its overlaps in a single transaction, so if the job is
+    interrupted, the visit table lists only the visits with complete
+    overlap entries, and re-running this function resumes with the
+    first unprocessed visit.
+
+    If the SkymapGeometry of the tracts is provided, the overlaps are
+    refined as in fill_overlap_table.
+
+    Only visits that are not yet in the visit table are processed, so
+    this function can't be used on a visit table that was filled by
+    fill_visit_table, since the overlaps for those visits would never
+    be computed.  A visit table with rows and an empty overlap table
+    is taken to be such a table, and a RuntimeError is raised.  Use
+    fill_overlap_table for those dbs instead.
+
+    Returns
+    -------
+    int Number of visits added.
+
+    Raises
+    ------
+    RuntimeError if the tract table is missing or if the visit table
+    has rows but the overlap table doesn't.
+    """
+    num_visits = 0
+    with bulk_load_connection(db_file) as con:
+        if not table_exists(con, tract_table):
+            raise RuntimeError(f'{tract_table} table not found in {db_file}')
+        index = TractIndex.from_db(db_file, tract_table=tract_table)
+        cursor = con.cursor()
+        cursor.execute(VISIT_TABLE_SQL.format(visit_table))
+        cursor.execute(OVERLAP_TABLE_SQL.format(overlap_table))
+        con.commit()
+        max_id = cursor.execute(f'select max(id) from {overlap_table}')\
+                       .fetchone()[0]
+        if max_id is None and cursor.execute(
+                f'select 1 from {visit_table} limit 1').fetchone():
+            raise RuntimeError(f'{visit_table} table in {db_file} has '
+                               f'visits, but {overlap_table} is empty, '
+                               'e.g., after fill_visit_table.  Use '
+                               'fill_overlap_table for this db.')
+        id_ = 0 if max_id is None else max_id + 1
+        tract_ids = index.tract_ids
+        tract_vertices = None if geometry is None \
+            else geometry.subset(tract_ids.tolist()).vertices
+        for df in iter_new_visits(db_file, opsim_db, visit_table=visit_table,
+                                  chunksize=batch_size):
+            visit_index, tract_index, closest \
+                = index.find_overlaps(df['ra'], df['dec'], max_sep=max_sep)
+            num_candidates = len(visit_index)
+            if tract_vertices is not None:
+                keep = refine_overlaps(df['ra'], df['dec'], visit_index,
+                                       tract_index, tract_vertices)
+                visit_index, tract_index = visit_index[keep], tract_index[keep]
+            df = df.assign(nearest_tract=tract_ids[closest])
+            visit_ids = df['id'].to_numpy()
+            num_overlaps = len(visit_index)
+            with con:
+                cursor.executemany(f'insert into {visit_table} values '
+                                   '(?, ?, ?, ?, ?, ?, ?)',
+                                   df.itertuples(index=False, name=None))
+                cursor.executemany(f'insert into {overlap_table} values '
+                                   '(?, ?, ?)',
+                                   zip(range(id_, id_ + num_overlaps),
+                                       tract_ids[tract_index].tolist(),
+                                       visit_ids[visit_index].tolist()))
+            id_ += num_overlaps
+            num_visits += len(df)
+            print(f'{num_visits} new visits added: {num_overlaps} '
+                  f'overlaps from {num_candidates} candidate pairs in this '
+                  'batch', flush=True)
+    create_overlap_indexes(db_file, overlap_table)
+    return num_visits
+
+
 if __name__ == '__main__':
-    db_file = 'drp_tables.db'
-    fill_visit_table(db_file)
-    fill_tract_table(db_file)
-    closest_tracts = fill_overlap_table(db_file)
-    with open('closest_tracts.pickle', 'wb') as fobj:
-        pickle.dump(closest_tracts, fobj)
-    with open('closest_tracts.pickle', 'rb') as fobj:
-        closest_tracts = pickle.load(fobj)
-    update_visit_table(db_file, closest_tracts)
+    parser = argparse.ArgumentParser(
+        description='Fill or update the visit, tract, and overlap tables.')
+    parser.add_argument('--db_file', default='drp_tables.db',
+                        help='output sqlite3 db file')
+    parser.add_argument('--refine', action='store_true',
+                        help='refine the overlaps with the tract and '
+                        'focal plane polygons from the skymap')
+    args = parser.parse_args()
+    db_file = args.db_file
+    with sqlite3.connect(db_file) as con:
+        has_tracts = table_exists(con, TRACT_TABLE)
+    if not has_tracts:
+        fill_tract_table(db_file)
+    # update_overlap_tables fills the visit table along with the
+    # overlaps, so fill_visit_table isn't run.
+    geometry = load_skymap_geometry() if args.refine else None
+    update_overlap_tables(db_file, geometry=geometry)
+    finalize_overlap_db(db_file)
@@ -0,0 +1,125 @@
+"""
+Minimal FITS header parsing for getting table sizes from the first few
+kilobytes of a file without reading the data units.
+"""
+__all__ = ['parse_fits_headers', 'fits_table_num_rows', 'read_num_rows']
+
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+
+def _parse_header(data, offset):
+    """
+    Parse the integer-valued keywords of the header starting at offset.
+
+    Returns
+    -------
+    (dict, int) The keyword values and the offset of the end of the
+    header, or (None, None) if the END card isn't in data.
+    """
+    header = {}
+    for start in range(offset, len(data) - CARD_SIZE + 1, CARD_SIZE):
+        card = data[start:start + CARD_SIZE].decode('ascii', 'replace')
+        keyword = card[:8].strip()
+        if keyword == 'END':
+            end = start + CARD_SIZE
+            return header, end + (-end % BLOCK_SIZE)
+        if card[8:10] != '= ':
+            continue
+        value = card[10:].split('/')[0].strip()
+        try:
+            header[keyword] = int(value)
+        except ValueError:
+            pass
+    return None, None
+
+
+def _data_size(header):
+    """Size in bytes of the padded data unit following a header."""
+    naxis = header.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    num_values = 1
+    for i in range(1, naxis + 1):
+        num_values *= header[f'NAXIS{i}']
+    size = (abs(header['BITPIX'])//8*header.get('GCOUNT', 1)
+            *(header.get('PCOUNT', 0) + num_values))
+    return size + (-size % BLOCK_SIZE)
+
+
+def parse_fits_headers(data, num_hdus):
+    """
+    Parse the integer-valued keywords of the first num_hdus headers in
+    the initial bytes of a FITS file.
+
+    Returns
+    -------
+    list of dicts, one per HDU, or None if data doesn't contain all of
+    the requested headers.
+
+    Raises
+    ------
+    ValueError if data isn't from a FITS file.
+    """
+    if not data.startswith(b'SIMPLE  ='):
+        raise ValueError('not a FITS file')
+    headers = []
+    offset = 0
+    while len(headers) < num_hdus:
+        header, end = _parse_header(data, offset)
+        if header is None:
+            return None
+        headers.append(header)
+        offset = end + _data_size(header)
+    return headers
+
+
+def fits_table_num_rows(data, hdu=1):
+    """
+    Number of rows in a binary table HDU, given the initial bytes of
+    the FITS file, or None if data doesn't contain the table header.
+    """
+    headers = parse_fits_headers(data, hdu + 1)
+    if headers is None:
+        return None
+    try:
+        return headers[hdu]['NAXIS2']
+    except KeyError as eobj:
+        raise ValueError(f'HDU {hdu} has no NAXIS2 keyword') from eobj
+
+
+def read_num_rows(uri, hdu=1, nbytes=8*BLOCK_SIZE, max_bytes=2**24):
+    """
+    Read the number of rows in a FITS binary table HDU from the file
+    headers.  The initial nbytes of the file are read, and that amount
+    is doubled until the table header is found or max_bytes is reached.
+
+    Parameters
+    ----------
+    uri : lsst.resources.ResourcePath
+        URI of the FITS file.
+    hdu : int [1]
+        HDU of the binary table.
+    nbytes : int [23040]
+        Initial number of bytes to read.
+    max_bytes : int [16777216]
+        Maximum number of bytes to read.
+
+    Returns
+    -------
+    int
+
+    Raises
+    ------
+    ValueError if the file isn't a FITS file or the table header isn't
+    found.
+    """
+    while True:
+        data = uri.read(size=nbytes)
+        num_rows = fits_table_num_rows(data, hdu=hdu)
+        if num_rows is not None:
+            return num_rows
+        if len(data) < nbytes or nbytes >= max_bytes:
+            raise ValueError(f'HDU {hdu} header not found in {uri}')
+        nbytes *= 2
@@ -1,46 +1,195 @@
-import os
-import glob
+import re
 from collections import defaultdict
+import threading
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import lsst.daf.butler as daf_butler
+from .resource_usage_cache import ResourceUsageCache
+from .columnar import ColumnAccumulator, ParquetPartWriter
+from .metadata_extraction import read_resource_usage
+from .fits_headers import read_num_rows
+from .dp_sizes import dataset_uris
 
 
-__all__ = ['get_nImage_stats', 'get_merged_det_stats', 'get_resource_usage',
+__all__ = ['get_nImage_stats', 'image_median_and_max',
+           'get_merged_det_stats', 'get_resource_usage',
+           'find_metadata_dataset_types',
            'add_nImage_columns', 'add_merged_det_column']
 
 
-def get_nImage_stats(repo, collection):
+# Column dtypes of the nImage statistics data frame.
+NIMAGE_DTYPES = {'coadd_type': 'object', 'band': 'object', 'tract': 'int64',
+                 'patch': 'int64', 'n_median': 'float64', 'n_max': 'int64'}
+
+
+def image_median_and_max(array):
+    """
+    Median and maximum of an image array.  For non-negative integer
+    arrays, such as nImage, these are computed from a histogram of the
+    pixel values, which avoids the copy and partial sort that np.median
+    makes.  The median is the same as from np.median.  Other arrays,
+    including integer arrays with values much larger than the number of
+    pixels, for which the histogram would be too large, use np.median.
+    """
+    if (not np.can_cast(array.dtype, np.intp) or np.min(array) < 0
+            or np.max(array) > array.size):
+        return np.median(array), np.max(array)
+    counts = np.bincount(array.ravel())
+    cumulative = np.cumsum(counts)
+    num_pix = cumulative[-1]
+    # Values of the middle elements of the sorted array.
+    lower = np.searchsorted(cumulative, (num_pix - 1)//2, side='right')
+    upper = np.searchsorted(cumulative, num_pix//2, side='right')
+    return (lower + upper)/2., len(counts) - 1
+
+
+def nImage_stats_rows(coadd_type, butler, dsrefs):
+    """
+    Read the nImage images and compute the median and maximum number of
+    input images for each one.
+
+    Returns
+    -------
+    list of rows with the columns given by NIMAGE_DTYPES.
+    """
+    rows = []
+    for dsref in dsrefs:
+        # The nImage datasets are plain images, so the array is a view
+        # of the pixel data.
+        n_median, n_max = image_median_and_max(butler.getDirect(dsref).array)
+        dataId = dsref.dataId
+        rows.append((coadd_type, dataId['band'], dataId['tract'],
+                     dataId['patch'], n_median, n_max))
+    return rows
+
+
+def _nImage_stats_chunk(chunk):
+    coadd_type, dsrefs = chunk
+    return nImage_stats_rows(coadd_type, _BUTLER, dsrefs)
+
+
+def get_nImage_stats(repo, collection, processes=10, output_file=None,
+                     chunk_size=50, resume=True):
+    """
+    Compute the median and maximum numbers of input images for the
+    deep and goodSeeing coadd patches in a collection.
+
+    The nImage dataset refs are divided into chunks of chunk_size refs,
+    which are processed by a pool of processes, each with its own
+    Butler.  If output_file is given, the results for each chunk are
+    written to that parquet dataset directory as they come in, and if
+    resume is True, patches that are already in the output are skipped.
+
+    Returns
+    -------
+    pd.DataFrame with the columns given by NIMAGE_DTYPES.
+    """
     butler = daf_butler.Butler(repo, collections=[collection])
-    dstypes = [_ + 'Coadd_nImage' for _ in 'deep goodSeeing'.split()]
-    data = defaultdict(list)
-    for dstype in dstypes:
-        dsrefs = set(butler.registry.queryDatasets(dstype))
-        print(dstype, len(dsrefs))
-        coadd_type = dstype[:-len('Coadd_nImage')]
-        for i, dsref in enumerate(dsrefs):
-            print(i)
-            image = butler.getDirect(dsref)
-            data['coadd_type'].append(coadd_type)
-            data['band'].append(dsref.dataId['band'])
-            data['tract'].append(dsref.dataId['tract'])
-            data['patch'].append(dsref.dataId['patch'])
-            data['n_median'].append(np.median(image.array))
-            data['n_max'].append(np.max(image.array))
-    return pd.DataFrame(data)
-
-
-def get_merged_det_stats(repo, collection):
+    acc = ColumnAccumulator(NIMAGE_DTYPES)
+    done = set()
+    writer = None
+    if output_file is not None:
+        writer = ParquetPartWriter(output_file, acc.arrow_schema(),
+                                   append=resume)
+        done = set(writer.read()[['coadd_type', 'band', 'tract', 'patch']]
+                   .itertuples(index=False, name=None))
+
+    chunks = []
+    for coadd_type in ('deep', 'goodSeeing'):
+        dstype = coadd_type + 'Coadd_nImage'
+        dsrefs = [_ for _ in set(butler.registry.queryDatasets(dstype))
+                  if (coadd_type, _.dataId['band'], _.dataId['tract'],
+                      _.dataId['patch']) not in done]
+        print(dstype, len(dsrefs), 'to read', flush=True)
+        chunks.extend((coadd_type, dsrefs[imin:imin + chunk_size])
+                      for imin in range(0, len(dsrefs), chunk_size))
+
+    def add_rows(rows):
+        if writer is not None:
+            acc.clear()
+        for row in rows:
+            acc.append(row)
+        if writer is not None:
+            writer.write(acc.to_frame())
+
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes,
+                                  initializer=_init_butler_worker,
+                                  initargs=(repo, [collection])) as pool:
+            for i, rows in enumerate(pool.imap_unordered(_nImage_stats_chunk,
+                                                         chunks)):
+                add_rows(rows)
+                print(f'{i + 1}/{len(chunks)} chunks', flush=True)
+    else:
+        for i, (coadd_type, dsrefs) in enumerate(chunks):
+            add_rows(nImage_stats_rows(coadd_type, butler, dsrefs))
+            print(f'{i + 1}/{len(chunks)} chunks', flush=True)
+
+    if writer is None:
+        return acc.to_frame()
+    return writer.read()
+
+
+def _header_num_rows(uris):
+    """
+    Number of rows from the FITS header of a single-file dataset, or
+    None if the dataset has several files or the header can't be read.
+    """
+    if len(uris) != 1:
+        return None
+    try:
+        return read_num_rows(uris[0])
+    except (ValueError, OSError):
+        return None
+
+
+def merged_det_count(butler, dsref, fast=True, uris=None):
+    """
+    Number of merged detections in a deepCoadd_mergeDet catalog.  If
+    fast is True, this is the NAXIS2 value from the catalog's FITS
+    header, and the full catalog is only read if that fails.  The
+    dataset's file URIs are resolved if they aren't given.
+    """
+    n_det = None
+    if fast:
+        if uris is None:
+            uris = dataset_uris(butler, [dsref])[0]
+        n_det = _header_num_rows(uris)
+    if n_det is None:
+        n_det = len(butler.getDirect(dsref))
+    return n_det
+
+
+def get_merged_det_stats(repo, collection, fast=True, threads=16):
+    """
+    Tabulate the number of merged detections per patch.  In fast mode,
+    the URIs of all of the catalogs are resolved up front, and the
+    counts are read from the FITS headers with a pool of threads,
+    since that work is I/O bound.  Catalogs whose headers can't be
+    read are then read in full.
+
+    Returns
+    -------
+    pd.DataFrame with tract, patch, and n_det columns.
+    """
     butler = daf_butler.Butler(repo, collections=[collection])
     data = defaultdict(list)
     dstype = 'deepCoadd_mergeDet'
-    dsrefs = set(butler.registry.queryDatasets(dstype))
-    for dsref in dsrefs:
-        cat = butler.getDirect(dsref)
+    dsrefs = list(set(butler.registry.queryDatasets(dstype)))
+    if fast:
+        uris = dataset_uris(butler, dsrefs)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            n_dets = list(executor.map(_header_num_rows, uris))
+    else:
+        n_dets = [None]*len(dsrefs)
+    for dsref, n_det in zip(dsrefs, n_dets):
+        if n_det is None:
+            n_det = len(butler.getDirect(dsref))
         data['tract'].append(dsref.dataId['tract'])
         data['patch'].append(dsref.dataId['patch'])
-        data['n_det'].append(len(cat))
+        data['n_det'].append(n_det)
     return pd.DataFrame(data)
 
 
@@ -65,149 +214,365 @@ def extract_resource_usage(md):
     return maxRSS, wall_time, cpu_time
 
 
-def fill_data_frames(task, butler, dsrefs):
-    data_coadd = defaultdict(list)
-    data_visit = defaultdict(list)
+def extract_record(task, dsref, usage):
+    """
+    Make the resource usage record, with fields given by RECORD_FIELDS,
+    for a metadata dataset from the (maxRSS, wall_time, cpu_time) tuple
+    extracted from it.  usage is None for metadata without memory info.
+    """
+    dataId = dsref.dataId
+    record = dict(dataset_id=str(dsref.id), task=task, frame=None,
+                  detector=None, visit=None, tract=None, patch=None,
+                  band=dataId.get('band', None), maxRSS=None,
+                  wall_time=None, cpu_time=None)
+    if usage is None:
+        return tuple(record.values())
+    maxRSS, wall_time, cpu_time = usage
+    record.update(maxRSS=maxRSS, wall_time=wall_time, cpu_time=cpu_time)
+    if 'detector' in dataId:
+        record['frame'] = 'visit'
+        record['detector'] = dataId['detector']
+        if 'visit' in dataId:
+            record['visit'] = dataId['visit']
+        else:
+            # isr task uses 'exposure' instead of 'visit' (for
+            # DC2 at least), even though it's still the visit.
+            record['visit'] = dataId['exposure']
+    elif 'visit' in dataId:
+        # Some focal plane level aggregation tasks pertain to
+        # visits, but not individual CCDs.
+        record['frame'] = 'visit'
+        record['visit'] = dataId['visit']
+    elif 'tract' in dataId:
+        record['frame'] = 'coadd'
+        record['tract'] = dataId['tract']
+        # There are tasks that produce only tract-level outputs.
+        record['patch'] = dataId.get('patch', None)
+    return tuple(record.values())
+
+
+def harvest_records(task, butler, dsrefs, fast=True):
+    """
+    Read the metadata datasets and extract the resource usage records.
+    If fast is True, the metadata files are parsed directly, falling
+    back to butler.getDirect for files in unrecognized formats.
+    """
+    records = []
     for dsref in dsrefs:
-        md = butler.getDirect(dsref)
         try:
-            maxRSS, wall_time, cpu_time = extract_resource_usage(md)
+            usage = read_resource_usage(butler, dsref) if fast else None
+            if usage is None:
+                usage = extract_resource_usage(butler.getDirect(dsref))
         except ValueError:
-            pass
-        else:
-            if 'detector' in dsref.dataId:
-                data = data_visit
-                data['detector'].append(dsref.dataId['detector'])
-                if 'visit' in dsref.dataId:
-                    data['visit'].append(dsref.dataId['visit'])
-                else:
-                    # isr task uses 'exposure' instead of 'visit' (for
-                    # DC2 at least), even though it's still the visit.
-                    data['visit'].append(dsref.dataId['exposure'])
-            elif 'visit' in dsref.dataId:
-                # Some focal plane level aggregation tasks pertain to
-                # visits, but not individual CCDs.
-                data = data_visit
-                data['detector'].append(None)
-                data['visit'].append(dsref.dataId['visit'])
-            elif 'tract' in dsref.dataId:
-                data = data_coadd
-                data['tract'].append(dsref.dataId['tract'])
-                # There are tasks that produce only tract-level outputs.
-                data['patch'].append(dsref.dataId.get('patch', None))
-            else:
-                continue
-            data['task'].append(task)
-            data['maxRSS (GB)'].append(maxRSS)
-            data['wall_time'].append(wall_time)
-            data['cpu_time (m)'].append(cpu_time)
-            data['band'].append(dsref.dataId.get('band', None))
-
-    df_coadd = pd.DataFrame(data_coadd)
-    df_visit = pd.DataFrame(data_visit)
-    return df_coadd, df_visit
+            usage = None
+        records.append(extract_record(task, dsref, usage))
+    return records
+
+
+# Column dtypes of the coadd-level and visit-level resource usage data
+# frames.  The patch and detector columns are nullable since there are
+# tract-level and visit-level tasks.
+COADD_DTYPES = {'tract': 'int64', 'patch': 'Int64', 'task': 'object',
+                'maxRSS (GB)': 'float64', 'wall_time': 'float64',
+                'cpu_time (m)': 'float64', 'band': 'object'}
+VISIT_DTYPES = {'detector': 'Int64', 'visit': 'int64', 'task': 'object',
+                'maxRSS (GB)': 'float64', 'wall_time': 'float64',
+                'cpu_time (m)': 'float64', 'band': 'object'}
+
+
+def add_records(accumulators, records):
+    """
+    Add resource usage records to the (coadd, visit) pair of
+    ColumnAccumulators.
+    """
+    coadd, visit = accumulators
+    for record in records:
+        (_, task, frame, detector, visit_, tract, patch, band, maxRSS,
+         wall_time, cpu_time) = record
+        if frame == 'visit':
+            visit.append((detector, visit_, task, maxRSS, wall_time,
+                          cpu_time, band))
+        elif frame == 'coadd':
+            coadd.append((tract, patch, task, maxRSS, wall_time,
+                          cpu_time, band))
+
+
+def new_accumulators():
+    """ColumnAccumulators for the coadd-level and visit-level rows."""
+    return (ColumnAccumulator(COADD_DTYPES), ColumnAccumulator(VISIT_DTYPES))
+
+
+def records_to_data_frames(records):
+    """
+    Convert resource usage records to coadd-level and visit-level
+    data frames.
+    """
+    accumulators = new_accumulators()
+    add_records(accumulators, records)
+    return tuple(_.to_frame() for _ in accumulators)
+
+
+def fill_data_frames(task, butler, dsrefs, fast=True):
+    return records_to_data_frames(harvest_records(task, butler, dsrefs,
+                                                  fast=fast))
+
+
+# Memoized metadata dataset type names, keyed by (repo, collections).
+_METADATA_DSTYPES = {}
+
+
+def find_metadata_dataset_types(repo, collections, butler=None,
+                                refresh=False):
+    """
+    Find the names of the task metadata dataset types that have
+    datasets in the specified collections.  The dataset types are
+    found with a single registry query for the '*_metadata' dataset
+    types, which is intersected with the dataset types in the registry
+    summaries of the requested collections, including any chained
+    collections.  The results are memoized per repo and collections.
+    Set refresh=True to query the registry again, e.g., after new
+    tasks have been run in the collections.
+    """
+    key = (repo, tuple(collections))
+    if refresh or key not in _METADATA_DSTYPES:
+        if butler is None:
+            butler = daf_butler.Butler(repo, collections=collections)
+        registry = butler.registry
+        dstypes = {_.name for _ in
+                   registry.queryDatasetTypes(re.compile('.*_metadata'))}
+        in_collections = set()
+        for collection in collections:
+            in_collections.update(registry.getCollectionSummary(collection)
+                                  .dataset_types.names)
+        _METADATA_DSTYPES[key] = sorted(dstypes & in_collections)
+    return _METADATA_DSTYPES[key]
+
+
+# Butler for the worker processes used by get_resource_usage and
+# get_nImage_stats.  Each worker creates its own Butler in the pool
+# initializer, so that a Butler isn't pickled and sent along with each
+# chunk of dataset refs.
+_BUTLER = None
+
+
+def _init_butler_worker(repo, collections):
+    global _BUTLER
+    _BUTLER = daf_butler.Butler(repo, collections=collections)
+
+
+def _harvest_records_chunk(chunk):
+    task, num_chunks, dsrefs, fast = chunk
+    return task, num_chunks, harvest_records(task, _BUTLER, dsrefs, fast=fast)
 
 
 def get_resource_usage(repo, collections, processes=10, output_name=None,
-                       target_dsrefs_size=1000, nmax=None):
+                       chunk_size=100, nmax=None, cache_file=None,
+                       refresh_collections=None, fast_metadata=True):
+    """
+    Extract the memory and timing info from the task metadata for all
+    of the tasks that were run in the specified collections.
+
+    The dataset refs for all of the metadata dataset types are divided
+    into chunks of chunk_size refs, which are streamed to a single pool
+    of processes, each with its own Butler.  The chunks are processed
+    in whatever order the workers finish them, so slow chunks don't
+    hold up the others.
+
+    If a cache_file is given, the values extracted from each metadata
+    dataset are stored in that sqlite3 file, keyed by dataset id, and
+    only datasets not already in the cache are read.  Datasets in
+    refresh_collections are always re-read, and the metadata dataset
+    types are then found anew rather than taken from the memo of
+    find_metadata_dataset_types.
+
+    If output_name is given, the results for each task are appended to
+    the coadd_resource_usage_{output_name}.parq and
+    visit_resource_usage_{output_name}.parq dataset directories as soon
+    as all of the task's datasets have been processed.  These can be
+    read with pd.read_parquet while the harvesting is in progress.
+    Previous versions wrote single parquet files with these names,
+    which must be removed or renamed before the directories can be
+    written.
+
+    If fast_metadata is True, the metadata files are parsed directly
+    rather than being read with the butler.
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame) Data frames of the coadd-level and
+    visit-level resource usage.
+    """
     butler = daf_butler.Butler(repo, collections=collections)
+    cache = None if cache_file is None else ResourceUsageCache(cache_file)
 
-    # Find metadata dataset types.
-    dstypes = set()
-    for collection in collections:
-        run_dirs = sorted(glob.glob(os.path.join(repo, collection, '*')))
-        for run_dir in run_dirs:
-            dstypes.update([os.path.basename(_) for _ in
-                            glob.glob(os.path.join(run_dir, '*_metadata'))])
-
-    # Loop over dataset types and extract memory and timing info.
-    coadd_dfs = []
-    visit_dfs = []
-    for i, dstype in enumerate(dstypes):
-        task = dstype.split('_')[0]
-        dsrefs = list(set(butler.registry.queryDatasets(dstype)))
-        if nmax is not None:
-            dsrefs = dsrefs[:nmax]
-        n_refs = len(dsrefs)
-        print(i, task, n_refs, flush=True)
-        if n_refs > target_dsrefs_size:
-            index = np.linspace(0, n_refs, processes + 1, dtype=int)
-            with multiprocessing.Pool(processes=processes) as pool:
-                workers = []
-                for imin, imax in zip(index[:-1], index[1:]):
-                    print('  ', imin, imax, flush=True)
-                    workers.append(pool.apply_async(fill_data_frames,
-                                                    (task, butler,
-                                                     dsrefs[imin:imax])))
-                pool.close()
-                pool.join()
-                for worker in workers:
-                    df_coadd, df_visit = worker.get()
-                    coadd_dfs.append(df_coadd)
-                    visit_dfs.append(df_visit)
-        else:
-            df_coadd, df_visit = fill_data_frames(task, butler, dsrefs)
-            coadd_dfs.append(df_coadd)
-            visit_dfs.append(df_visit)
-
-    df_coadd = pd.concat(coadd_dfs)
-    df_visit = pd.concat(visit_dfs)
+    dstypes = find_metadata_dataset_types(repo, collections, butler=butler,
+                                          refresh=bool(refresh_collections))
 
+    # If output is requested, the rows for each task are accumulated
+    # separately and flushed to the parquet datasets once all of the
+    # task's chunks are in.  Otherwise, the rows for all tasks are
+    # accumulated together.
     if output_name is not None:
-        df_coadd.to_parquet(f'coadd_resource_usage_{output_name}.parq')
-        df_visit.to_parquet(f'visit_resource_usage_{output_name}.parq')
-
-    return df_coadd, df_visit
+        writers = [ParquetPartWriter(f'{frame}_resource_usage_'
+                                     f'{output_name}.parq',
+                                     ColumnAccumulator(dtypes).arrow_schema())
+                   for frame, dtypes in (('coadd', COADD_DTYPES),
+                                         ('visit', VISIT_DTYPES))]
+        accumulators = defaultdict(new_accumulators)
+    else:
+        writers = None
+        all_rows = new_accumulators()
+        accumulators = defaultdict(lambda: all_rows)
+    received = defaultdict(int)
+
+    def flush(task):
+        if writers is not None:
+            for writer, acc in zip(writers, accumulators.pop(task)):
+                writer.write(acc.to_frame())
+
+    # The chunks are generated lazily, one task at a time, so the
+    # workers can start on the first task's chunks while the registry
+    # is queried for the others.  The pool consumes the generator in a
+    # separate thread, so the updates of the accumulators from the
+    # cached records and from the worker results are serialized.
+    lock = threading.Lock()
+
+    def chunks():
+        for i, dstype in enumerate(dstypes):
+            task = dstype.split('_')[0]
+            dsrefs = list(set(butler.registry.queryDatasets(dstype)))
+            if nmax is not None:
+                dsrefs = dsrefs[:nmax]
+            print(i, task, len(dsrefs), flush=True)
+            cached_records = []
+            if cache is not None:
+                refresh_ids = set()
+                if refresh_collections:
+                    refresh_ids = {str(_.id) for _ in
+                                   butler.registry.queryDatasets(
+                                       dstype,
+                                       collections=refresh_collections)}
+                cached_records, dsrefs \
+                    = cache.split(task, dsrefs, refresh_ids=refresh_ids)
+                print(f'  {len(cached_records)} cached, '
+                      f'{len(dsrefs)} to read', flush=True)
+            num_chunks = (len(dsrefs) + chunk_size - 1)//chunk_size
+            with lock:
+                add_records(accumulators[task], cached_records)
+                if num_chunks == 0:
+                    flush(task)
+            for imin in range(0, len(dsrefs), chunk_size):
+                yield (task, num_chunks, dsrefs[imin:imin + chunk_size],
+                       fast_metadata)
+
+    def add_chunk(task, num_chunks, records):
+        with lock:
+            add_records(accumulators[task], records)
+            if cache is not None:
+                cache.add(records)
+            received[task] += 1
+            if received[task] == num_chunks:
+                flush(task)
+
+    # Loop over chunks of dataset refs and extract memory and timing info.
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes,
+                                  initializer=_init_butler_worker,
+                                  initargs=(repo, collections)) as pool:
+            for result in pool.imap_unordered(_harvest_records_chunk,
+                                              chunks()):
+                add_chunk(*result)
+    else:
+        for task, num_chunks, dsrefs, fast in chunks():
+            add_chunk(task, num_chunks,
+                      harvest_records(task, butler, dsrefs, fast=fast))
+    if cache is not None:
+        print(cache, flush=True)
+
+    if writers is None:
+        return tuple(_.to_frame() for _ in all_rows)
+    return tuple(_.read() for _ in writers)
+
+
+def _match_rows(left, right, on):
+    """
+    Positions of the rows in right whose values of the key columns, on,
+    match those of each row in left, or -1 where there is no match.  If
+    the keys in right aren't unique, the last matching row is used.
+    """
+    right = right[on].drop_duplicates(keep='last')
+    right = right.assign(_row=right.index.to_numpy())
+    merged = left[on].merge(right, how='left', on=on)
+    return merged['_row'].fillna(-1).to_numpy(dtype=np.int64)
+
+
+def _lookup(left, right, on, column, default=KeyError):
+    """
+    Values of right[column] for the rows in right matching the key
+    values of each row in left, as an object array.  Missing keys
+    raise a KeyError unless a default value is given.
+    """
+    right = right.reset_index(drop=True)
+    rows = _match_rows(left, right, on)
+    missing = rows < 0
+    if np.any(missing) and default is KeyError:
+        raise KeyError(tuple(left[on].to_numpy()[np.argmax(missing)]))
+    values = right[column].to_numpy(dtype=object)[rows]
+    values[missing] = default
+    return values
 
 
 def add_nImage_columns(df_coadd, df_nImage):
-    n_stats = {'deep' : {}, 'goodSeeing' : {}}
-    n_ugrizy = {'n_median': defaultdict(lambda : 0),
-                'n_max': defaultdict(lambda : 0)}
-    for _, row in df_nImage.iterrows():
-        n_stats[row.coadd_type][(row.band, row.tract, row.patch)] \
-            = (row.n_median, row.n_max)
-        if row.coadd_type == 'deep':
-            n_ugrizy['n_median'][(row.tract, row.patch)] += row.n_median
-            n_ugrizy['n_max'][(row.tract, row.patch)] += row.n_max
-
-    n_median, n_max = [], []
-    for _, row in df_coadd.iterrows():
-        key = row.band, row.tract, row.patch
-        if row.patch is None or np.isnan(row.patch):
-            n_median.append(None)
-            n_max.append(None)
-        elif row.task == 'makeWarp':
-            n_median.append(1)
-            n_max.append(1)
-        elif row.band is None:
-            n_median.append(n_ugrizy['n_median'][(row.tract, row.patch)])
-            n_max.append(n_ugrizy['n_max'][(row.tract, row.patch)])
-        elif row.task == 'templateGen':
-            n_median.append(n_stats['goodSeeing'][key][0])
-            n_max.append(n_stats['goodSeeing'][key][1])
-        else:
-            n_median.append(n_stats['deep'][key][0])
-            n_max.append(n_stats['deep'][key][1])
-
-    df_coadd['n_median'] = n_median
-    df_coadd['n_max'] = n_max
+    """
+    Add the n_median and n_max columns of the nImage statistics for
+    the (band, tract, patch) of each row of df_coadd.  makeWarp rows
+    get 1, rows without a band get the sum over the deep coadd bands,
+    templateGen rows use the goodSeeing coadds, and the remaining rows
+    with a patch use the deep coadds.
+    """
+    coadd = df_coadd[['task', 'band', 'tract', 'patch']].reset_index(drop=True)
+    has_patch = coadd['patch'].notna().to_numpy()
+    make_warp = has_patch & (coadd['task'] == 'makeWarp').to_numpy()
+    no_band = has_patch & ~make_warp & coadd['band'].isna().to_numpy()
+    rest = has_patch & ~make_warp & ~no_band
+    template = rest & (coadd['task'] == 'templateGen').to_numpy()
+    deep = rest & ~template
+
+    deep_stats = df_nImage.query("coadd_type == 'deep'")
+    good_seeing_stats = df_nImage.query("coadd_type == 'goodSeeing'")
+    ugrizy_stats = deep_stats.groupby(['tract', 'patch'], as_index=False)\
+                             [['n_median', 'n_max']].sum()
+
+    columns = {}
+    for column in ('n_median', 'n_max'):
+        values = np.full(len(coadd), None, dtype=object)
+        values[make_warp] = 1
+        values[no_band] = _lookup(coadd[no_band], ugrizy_stats,
+                                  ['tract', 'patch'], column, default=0)
+        values[template] = _lookup(coadd[template], good_seeing_stats,
+                                   ['band', 'tract', 'patch'], column)
+        values[deep] = _lookup(coadd[deep], deep_stats,
+                               ['band', 'tract', 'patch'], column)
+        columns[column] = values
+
+    # Assign lists so that pandas infers the column dtypes.
+    df_coadd['n_median'] = columns['n_median'].tolist()
+    df_coadd['n_max'] = columns['n_max'].tolist()
 
     return df_coadd
 
 
 def add_merged_det_column(df_coadd, df_merged_det):
-    n_det_dict = {(row.tract, row.patch) : row.n_det
-                  for _, row in df_merged_det.iterrows()}
-
-    n_det = []
-    for _, row in df_coadd.iterrows():
-        if row.task == 'deblend':
-            key = row.tract, row.patch
-            n_det.append(n_det_dict[key])
-        else:
-            n_det.append(None)
-    df_coadd['merged detections'] = n_det
+    """
+    Add the number of merged detections for the (tract, patch) of each
+    deblend row of df_coadd.
+    """
+    coadd = df_coadd[['task', 'tract', 'patch']].reset_index(drop=True)
+    deblend = (coadd['task'] == 'deblend').to_numpy()
+    n_det = np.full(len(coadd), None, dtype=object)
+    n_det[deblend] = _lookup(coadd[deblend], df_merged_det,
+                             ['tract', 'patch'], 'n_det')
+    df_coadd['merged detections'] = n_det.tolist()
     return df_coadd
 
 
@@ -224,19 +589,19 @@ if __name__ == "__main__":
 
     # nImage info from coadds.
     print("Getting nImage info", flush=True)
-    df_nImage = pd.read_parquet('nImage.parq')
-    #df_nImage = get_nImage_stats(repo, step3_collection)
+    df_nImage = get_nImage_stats(repo, step3_collection,
+                                 output_file='nImage_stats.parq')
 
     # Merged detection numbers.
     print("Getting merged_det info", flush=True)
-    df_merged_det = pd.read_parquet('merged_det.parq')
-    #df_merged_det = get_merged_det_stats(repo, step3_collection)
+    df_merged_det = get_merged_det_stats(repo, step3_collection)
 
     # Memory and cputime visit- and coadd-level data.
     print("Getting resource usage info", flush=True)
 #    df_coadd = pd.read_parquet('coadd.parq')
 #    df_visit = pd.read_parquet('visit.parq')
-    df_coadd, df_visit = get_resource_usage(repo, collections, nmax=200)
+    df_coadd, df_visit = get_resource_usage(
+        repo, collections, cache_file='resource_usage_cache.db')
 
     # Add nImage and merged_det columns to coadd data frame.
     df_coadd = add_nImage_columns(df_coadd, df_nImage)
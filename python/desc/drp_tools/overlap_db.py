@@ -0,0 +1,75 @@
+"""
+Functions for managing the sqlite3 overlap db files: connections tuned
+for bulk loading, indexes for the visit-tract overlap queries, and a
+finalize step to run once a db has been filled.
+"""
+import sqlite3
+from contextlib import contextmanager
+
+__all__ = ['bulk_load_connection', 'create_overlap_indexes',
+           'finalize_overlap_db']
+
+
+@contextmanager
+def bulk_load_connection(db_file, cache_size_mb=512):
+    """
+    Context manager that provides an sqlite3 connection configured for
+    bulk loading: WAL journaling, a larger page cache, and
+    synchronous=OFF.  The connection is committed on normal exit,
+    rolled back if an exception is raised, and then closed.
+
+    With synchronous=OFF, an application crash will not corrupt the db
+    file, but an operating system crash or power loss during the load
+    can, so the db should be rebuilt in that case.
+    """
+    con = sqlite3.connect(db_file)
+    try:
+        con.execute('pragma journal_mode=WAL')
+        con.execute('pragma synchronous=OFF')
+        con.execute(f'pragma cache_size=-{cache_size_mb*1024}')
+        with con:
+            yield con
+    finally:
+        con.close()
+
+
+def create_overlap_indexes(db_file, overlap_table='Overlap',
+                           columns=('tract', 'visit')):
+    """
+    Create the indexes on the (tract, visit) and (visit, tract) column
+    pairs of an overlap table if they don't already exist.  These cover
+    the queries for the visits overlapping a set of tracts and for the
+    tracts overlapping a set of visits.
+    """
+    col0, col1 = columns
+    con = sqlite3.connect(db_file)
+    try:
+        with con:
+            con.execute(f'create index if not exists '
+                        f'{overlap_table}_{col0}_{col1}_idx '
+                        f'on {overlap_table} ({col0}, {col1})')
+            con.execute(f'create index if not exists '
+                        f'{overlap_table}_{col1}_{col0}_idx '
+                        f'on {overlap_table} ({col1}, {col0})')
+    finally:
+        # Close the connection explicitly, so that it doesn't block
+        # a subsequent change of journal mode.
+        con.close()
+
+
+def finalize_overlap_db(db_file, journal_mode='DELETE', vacuum=True):
+    """
+    Gather the query planner statistics for an overlap db that has been
+    filled and, optionally, vacuum it.  By default, the journal mode is
+    set back to DELETE, so that the db is a single file that can be
+    read from file systems that don't support WAL, such as NFS.
+    """
+    con = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        con.execute('analyze')
+        if vacuum:
+            con.execute('vacuum')
+        if journal_mode is not None:
+            con.execute(f'pragma journal_mode={journal_mode}')
+    finally:
+        con.close()
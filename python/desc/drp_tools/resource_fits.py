@@ -0,0 +1,152 @@
+"""
+Fits of the per-task resource usage for setting the memory and cpu
+time requests in bps resource configs.  The fits for all tasks are
+computed from grouped data frames, independently of any plotting.
+"""
+import numpy as np
+import pandas as pd
+
+__all__ = ['RESOURCE_COLUMNS', 'percentile_value', 'fit_upper_envelope',
+           'fit_visit_resources', 'fit_coadd_resources',
+           'resource_params']
+
+
+RESOURCE_COLUMNS = ('cpu_time (m)', 'maxRSS (GB)')
+
+# Columns of the resource fit tables.  The resource usage for a quantum
+# is modeled as slope*x + intercept, where x is the value in the
+# x_column of the coadd data frame, or slope is zero and x_column is
+# None for the percentile fits.
+FIT_COLUMNS = ('task', 'column', 'slope', 'intercept', 'x_column', 'method')
+
+# Coadd-level tasks that are fit with percentiles of the band-level
+# resource usage instead of upper envelopes vs max(nImage).
+PERCENTILE_TASKS = ('healSparsePropertyMaps',)
+
+
+def percentile_value(values, percentile=0.95):
+    """
+    Value at index int(percentile*N) of the sorted non-NaN values,
+    found with np.partition instead of a full sort.  NaN is returned if
+    there are no such values.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan
+    index = int(percentile*len(values))
+    return np.partition(values, index)[index]
+
+
+def _percentile_func(percentile):
+    """Per-column aggregation function for groupby percentile values."""
+    return lambda values: percentile_value(values, percentile=percentile)
+
+
+def _envelope_pars(envelope):
+    """
+    Linear fit to an upper envelope, given as a series of maximum y
+    values indexed by x.  A constant is fit if the slope isn't positive.
+    """
+    xvals = envelope.index.to_numpy(dtype=float)
+    yvals = envelope.to_numpy(dtype=float)
+    pars = np.polyfit(xvals, yvals, 1)
+    if pars[0] <= 0:
+        # Can't have negative slope, so fit a constant line instead.
+        pars = (0, np.polyfit(xvals, yvals, 0)[0])
+    return tuple(pars)
+
+
+def fit_upper_envelope(x, y):
+    """
+    Fit a line to the maximum y values at each distinct x value.
+
+    Returns
+    -------
+    (slope, intercept)
+    """
+    return _envelope_pars(pd.Series(np.asarray(y)).groupby(np.asarray(x))
+                          .max())
+
+
+def _fit_table(rows):
+    return pd.DataFrame(rows, columns=FIT_COLUMNS)
+
+
+def fit_visit_resources(df_visit, percentile=0.95,
+                        columns=RESOURCE_COLUMNS):
+    """
+    Compute the percentile values of the resource usage columns for
+    each visit-level task.
+
+    Returns
+    -------
+    pd.DataFrame with columns given by FIT_COLUMNS.
+    """
+    values = df_visit.groupby('task', sort=True)[list(columns)]\
+                     .agg(_percentile_func(percentile))
+    return _fit_table([(task, column, 0, values.loc[task, column], None,
+                        'percentile')
+                       for task in values.index for column in columns])
+
+
+def fit_coadd_resources(df_coadd, percentile=0.95,
+                        columns=RESOURCE_COLUMNS):
+    """
+    Fit the resource usage columns for each coadd-level task, except
+    for the consolidate and isolatedStar tasks.  deblend is fit with a
+    percentile value.  Tasks that are run on all bands together, and
+    the tasks in PERCENTILE_TASKS, are fit with percentile values over
+    all of the bands.  The other tasks are fit with a linear upper
+    envelope as a function of max(nImage) over all of the ugrizy bands.
+
+    Returns
+    -------
+    pd.DataFrame with columns given by FIT_COLUMNS.
+    """
+    columns = list(columns)
+    df = df_coadd[~(df_coadd['task'].str.contains('consolidate') |
+                    df_coadd['task'].str.contains('isolatedStar'))]
+    in_bands = df['band'].isin(list('ugrizy'))
+    by_task = df.groupby('task', sort=True)
+    single_band = by_task['band'].nunique(dropna=False) == 1
+
+    percentiles = by_task[columns].agg(_percentile_func(percentile))
+    band_percentiles = df[in_bands].groupby('task')[columns]\
+                                   .agg(_percentile_func(percentile))\
+                                   .reindex(percentiles.index)
+    envelopes = df[in_bands].groupby(['task', 'n_max'], sort=True)[columns]\
+                            .max()
+
+    rows = []
+    for task in percentiles.index:
+        for column in columns:
+            if task == 'deblend' or single_band[task]:
+                rows.append((task, column, 0, percentiles.loc[task, column],
+                             None, 'percentile'))
+            elif task in PERCENTILE_TASKS:
+                rows.append((task, column, 0,
+                             band_percentiles.loc[task, column], None,
+                             'percentile'))
+            elif task in envelopes.index:
+                slope, intercept \
+                    = _envelope_pars(envelopes.loc[task][column])
+                rows.append((task, column, slope, intercept, 'n_max',
+                             'envelope'))
+            else:
+                # No ugrizy rows with max(nImage) values to fit.
+                rows.append((task, column, np.nan, np.nan, 'n_max',
+                             'envelope'))
+    return _fit_table(rows)
+
+
+def resource_params(fits):
+    """
+    Convert a resource fit table to a dictionary of (slope, intercept)
+    tuples, keyed by task and resource usage column.
+    """
+    params = {}
+    for row in fits.itertuples(index=False):
+        params.setdefault(row.task, {})[row.column] \
+            = (row.slope, row.intercept)
+    return params
@@ -0,0 +1,233 @@
+"""
+Model of the per-quantum memory and cpu time of pipeline tasks based
+on the resource fits, for predicting the node-hours and memory needed
+for planned processing and for setting bps resource requests.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+import yaml
+from .resource_fits import FIT_COLUMNS
+
+__all__ = ['ResourceModel', 'ccd_visit_quanta']
+
+
+def ccd_visit_quanta(df_overlaps, tasks=('isr', 'characterizeImage',
+                                         'calibrate')):
+    """
+    Make the table of planned quanta for ccd-visit level tasks from a
+    data frame of overlaps, e.g., from SfpYamlFactory.query_overlaps,
+    with visit and detector columns.
+
+    Returns
+    -------
+    pd.DataFrame with task, visit, and detector columns.
+    """
+    ccd_visits = df_overlaps[['visit', 'detector']].drop_duplicates()
+    return pd.concat([ccd_visits.assign(task=task) for task in tasks],
+                     ignore_index=True)[['task', 'visit', 'detector']]
+
+
+class ResourceModel:
+    """
+    Linear model, slope*x + intercept, of the maxRSS (GB) and cpu time
+    (m) per quantum for each task, where x is the value of the model's
+    x_column, e.g., 'n_max' or 'merged detections', for the quantum.
+    Percentile models have zero slope and no x_column.
+
+    Tasks with NaN slopes or intercepts, e.g., envelope fits for tasks
+    without any ugrizy rows, can't be evaluated, so they are left out
+    of the model and listed in skipped_tasks.
+    """
+    memory_column = 'maxRSS (GB)'
+    cpu_column = 'cpu_time (m)'
+
+    def __init__(self, fits):
+        """
+        Parameters
+        ----------
+        fits : pd.DataFrame
+            Resource fit table with columns given by FIT_COLUMNS, e.g.,
+            from fit_visit_resources or fit_coadd_resources.
+        """
+        fits = pd.DataFrame(fits, columns=FIT_COLUMNS)
+        nan_fits = fits['slope'].isna() | fits['intercept'].isna()
+        self.skipped_tasks = sorted(set(fits.loc[nan_fits, 'task']))
+        if self.skipped_tasks:
+            print('Skipping tasks with NaN resource fits:',
+                  ', '.join(self.skipped_tasks), flush=True)
+        self.fits = fits[~fits['task'].isin(self.skipped_tasks)]\
+            .set_index(['task', 'column'])
+
+    @staticmethod
+    def from_fits(*fit_tables):
+        """Make a model from one or more resource fit tables."""
+        return ResourceModel(pd.concat(fit_tables, ignore_index=True))
+
+    @property
+    def tasks(self):
+        """Tasks in the model."""
+        return sorted(set(self.fits.index.get_level_values('task')))
+
+    def to_dict(self):
+        """
+        Nested dict of the model parameters keyed by task and resource
+        usage column.
+        """
+        params = {}
+        for (task, column), row in self.fits.iterrows():
+            x_column = row['x_column']
+            params.setdefault(task, {})[column] = dict(
+                slope=float(row['slope']), intercept=float(row['intercept']),
+                x_column=None if pd.isna(x_column) else x_column,
+                method=row['method'])
+        return params
+
+    @staticmethod
+    def from_dict(params):
+        """Make a model from a nested dict from to_dict."""
+        rows = [(task, column, pars['slope'], pars['intercept'],
+                 pars.get('x_column', None), pars.get('method', None))
+                for task, columns in params.items()
+                for column, pars in columns.items()]
+        return ResourceModel(rows)
+
+    def write(self, outfile):
+        """Write the model to a .json or .yaml file."""
+        params = self.to_dict()
+        with open(outfile, 'w') as output:
+            if os.path.splitext(outfile)[1] == '.json':
+                json.dump(params, output, indent=2, sort_keys=True)
+            else:
+                yaml.safe_dump(params, output, default_flow_style=False)
+
+    @staticmethod
+    def read(infile):
+        """Read a model from a .json or .yaml file."""
+        with open(infile) as fobj:
+            if os.path.splitext(infile)[1] == '.json':
+                return ResourceModel.from_dict(json.load(fobj))
+            return ResourceModel.from_dict(yaml.safe_load(fobj))
+
+    def _evaluate(self, task, column, df):
+        row = self.fits.loc[(task, column)]
+        if pd.isna(row['x_column']):
+            return np.full(len(df), row['intercept'], dtype=float)
+        x = df[row['x_column']].to_numpy(dtype=float)
+        return row['slope']*x + row['intercept']
+
+    def predict(self, quanta):
+        """
+        Predict the maxRSS (GB) and cpu time (m) for each quantum.
+
+        Parameters
+        ----------
+        quanta : pd.DataFrame
+            Planned quanta with a task column and the x_columns used by
+            the models for those tasks.
+
+        Returns
+        -------
+        pd.DataFrame A copy of quanta with the predicted maxRSS (GB) and
+        cpu_time (m) columns added.
+
+        Raises
+        ------
+        KeyError if quanta has tasks that aren't in the model, including
+        the skipped tasks with NaN fits.
+        """
+        missing = set(quanta['task']) - set(self.tasks)
+        if missing:
+            message = f'tasks not in resource model: {sorted(missing)}'
+            skipped = sorted(missing.intersection(self.skipped_tasks))
+            if skipped:
+                message += f', with NaN fits for {skipped}'
+            raise KeyError(message)
+        predicted = quanta.reset_index(drop=True)
+        memory = np.zeros(len(predicted))
+        cpu_time = np.zeros(len(predicted))
+        for task, index in predicted.groupby('task').indices.items():
+            df = predicted.iloc[index]
+            memory[index] = self._evaluate(task, self.memory_column, df)
+            cpu_time[index] = self._evaluate(task, self.cpu_column, df)
+        return predicted.assign(**{self.memory_column: memory,
+                                   self.cpu_column: cpu_time})
+
+    def node_hours(self, quanta, cores_per_node=128, memory_per_node=512):
+        """
+        Estimate the node-hours and peak memory per job for each task.
+        The number of quanta that can run at once on a node is the
+        number of cores, reduced if needed so that the predicted
+        memory of the quanta fits on the node.
+
+        Parameters
+        ----------
+        quanta : pd.DataFrame
+            Planned quanta.  See predict.
+        cores_per_node : int [128]
+            Number of cores per node.
+        memory_per_node : float [512]
+            Memory per node in GB.
+
+        Returns
+        -------
+        pd.DataFrame with the number of quanta, cpu hours, node-hours,
+        and peak and mean maxRSS (GB) for each task, and a 'total' row.
+        """
+        df = self.predict(quanta)
+        memory = np.maximum(df[self.memory_column].to_numpy(), 1e-3)
+        jobs_per_node = np.clip(np.floor(memory_per_node/memory), 1,
+                                cores_per_node)
+        df['cpu_hours'] = df[self.cpu_column]/60.
+        df['node_hours'] = df['cpu_hours']/jobs_per_node
+        summary = df.groupby('task').agg(
+            num_quanta=('task', 'size'), cpu_hours=('cpu_hours', 'sum'),
+            node_hours=('node_hours', 'sum'),
+            peak_memory=(self.memory_column, 'max'),
+            mean_memory=(self.memory_column, 'mean'))
+        summary.loc['total'] = [summary['num_quanta'].sum(),
+                                summary['cpu_hours'].sum(),
+                                summary['node_hours'].sum(),
+                                summary['peak_memory'].max(),
+                                df[self.memory_column].mean()]
+        return summary.astype({'num_quanta': int})
+
+    def bps_overrides(self, quanta=None, memory_margin=1.1, request_cpus=1):
+        """
+        Per-task bps requestMemory (MB) and requestCpus values.  The
+        requested memory is the peak predicted maxRSS times
+        memory_margin.  Models with an x_column need the planned quanta
+        to evaluate the peak memory, so those tasks are omitted if
+        quanta isn't given.  The skipped tasks with NaN fits are also
+        omitted.
+
+        Returns
+        -------
+        dict with a 'pipetask' entry of per-task request values, for
+        inclusion in a bps yaml file.
+        """
+        peak_memory = {}
+        if quanta is not None:
+            peak_memory = self.predict(quanta).groupby('task')\
+                              [self.memory_column].max().to_dict()
+        overrides = {}
+        for task in self.tasks:
+            if task in peak_memory:
+                memory = peak_memory[task]
+            elif pd.isna(self.fits.loc[(task, self.memory_column),
+                                       'x_column']):
+                memory = self.fits.loc[(task, self.memory_column),
+                                       'intercept']
+            else:
+                continue
+            overrides[task] = dict(
+                requestMemory=int(np.ceil(memory*memory_margin*1024)),
+                requestCpus=request_cpus)
+        return {'pipetask': overrides}
+
+    def write_bps_overrides(self, outfile, **kwargs):
+        """Write the bps_overrides output to a yaml file."""
+        with open(outfile, 'w') as output:
+            yaml.safe_dump(self.bps_overrides(**kwargs), output,
+                           default_flow_style=False)
@@ -0,0 +1,72 @@
+"""
+Persistent sqlite3 cache of the resource usage values extracted from
+task metadata datasets, keyed by dataset id.
+"""
+import sqlite3
+
+__all__ = ['RECORD_FIELDS', 'ResourceUsageCache']
+
+
+# Fields of the resource usage record extracted for each metadata
+# dataset.  'frame' is 'visit' or 'coadd' for the data frame that the
+# record goes into, or None for datasets that aren't tabulated, e.g.,
+# metadata without memory info.
+RECORD_FIELDS = ('dataset_id', 'task', 'frame', 'detector', 'visit',
+                 'tract', 'patch', 'band', 'maxRSS', 'wall_time',
+                 'cpu_time')
+
+
+class ResourceUsageCache:
+    """
+    sqlite3 cache of resource usage records keyed by the dataset ids of
+    the metadata datasets, with counts of cache hits and misses.
+    """
+    def __init__(self, cache_file, table='resource_usage'):
+        self.cache_file = cache_file
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        with sqlite3.connect(cache_file) as con:
+            con.execute(f'create table if not exists {table} '
+                        '(dataset_id TEXT PRIMARY KEY, task TEXT, '
+                        'frame TEXT, detector INTEGER, visit INTEGER, '
+                        'tract INTEGER, patch INTEGER, band TEXT, '
+                        'maxRSS REAL, wall_time REAL, cpu_time REAL)')
+            con.execute(f'create index if not exists {table}_task_idx '
+                        f'on {table} (task)')
+
+    def split(self, task, dsrefs, refresh_ids=()):
+        """
+        Split the dataset refs for a task into the cached records and
+        the refs that are not in the cache or whose ids are in
+        refresh_ids.  The hit and miss counts are updated accordingly.
+
+        Returns
+        -------
+        (list, list) The cached records and the uncached dataset refs.
+        """
+        with sqlite3.connect(self.cache_file) as con:
+            cached = {row[0]: row for row in
+                      con.execute(f'select * from {self.table} '
+                                  'where task=?', (task,))}
+        records, misses = [], []
+        for dsref in dsrefs:
+            dataset_id = str(dsref.id)
+            if dataset_id in cached and dataset_id not in refresh_ids:
+                records.append(cached[dataset_id])
+            else:
+                misses.append(dsref)
+        self.hits += len(records)
+        self.misses += len(misses)
+        return records, misses
+
+    def add(self, records):
+        """Insert or replace records in the cache."""
+        placeholders = ', '.join('?'*len(RECORD_FIELDS))
+        with sqlite3.connect(self.cache_file) as con:
+            con.executemany(f'insert or replace into {self.table} '
+                            f'values ({placeholders})', records)
+
+    def __str__(self):
+        return (f'{self.cache_file}: {self.hits} hits, '
+                f'{self.misses} misses')
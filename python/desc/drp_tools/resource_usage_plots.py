@@ -1,122 +1,254 @@
-from collections import defaultdict
+import time
+import multiprocessing
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 import pandas as pd
+from .resource_fits import RESOURCE_COLUMNS, PERCENTILE_TASKS, \
+    fit_visit_resources, fit_coadd_resources, fit_upper_envelope, \
+    percentile_value, resource_params as params_from_fits
 
 
 __all__ = ['make_visit_resource_usage_plots',
            'make_coadd_resource_usage_plots']
 
 
-def fit_upper_envelope(x, y):
-    df = pd.DataFrame(data=dict(x=x, y=y))
-    xvals = sorted(list(set(x)))
-    yvals = []
-    for xval in xvals:
-        yvals.append(np.max(df.query(f'x=={xval}')['y']))
-    pars = np.polyfit(xvals, yvals, 1)
-    if pars[0] <= 0:
-        # Can't have negative slope, so fit a constant line instead.
-        pars = (0, np.polyfit(xvals, yvals, 0)[0])
-    return pars
+# The fitting functions moved to resource_fits.  These names are kept
+# so that existing code that imports them from this module still works.
+# fit_upper_envelope is re-exported as is.
+def get_percentile_value(xx, percentile=0.95):
+    """
+    Value at index int(percentile*N) of the sorted non-NaN values of
+    xx.  Use resource_fits.percentile_value instead.
 
+    Raises
+    ------
+    IndexError if xx has no non-NaN values.
+    """
+    value = percentile_value(xx, percentile=percentile)
+    if np.isnan(value):
+        raise IndexError('no non-NaN values')
+    return value
 
-def get_percentile_value(xx, percentile=0.95):
-    xvals = np.array([_ for _ in xx if _ == _])
-    index = int(percentile*len(xvals))
-    return sorted(xvals)[index]
-
-
-def make_visit_resource_usage_plots(df_visit, alpha=1, output_label=None):
-    bands = 'ugrizy'
-    resource_params = defaultdict(dict)
-    for task in sorted(list(set(df_visit['task']))):
-        df = df_visit.query(f"task == '{task}'")
-        plt.figure(figsize=(8, 4))
-        for i, column in enumerate(('cpu_time (m)', 'maxRSS (GB)'), 1):
-            plt.subplot(1, 2, i)
-            for band in bands:
-                my_df = df.query(f"band == '{band}'")
-                plt.hist(my_df[column], bins=30, alpha=alpha, label=band)
-            pars = (0, get_percentile_value(df[column]))
-            resource_params[task][column] = pars
-            plt.axvline(pars[1], linestyle='--')
-            plt.xlabel(column)
-            plt.legend(fontsize='x-small')
+
+BANDS = 'ugrizy'
+
+
+def _band_slices(df, bands=BANDS):
+    """Split a data frame into per-band slices for the listed bands."""
+    by_band = dict(tuple(df.groupby('band', sort=False)))
+    return [(band, by_band.get(band, df.iloc[:0])) for band in bands]
+
+
+def draw_visit_task(fig, task, df, params, alpha=1):
+    """
+    Draw the cpu time and maxRSS histograms for a visit-level task.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to draw on.
+    task : str
+        Task name.
+    df : pd.DataFrame
+        Resource usage data for the task.
+    params : dict
+        (slope, intercept) tuples keyed by resource usage column.
+    alpha : float [1]
+        Histogram transparency.
+    """
+    band_slices = _band_slices(df)
+    for ax, column in zip(fig.subplots(1, 2), RESOURCE_COLUMNS):
+        for band, my_df in band_slices:
+            ax.hist(my_df[column], bins=30, alpha=alpha, label=band)
+        ax.axvline(params[column][1], linestyle='--')
+        ax.set_xlabel(column)
+        ax.legend(fontsize='x-small')
+    fig.tight_layout(rect=(0, 0, 1, 0.95))
+    fig.suptitle(task)
+
+
+def draw_coadd_task(fig, task, df, params, methods):
+    """
+    Draw the cpu time and maxRSS for a coadd-level task with the
+    resource fits.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to draw on.
+    task : str
+        Task name.
+    df : pd.DataFrame
+        Resource usage data for the task.
+    params : dict
+        (slope, intercept) tuples keyed by resource usage column.
+    methods : dict
+        Fit methods, 'percentile' or 'envelope', keyed by resource
+        usage column.
+    """
+    band_slices = _band_slices(df)
+    for ax, column in zip(fig.subplots(1, 2), RESOURCE_COLUMNS):
+        pars = params[column]
+        if task == 'deblend':
+            x_col = 'merged detections'
+            ax.scatter(df[x_col], df[column], s=2)
+            ax.set_xlabel(x_col)
+            ax.set_ylabel(column)
+            ax.axhline(pars[1], linestyle='--')
+            continue
+        if methods[column] == 'envelope':
+            yvals = []
+            for band, my_df in band_slices:
+                yvals.extend(my_df[column])
+                ax.scatter(my_df['n_max'], my_df[column], s=2, label=band)
+            ax.set_ylim(0, 1.05*max(yvals))
+            func = np.poly1d(pars)
+            xvals = df.loc[df['band'].isin(list(BANDS)), 'n_max']
+            xx = np.linspace(min(xvals), max(xvals), 100)
+            ax.plot(xx, func(xx), linestyle='--')
+        elif task in PERCENTILE_TASKS:
+            for band, my_df in band_slices:
+                ax.hist(my_df[column], bins=30, label=band)
+            ax.axvline(pars[1], linestyle='--')
+        else:
+            ax.scatter(df['n_max'], df[column], s=2,
+                       label=str(df['band'].iloc[0]))
+            ax.axhline(pars[1], linestyle='--')
+        ax.legend(fontsize='x-small')
+        if task in PERCENTILE_TASKS:
+            ax.set_xlabel(column)
+            ax.set_ylabel('entries / bin')
+        else:
+            ax.set_xlabel('max(nImage)')
+            ax.set_ylabel(column)
+    fig.tight_layout(rect=(0, 0, 1, 0.95))
+    fig.suptitle(task)
+
+
+_DRAW_FUNCS = {'visit': draw_visit_task, 'coadd': draw_coadd_task}
+
+
+def _render_task(job):
+    """
+    Draw and save the figure for one task with the object-oriented
+    API, so that the figure isn't registered with pyplot and its
+    memory is released as soon as it is saved.
+
+    Returns
+    -------
+    (str, float) The task name and the rendering time in seconds.
+    """
+    t0 = time.time()
+    frame, task, df, outfile, args = job
+    fig = Figure(figsize=(8, 4))
+    _DRAW_FUNCS[frame](fig, task, df, *args)
+    fig.savefig(outfile)
+    fig.clear()
+    return task, time.time() - t0
+
+
+def _render_figures(jobs, processes):
+    """
+    Render the figures for a list of jobs, in a pool of processes if
+    processes > 1, and print a summary of the rendering times.
+    """
+    t0 = time.time()
+    if processes > 1:
+        with multiprocessing.Pool(processes=processes) as pool:
+            timings = list(pool.imap_unordered(_render_task, jobs))
+    else:
+        timings = [_render_task(job) for job in jobs]
+    if not timings:
+        return
+    wall_time = time.time() - t0
+    task, slowest = max(timings, key=lambda _: _[1])
+    print(f'rendered {len(timings)} figures in {wall_time:.1f} s '
+          f'({sum(_[1] for _ in timings):.1f} s total render time, '
+          f'slowest: {task} {slowest:.1f} s)', flush=True)
+
+
+def _plot_jobs(frame, task_slices, output_label, processes, args):
+    """
+    Draw the figures for each (task, df) slice.  If output_label is
+    None, the figures are drawn with pyplot and left open for display.
+    Otherwise, they are rendered to png files with the Agg canvas.
+    """
+    if output_label is None:
+        for task, df in task_slices:
+            fig = plt.figure(figsize=(8, 4))
+            _DRAW_FUNCS[frame](fig, task, df, *args[task])
+        return
+    jobs = [(frame, task, df, f'{task}_{output_label}.png', args[task])
+            for task, df in task_slices]
+    _render_figures(jobs, processes)
+
+
+def make_visit_resource_usage_plots(df_visit, alpha=1, output_label=None,
+                                    fits=None, processes=1):
+    """
+    Plot the cpu time and maxRSS distributions for each visit-level
+    task with the resource fit values.  The fits are computed with
+    fit_visit_resources if they aren't provided.
+
+    If output_label is given, the figures are written to
+    '{task}_{output_label}.png' files and closed.  For processes > 1,
+    the figures are rendered in a pool of processes, each of which is
+    sent only the data for the task it's plotting.
+
+    Returns
+    -------
+    dict of (slope, intercept) tuples keyed by task and column.
+    """
+    if fits is None:
+        fits = fit_visit_resources(df_visit)
+    resource_params = params_from_fits(fits)
+    for task in resource_params:
+        for column in RESOURCE_COLUMNS:
             print(task, column, resource_params[task][column])
-        plt.tight_layout(rect=(0, 0, 1, 0.95))
-        plt.suptitle(task)
-        if output_label is not None:
-            outfile = f'{task}_{output_label}.png'
-            plt.savefig(outfile)
-    return dict(resource_params)
-
-
-def make_coadd_resource_usage_plots(df_coadd, output_label=None):
-    tasks = sorted([_ for _ in set(df_coadd['task']) if
-                    ('consolidate' not in _ and 'isolatedStar' not in _)])
-    bands = 'ugrizy'
-
-    resource_params = defaultdict(dict)
-    for task in tasks:
-        df = df_coadd.query(f"task == '{task}'")
-        plt.figure(figsize=(8, 4))
-        for i, column in enumerate(('cpu_time (m)', 'maxRSS (GB)'), 1):
-            plt.subplot(1, 2, i)
-            if task == 'deblend':
-                x_col = 'merged detections'
-                plt.scatter(df[x_col], df[column], s=2)
-                plt.xlabel(x_col)
-                plt.ylabel(column)
-                pars = (0, get_percentile_value(df[column]))
-                plt.axhline(pars[1], linestyle='--')
-                resource_params[task][column] = pars
-            else:
-                if len(set(df['band'])) == 1:
-                    plt.scatter(df['n_max'], df[column], s=2, label=band)
-                    pars = (0, get_percentile_value(df[column]))
-                    plt.axhline(pars[1], linestyle='--')
-                    resource_params[task][column] = pars
-                else:
-                    xvals, yvals = [], []
-                    for band in bands:
-                        my_df = df.query(f"band == '{band}'")
-                        if task in ('healSparsePropertyMaps',):
-                            plt.hist(my_df[column], bins=30, label=band)
-                            xvals.extend(my_df[column])
-                        else:
-                            xvals.extend(my_df['n_max'])
-                            yvals.extend(my_df[column])
-                            plt.scatter(my_df['n_max'], my_df[column], s=2,
-                                        label=band)
-                    if task in ('healSparsePropertyMaps',):
-                        pars = (0, get_percentile_value(xvals))
-                        plt.axvline(pars[1], linestyle='--')
-                        resource_params[task][column] = pars
-                    else:
-                        plt.ylim(0, 1.05*max(yvals))
-                        pars = fit_upper_envelope(xvals, yvals)
-                        resource_params[task][column] = tuple(pars)
-                        func = np.poly1d(pars)
-                        xx = np.linspace(min(xvals), max(xvals), 100)
-                        plt.plot(xx, func(xx), linestyle='--')
-                plt.legend(fontsize='x-small')
-                if task in ('healSparsePropertyMaps',):
-                    plt.xlabel(column)
-                    plt.ylabel('entries / bin')
-                else:
-                    plt.xlabel('max(nImage)')
-                    plt.ylabel(column)
-                plt.tight_layout(rect=(0, 0, 1, 0.95))
-            try:
-                print(task, column, resource_params[task][column])
-            except Exception as eobj:
-                print(task, eobj)
-        plt.suptitle(task)
-        if output_label is not None:
-            outfile = f'{task}_{output_label}.png'
-            plt.savefig(outfile)
-    return dict(resource_params)
+    columns = ['band', *RESOURCE_COLUMNS]
+    task_slices = [(task, df[columns]) for task, df
+                   in df_visit.groupby('task', sort=True)]
+    args = {task: (resource_params[task], alpha) for task in resource_params}
+    _plot_jobs('visit', task_slices, output_label, processes, args)
+    return resource_params
+
+
+def make_coadd_resource_usage_plots(df_coadd, output_label=None, fits=None,
+                                    processes=1):
+    """
+    Plot the cpu time and maxRSS for each coadd-level task with the
+    resource fits.  The fits are computed with fit_coadd_resources if
+    they aren't provided.
+
+    If output_label is given, the figures are written to
+    '{task}_{output_label}.png' files and closed.  For processes > 1,
+    the figures are rendered in a pool of processes, each of which is
+    sent only the data for the task it's plotting.
+
+    Returns
+    -------
+    dict of (slope, intercept) tuples keyed by task and column.
+    """
+    if fits is None:
+        fits = fit_coadd_resources(df_coadd)
+    resource_params = params_from_fits(fits)
+    methods = {}
+    for row in fits.itertuples(index=False):
+        methods.setdefault(row.task, {})[row.column] = row.method
+    for task in resource_params:
+        for column in RESOURCE_COLUMNS:
+            print(task, column, resource_params[task][column])
+    columns = [_ for _ in ('band', 'n_max', 'merged detections',
+                           *RESOURCE_COLUMNS) if _ in df_coadd]
+    task_slices = [(task, df[columns]) for task, df
+                   in df_coadd.groupby('task', sort=True)
+                   if task in resource_params]
+    args = {task: (resource_params[task], methods[task])
+            for task in resource_params}
+    _plot_jobs('coadd', task_slices, output_label, processes, args)
+    return resource_params
+
 
 if __name__ == '__main__':
     df_coadd = pd.read_parquet('coadd.parq')
@@ -2,11 +2,11 @@
 Code to generate bps yaml files for single frame processing.
 """
 import os
+import heapq
 import sqlite3
-import numpy as np
 import pandas as pd
 
-__all__ = ['SfpYamlFactory']
+__all__ = ['SfpYamlFactory', 'partition_visits']
 
 # Template for making bps yaml files.  Use '$(...)' for env vars to be
 # resolved by bps.  The '$()' will be replaced by '${}' after the
@@ -24,6 +24,65 @@ payload:
   dataQuery: "{dataQuery}"
 """
 
+def partition_visits(costs, num_parts, quanta=None, max_quanta_per_part=None):
+    """
+    Partition visits into parts with nearly equal total costs using
+    longest-processing-time-first bin packing: visits are assigned in
+    order of decreasing cost to the part with the lowest total cost so
+    far.  If max_quanta_per_part is given, a visit only goes to a part
+    with room for its quanta, and new parts are added as needed.
+
+    Parameters
+    ----------
+    costs : dict
+        Predicted cost of each visit, keyed by visit.
+    num_parts : int
+        Minimum number of parts.
+    quanta : dict [None]
+        Number of quanta for each visit, keyed by visit.  If None, each
+        visit has one quantum.
+    max_quanta_per_part : int [None]
+        Maximum number of quanta in a part.
+
+    Returns
+    -------
+    (list, list, list) Sorted lists of the visits in each part, and
+    the total cost and number of quanta of each part.
+    """
+    if quanta is None:
+        quanta = {visit: 1 for visit in costs}
+    if max_quanta_per_part is not None:
+        too_big = [_ for _ in costs if quanta[_] > max_quanta_per_part]
+        if too_big:
+            raise ValueError(f'visit {too_big[0]} has {quanta[too_big[0]]} '
+                             'quanta, which is more than '
+                             f'max_quanta_per_part={max_quanta_per_part}')
+    parts = [[] for _ in range(num_parts)]
+    part_costs = [0]*num_parts
+    part_quanta = [0]*num_parts
+    heap = [(0, part) for part in range(num_parts)]
+    for visit in sorted(costs, key=lambda _: (-costs[_], _)):
+        # Set aside the parts without room for this visit.
+        full = []
+        while (heap and max_quanta_per_part is not None and
+               part_quanta[heap[0][1]] + quanta[visit] > max_quanta_per_part):
+            full.append(heapq.heappop(heap))
+        if heap:
+            _, part = heapq.heappop(heap)
+        else:
+            part = len(parts)
+            parts.append([])
+            part_costs.append(0)
+            part_quanta.append(0)
+        parts[part].append(visit)
+        part_costs[part] += costs[visit]
+        part_quanta[part] += quanta[visit]
+        heapq.heappush(heap, (part_costs[part], part))
+        for item in full:
+            heapq.heappush(heap, item)
+    return [sorted(_) for _ in parts], part_costs, part_quanta
+
+
 class SfpYamlFactory:
     """
     Class to generate bps yaml files for single frame processing given
@@ -36,18 +95,73 @@ class SfpYamlFactory:
         ----------
         overlap_db : sqlite3 db file
             This file contains an 'overlaps' table with the ccd-visits
-            that overlap each patch in the repo skymap.
+            that overlap each patch in the repo skymap.  The db file is
+            only read.  The queries use the (tract, visit) index created
+            by compact_shards, which can be added to older db files with
+            create_overlap_indexes(overlap_db, 'overlaps').
+        repo : str
+            Path to the data repository.
         """
         if not os.path.isfile(overlap_db):
             raise FileNotFoundError(f'{overlap_db} not found')
         self.overlap_db = overlap_db
         self.repo = repo
 
+    def query_overlaps(self, tracts, visit_range=None, processed_visits=None,
+                       processed_visits_table=None):
+        """
+        Query the overlaps table for the ccd-visits that overlap the
+        specified tracts, excluding processed visits.  The tracts and
+        processed visits are loaded into indexed temporary tables and
+        the processed visits are excluded with an anti-join, so the
+        query doesn't grow with the number of processed visits.  See
+        the create method for a description of the parameters.
+
+        Returns
+        -------
+        pd.DataFrame of the rows in the overlaps table.
+        """
+        if isinstance(processed_visits, str):
+            with open(processed_visits) as fobj:
+                processed_visits = [int(line) for line in fobj
+                                    if line.strip()]
+        query = ('select o.* from overlaps as o '
+                 'join temp.query_tracts as t on o.tract=t.tract '
+                 'where not exists (select 1 from temp.processed_visits '
+                 'as p where p.visit=o.visit)')
+        params = []
+        if visit_range is not None:
+            query += ' and o.visit between ? and ?'
+            params.extend(int(_) for _ in visit_range)
+        with sqlite3.connect(self.overlap_db) as con:
+            con.execute('create temp table query_tracts '
+                        '(tract INTEGER PRIMARY KEY)')
+            con.executemany('insert or ignore into temp.query_tracts '
+                            'values (?)', [(int(_),) for _ in tracts])
+            con.execute('create temp table processed_visits '
+                        '(visit INTEGER PRIMARY KEY)')
+            if processed_visits is not None:
+                con.executemany('insert or ignore into temp.processed_visits '
+                                'values (?)',
+                                [(int(_),) for _ in processed_visits])
+            if processed_visits_table is not None:
+                db_file, table = processed_visits_table
+                con.execute('attach database ? as processed_db', (db_file,))
+                con.execute('insert or ignore into temp.processed_visits '
+                            f'select visit from processed_db.{table}')
+            df0 = pd.read_sql(query, con, params=params)
+        con.close()
+        return df0
+
     def create(self, tracts, num_parts=1, visit_range=None,
-               processed_visits=None):
+               processed_visits=None, visit_costs=None,
+               max_quanta_per_part=None, processed_visits_table=None,
+               return_counts=False):
         """
         Create bps yaml files for single-frame processing of the
-        visits that overlap with the specified tracts.
+        visits that overlap with the specified tracts.  The visits are
+        divided among the parts so that the parts have nearly equal
+        predicted costs.
 
         Parameters
         ----------
@@ -58,42 +172,65 @@ class SfpYamlFactory:
             number of bps yaml files.
         visit_range : (int, int) [None]
             Range of visits to consider.
-        processed_visits : list [None]
+        processed_visits : list or str [None]
             List of visits that have already been processed and which
-            should be excluded.
+            should be excluded, or the name of a text file with one
+            visit per line.
+        visit_costs : dict [None]
+            Predicted processing cost of each visit, keyed by visit.  If
+            None, the number of ccd-visits overlapping the tracts is
+            used.
+        max_quanta_per_part : int [None]
+            Maximum number of ccd-visit quanta in a part.  More than
+            num_parts parts are created if needed.
+        processed_visits_table : (str, str) [None]
+            sqlite3 db file and the name of a table in it with a 'visit'
+            column of processed visits to exclude.
+        return_counts : bool [False]
+            If True, also return the number of visits per tract.
 
         Returns
         -------
-        list of visits included in the bps yaml files.
+        list of visits included in the bps yaml files, and if
+        return_counts is True, a pd.Series of the number of those
+        visits that overlap each tract.
         """
         repo = self.repo
         if num_parts < 1:
             raise ValueError('Must have num_parts >= 1.')
-        tract_list = ','.join([str(_) for _ in tracts])
-        query = f'select * from overlaps where tract in ({tract_list})'
-        if visit_range is not None:
-            query += (f' and visit >= {visit_range[0]}'
-                      f' and visit <= {visit_range[1]}')
-        if processed_visits is not None and processed_visits:
-            processed_visit_list \
-                = '(' + ','.join([str(_) for _ in processed_visits]) + ')'
-            query += f' and visit not in {processed_visit_list}'
-        with sqlite3.connect(self.overlap_db) as con:
-            df0 = pd.read_sql(query, con)
+        df0 = self.query_overlaps(
+            tracts, visit_range=visit_range,
+            processed_visits=processed_visits,
+            processed_visits_table=processed_visits_table)
         visits = sorted(list(set(df0['visit'])))
 
-        indexes = np.linspace(0, len(visits) + 1, num_parts + 1, dtype=int)
+        # The single frame processing quanta are ccd-visits, so count
+        # the distinct detectors overlapping the tracts for each visit.
+        if 'detector' in df0:
+            quanta = df0.groupby('visit')['detector'].nunique().to_dict()
+        else:
+            quanta = df0.groupby('visit').size().to_dict()
+        if visit_costs is None:
+            costs = quanta
+        else:
+            costs = {visit: visit_costs[visit] for visit in visits}
+        parts, part_costs, part_quanta \
+            = partition_visits(costs, num_parts, quanta=quanta,
+                               max_quanta_per_part=max_quanta_per_part)
 
         tract_list = '_'.join([str(_) for _ in tracts])
-        for part, (imin, imax) in enumerate(zip(indexes[:-1], indexes[1:])):
+        for part, part_visits in enumerate(parts):
+            if not part_visits:
+                continue
             # Use '[...]' here, and replace with '(...)' after env var
             # delimiters have been replaced.
-            visit_list = '[' + ','.join([str(_) for _ in visits[imin:imax]]) \
-                         + ']'
+            visit_list = '[' + ','.join([str(_) for _ in part_visits]) + ']'
             payloadName = f'sfp_Y1_{tract_list}_visits_part_{part:02d}'
             dataQuery = f"instrument='LSSTCam-imSim' and visit in {visit_list}"
             outfile = f'bps_{payloadName}.yaml'
-            print(outfile)
+            print(f'{outfile}: {len(part_visits)} visits, '
+                  f'{part_quanta[part]} quanta, '
+                  f'predicted cost {part_costs[part]:.1f}')
             with open(outfile, 'w') as output:
                 output_string \
                     = BPS_SFP_YAML.format(**locals())\
@@ -101,4 +238,6 @@ class SfpYamlFactory:
                                   .replace('[', '(').replace(']', ')')
                 output.write(output_string)
 
+        if return_counts:
+            return visits, df0.groupby('tract')['visit'].nunique()
         return visits
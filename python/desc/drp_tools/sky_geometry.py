@@ -0,0 +1,151 @@
+"""
+Vectorized spherical geometry helpers for visit and tract centers.
+Positions are handled as unit vectors so that separations can be
+computed with dot products for whole arrays of coordinates at once.
+"""
+import numpy as np
+
+__all__ = ['unit_vectors', 'angular_separation', 'tangent_plane_polygons',
+           'focal_plane_polygons', 'polygon_edge_normals',
+           'convex_polygons_intersect']
+
+
+def unit_vectors(ra, dec):
+    """
+    Convert RA, Dec values (in degrees) to an (N, 3) array of unit
+    vectors.
+    """
+    ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+    dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec*np.cos(ra), cos_dec*np.sin(ra),
+                            np.sin(dec)))
+
+
+def angular_separation(vec1, vec2):
+    """
+    Angular separation (in degrees) between corresponding rows of two
+    arrays of unit vectors.  This uses the chord length, so it remains
+    accurate for small separations.
+    """
+    chord = np.linalg.norm(np.asarray(vec1) - np.asarray(vec2), axis=-1)
+    return np.degrees(2*np.arcsin(np.clip(chord/2, 0, 1)))
+
+
+# Convex hull of the LSSTCam science rafts in focal plane coordinates
+# (degrees).  The 5x5 raft array is 3.5 degrees across, and the corner
+# rafts are not science rafts.
+LSSTCAM_FOOTPRINT = np.array([(1.75, -1.05), (1.75, 1.05), (1.05, 1.75),
+                              (-1.05, 1.75), (-1.75, 1.05), (-1.75, -1.05),
+                              (-1.05, -1.75), (1.05, -1.75)])
+
+# Radius (degrees) of the circle enclosing the LSSTCam science rafts.
+LSSTCAM_RADIUS = np.hypot(1.75, 1.05)
+
+
+def tangent_plane_polygons(ra, dec, offsets, rot=None):
+    """
+    Project polygons defined in the tangent plane at each of the input
+    positions onto the sphere.
+
+    Parameters
+    ----------
+    ra, dec : array-like
+        Coordinates (degrees) of the tangent points.
+    offsets : np.array
+        (num_vertices, 2) array of tangent plane vertex coordinates in
+        degrees, with the first axis pointing East and the second
+        pointing North for zero rotation.
+    rot : array-like [None]
+        Rotation angles (degrees, North through East) of the polygons.
+
+    Returns
+    -------
+    np.array (num_positions, num_vertices, 3) array of vertex unit
+    vectors.
+    """
+    ra_rad = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+    dec_rad = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+    centers = unit_vectors(ra, dec)
+    east = np.column_stack((-np.sin(ra_rad), np.cos(ra_rad),
+                            np.zeros_like(ra_rad)))
+    north = np.cross(centers, east)
+    xy = np.tan(np.radians(offsets))[None, :, :]
+    if rot is not None:
+        angle = np.radians(np.atleast_1d(np.asarray(rot, dtype=float)))
+        cos_a, sin_a = np.cos(angle)[:, None], np.sin(angle)[:, None]
+        x, y = xy[..., 0], xy[..., 1]
+        xy = np.stack((x*cos_a + y*sin_a, y*cos_a - x*sin_a), axis=-1)
+    vertices = (centers[:, None, :] + xy[..., 0:1]*east[:, None, :]
+                + xy[..., 1:2]*north[:, None, :])
+    return vertices/np.linalg.norm(vertices, axis=-1, keepdims=True)
+
+
+def focal_plane_polygons(ra, dec, rot=None, num_sides=16):
+    """
+    Focal plane footprints of visits as convex spherical polygons.  If
+    the rotation angles are given, the footprint is the convex hull of
+    the LSSTCam science rafts.  Otherwise, a regular polygon with
+    num_sides sides that encloses the LSSTCam footprint at any rotation
+    is used.
+
+    Returns
+    -------
+    np.array (num_visits, num_vertices, 3) array of vertex unit vectors.
+    """
+    if rot is not None:
+        return tangent_plane_polygons(ra, dec, LSSTCAM_FOOTPRINT, rot=rot)
+    # Vertices of the regular polygon circumscribing the circle
+    # enclosing the footprint.  Great circles map to straight lines in
+    # the tangent plane, so this polygon also encloses the footprint on
+    # the sphere.
+    radius = np.degrees(np.arctan(np.tan(np.radians(LSSTCAM_RADIUS))
+                                  /np.cos(np.pi/num_sides)))
+    phi = 2*np.pi*np.arange(num_sides)/num_sides
+    offsets = np.column_stack((radius*np.cos(phi), radius*np.sin(phi)))
+    return tangent_plane_polygons(ra, dec, offsets)
+
+
+def polygon_edge_normals(vertices):
+    """
+    Normals of the great circles containing the edges of convex
+    spherical polygons, oriented so that the polygon interiors are on
+    the positive side.
+
+    Parameters
+    ----------
+    vertices : np.array
+        (..., num_vertices, 3) array of polygon vertex unit vectors,
+        in either clockwise or counterclockwise order.
+    """
+    normals = np.cross(vertices, np.roll(vertices, -1, axis=-2))
+    centroids = np.sum(vertices, axis=-2, keepdims=True)
+    sign = np.sign(np.sum(normals*centroids, axis=-1, keepdims=True))
+    return normals*sign
+
+
+def convex_polygons_intersect(vertices1, vertices2):
+    """
+    Test if pairs of convex spherical polygons intersect.  Each pair
+    of polygons must lie within a hemisphere.  Two such polygons are
+    disjoint if and only if all of the vertices of one polygon lie
+    outside one of the edges of the other.
+
+    Parameters
+    ----------
+    vertices1, vertices2 : np.array
+        (num_pairs, num_vertices, 3) arrays of polygon vertex unit
+        vectors.  The two polygons in a pair can have different
+        numbers of vertices.
+
+    Returns
+    -------
+    np.array of bools
+    """
+    def separated(normals, vertices):
+        # (num_pairs, num_edges, num_vertices) array of the vertex
+        # positions relative to each edge.
+        side = np.einsum('pek,pvk->pev', normals, vertices)
+        return np.any(np.all(side < 0, axis=2), axis=1)
+    return ~(separated(polygon_edge_normals(vertices1), vertices2) |
+             separated(polygon_edge_normals(vertices2), vertices1))
@@ -0,0 +1,162 @@
+"""
+On-disk cache of the skymap tract geometry so that tract centers,
+vertices, and radii can be used without unpickling the skymap or
+importing the LSST stack.
+"""
+import os
+import hashlib
+import pickle
+import numpy as np
+from .sky_geometry import unit_vectors, angular_separation
+
+__all__ = ['SkymapGeometry', 'build_skymap_cache', 'load_skymap_geometry']
+
+
+def file_sha256(filename, blocksize=2**20):
+    """sha256 hex digest of a file's contents."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fobj:
+        for block in iter(lambda: fobj.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class SkymapGeometry:
+    """
+    Tract ids, tract center coordinates, and tract vertex unit vectors
+    for a set of skymap tracts.
+    """
+    def __init__(self, tract_ids, ra, dec, vertices):
+        """
+        Parameters
+        ----------
+        tract_ids : array-like
+            Tract ids.
+        ra, dec : array-like
+            Tract center coordinates in degrees.
+        vertices : array-like
+            (num_tracts, num_vertices, 3) array of tract vertex unit
+            vectors.
+        """
+        self.tract_ids = np.asarray(tract_ids)
+        self.ra = np.asarray(ra, dtype=float)
+        self.dec = np.asarray(dec, dtype=float)
+        self.vertices = np.asarray(vertices, dtype=float)
+        self._rows = {tract_id: i for i, tract_id
+                      in enumerate(self.tract_ids.tolist())}
+
+    def __len__(self):
+        return len(self.tract_ids)
+
+    @property
+    def centers(self):
+        """Tract center unit vectors."""
+        return unit_vectors(self.ra, self.dec)
+
+    @property
+    def radii(self):
+        """Maximum vertex to center distance (degrees) for each tract."""
+        seps = angular_separation(self.vertices, self.centers[:, None, :])
+        return np.max(seps, axis=1)
+
+    @property
+    def max_radius(self):
+        """Maximum vertex to center distance (degrees) over all tracts."""
+        return np.max(self.radii)
+
+    def subset(self, tract_list):
+        """Return the geometry for the tracts in tract_list."""
+        try:
+            rows = [self._rows[tract_id] for tract_id in tract_list]
+        except KeyError as eobj:
+            raise KeyError(f'tract {eobj} not in skymap geometry') from eobj
+        return SkymapGeometry(self.tract_ids[rows], self.ra[rows],
+                              self.dec[rows], self.vertices[rows])
+
+    @staticmethod
+    def from_skymap(skymap, tract_list=None):
+        """
+        Extract the geometry from a skymap object.  If tract_list is
+        None, all of the tracts in the skymap are used.
+        """
+        if tract_list is None:
+            tract_list = [tract.getId() for tract in skymap]
+        ra, dec, vertices = [], [], []
+        for tract_id in tract_list:
+            tract = skymap[tract_id]
+            coord = tract.getCtrCoord()
+            ra.append(coord.getLongitude().asDegrees())
+            dec.append(coord.getLatitude().asDegrees())
+            vertices.append(
+                unit_vectors([_.getLongitude().asDegrees()
+                              for _ in tract.vertex_list],
+                             [_.getLatitude().asDegrees()
+                              for _ in tract.vertex_list]))
+        return SkymapGeometry(tract_list, ra, dec, vertices)
+
+
+def build_skymap_cache(skymap_file, cache_file, tract_list=None):
+    """
+    Unpickle the skymap, extract the tract geometry, and write it to
+    cache_file as an .npz file, along with the modification time, size
+    and sha256 digest of the skymap file.
+
+    Returns
+    -------
+    SkymapGeometry
+    """
+    stat = os.stat(skymap_file)
+    with open(skymap_file, 'rb') as fobj:
+        skymap = pickle.load(fobj)
+    geometry = SkymapGeometry.from_skymap(skymap, tract_list=tract_list)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as output:
+        np.savez(output, tract_ids=geometry.tract_ids, ra=geometry.ra,
+                 dec=geometry.dec, vertices=geometry.vertices,
+                 source_mtime=stat.st_mtime, source_size=stat.st_size,
+                 source_sha256=file_sha256(skymap_file))
+    os.replace(tmp_file, cache_file)
+    return geometry
+
+
+def load_skymap_geometry(skymap_file='/home/DC2/skyMap.pickle',
+                         cache_file=None, check_hash=False):
+    """
+    Load the tract geometry from the cache file, rebuilding the cache
+    from the skymap file if it is missing or stale.  The cache is stale
+    if the modification time or size of the skymap file has changed
+    or, if check_hash is True, if its sha256 digest has changed.  If
+    the skymap file doesn't exist, an existing cache is used as is.
+
+    Parameters
+    ----------
+    skymap_file : str ['/home/DC2/skyMap.pickle']
+        Pickled skymap file.
+    cache_file : str [None]
+        The .npz cache file.  If None, then use
+        '<skymap file basename>_geometry.npz' in the current directory.
+    check_hash : bool [False]
+        Flag to compare the sha256 digest of the skymap file to the
+        cached value.
+
+    Returns
+    -------
+    SkymapGeometry
+    """
+    if cache_file is None:
+        basename = os.path.splitext(os.path.basename(skymap_file))[0]
+        cache_file = f'{basename}_geometry.npz'
+    if os.path.isfile(cache_file):
+        with np.load(cache_file, allow_pickle=False) as cache:
+            geometry = SkymapGeometry(cache['tract_ids'], cache['ra'],
+                                      cache['dec'], cache['vertices'])
+            if not os.path.isfile(skymap_file):
+                return geometry
+            stat = os.stat(skymap_file)
+            valid = (stat.st_mtime == cache['source_mtime'] and
+                     stat.st_size == cache['source_size'])
+            if valid and check_hash:
+                valid = file_sha256(skymap_file) == str(cache['source_sha256'])
+        if valid:
+            return geometry
+    return build_skymap_cache(skymap_file, cache_file)
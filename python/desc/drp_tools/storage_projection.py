@@ -0,0 +1,147 @@
+"""
+Projections of the storage needed for the outputs of a QuantumGraph,
+combining the output counts from the graph with file size statistics
+from example data products.
+"""
+from collections import Counter
+import numpy as np
+import pandas as pd
+import scipy.stats
+import lsst.daf.butler as daf_butler
+from .dp_sizes import load_qgraph, dataset_size_stats
+
+__all__ = ['count_outputs', 'project_storage', 'storage_projection']
+
+
+def count_outputs(qgraph, task_steps=None):
+    """
+    Count the output datasets of a QuantumGraph by task, dataset type,
+    step, and tract in a single pass over the graph nodes.  Only the
+    counts are accumulated, so with the nodes from load_qgraph, which
+    loads them in batches, memory use is set by the batch size rather
+    than the size of the graph.
+
+    Parameters
+    ----------
+    qgraph : iterable
+        QuantumGraph or other iterable of QuantumNodes.  The nodes are
+        only iterated over once, so a generator of nodes can be used.
+    task_steps : dict [None]
+        Step name, e.g., 'step1', keyed by task label.  Tasks that
+        aren't in task_steps are assigned to step None.
+
+    Returns
+    -------
+    pd.DataFrame with task, dataset_type, step, tract, and num_files
+    columns.  The tract is NA for outputs without a tract in their
+    data ids.
+    """
+    if task_steps is None:
+        task_steps = {}
+    counts = Counter()
+    for node in qgraph:
+        task = node.taskDef.label
+        step = task_steps.get(task, None)
+        for dstype, dsrefs in node.quantum.outputs.items():
+            for dsref in dsrefs:
+                tract = dsref.dataId.get('tract', None)
+                counts[(task, dstype.name, step, tract)] += 1
+    df = pd.DataFrame([(*key, num_files) for key, num_files
+                       in counts.items()],
+                      columns=['task', 'dataset_type', 'step', 'tract',
+                               'num_files'])
+    return df.astype({'tract': 'Int64'})
+
+
+def project_storage(counts, stats, confidence=0.9):
+    """
+    Project the total storage by task, step, and tract.
+
+    The total size of N files of a dataset type is estimated as
+    N*mean, where mean is the sample mean of the example file sizes.
+    Its variance is N*var + N**2*var/n, where var is the sample
+    variance (ddof=1) of the file sizes and n the number of example
+    files: the first term is from the scatter of the individual file
+    sizes and the second from the uncertainty in the sample mean.
+    Dataset types are treated as independent when the totals are
+    summed.  The variance is unknown for dataset types with a single
+    example file, so the bands of any totals that include them are NaN.
+
+    Parameters
+    ----------
+    counts : pd.DataFrame
+        Output counts from count_outputs.
+    stats : dict
+        SizeStats keyed by (task, dataset type) from dataset_size_stats.
+    confidence : float [0.9]
+        Confidence level of the (lower, upper) bands.
+
+    Returns
+    -------
+    dict of pd.DataFrames keyed by 'task', 'step', and 'tract', each
+    with num_files, total (GB), lower (GB), and upper (GB) columns.
+    Dataset types without example files contribute to num_files, but
+    not to the sizes, and are listed in num_unsized_files.
+    """
+    df = counts.copy()
+    keys = list(zip(df['task'], df['dataset_type']))
+    mean = np.array([stats[_].mean if _ in stats and stats[_].count
+                     else np.nan for _ in keys])
+    var = np.array([stats[_].variance if _ in stats and stats[_].count
+                    else np.nan for _ in keys])
+    num_examples = np.array([stats[_].count if _ in stats else 0
+                             for _ in keys])
+    num_files = df['num_files'].to_numpy()
+    sized = num_examples > 0
+    df['total (GB)'] = np.where(sized, num_files*mean, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['variance'] = np.where(sized, num_files*var
+                                  + num_files**2*var/num_examples, 0)
+    df['num_unsized_files'] = np.where(sized, 0, num_files)
+    df['unknown_variance'] = df['variance'].isna()
+    df['variance'] = df['variance'].fillna(0)
+
+    z = scipy.stats.norm.ppf(0.5 + confidence/2.)
+    projections = {}
+    for level in ('task', 'step', 'tract'):
+        summed = df.groupby(level, dropna=False)[
+            ['num_files', 'num_unsized_files', 'total (GB)', 'variance',
+             'unknown_variance']].sum()
+        sigma = np.sqrt(summed.pop('variance'))
+        sigma[summed.pop('unknown_variance') > 0] = np.nan
+        summed['lower (GB)'] = np.clip(summed['total (GB)'] - z*sigma, 0,
+                                       None)
+        summed['upper (GB)'] = summed['total (GB)'] + z*sigma
+        projections[level] = summed.reset_index()
+    return projections
+
+
+def storage_projection(qgraph_file, repo, collection, task_steps=None,
+                       sample_size=100, confidence=0.9, threads=16,
+                       seed=None, outfile_prefix=None, batch_size=10000):
+    """
+    Project the storage needs for the outputs of a QuantumGraph, using
+    file size statistics from sample_size example files per dataset
+    type in the specified collection.  The graph nodes are loaded
+    batch_size nodes at a time with load_qgraph.
+
+    If outfile_prefix is given, the per-task, per-step, and per-tract
+    projections are written to '{outfile_prefix}_{level}.csv' files.
+
+    Returns
+    -------
+    dict of pd.DataFrames keyed by 'task', 'step', and 'tract'.  See
+    project_storage.
+    """
+    counts = count_outputs(load_qgraph(qgraph_file, batch_size=batch_size),
+                           task_steps=task_steps)
+    dstypes = {task: set(df['dataset_type'])
+               for task, df in counts.groupby('task')}
+    butler = daf_butler.Butler(repo, collections=[collection])
+    stats = dataset_size_stats(butler, dstypes, sample_size=sample_size,
+                               threads=threads, seed=seed)
+    projections = project_storage(counts, stats, confidence=confidence)
+    if outfile_prefix is not None:
+        for level, df in projections.items():
+            df.to_csv(f'{outfile_prefix}_{level}.csv', index=False)
+    return projections
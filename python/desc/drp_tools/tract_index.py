@@ -0,0 +1,147 @@
+"""
+Spatial index of tract centers for finding the tracts that overlap
+visits on the sphere.
+"""
+import sqlite3
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from .sky_geometry import unit_vectors, angular_separation
+
+__all__ = ['TractIndex']
+
+
+def chord_length(sep):
+    """Chord length between unit vectors separated by sep degrees."""
+    return 2*np.sin(np.radians(sep)/2)
+
+
+class TractIndex:
+    """
+    k-d tree of tract center unit vectors.  Since the distance between
+    two unit vectors is a monotonic function of their angular
+    separation, radius and nearest-tract queries on the tree are exact
+    on the sphere, so there are no special cases for RA wraparound or
+    for visits near the poles.
+    """
+    def __init__(self, tract_ids, ra, dec):
+        """
+        Parameters
+        ----------
+        tract_ids : array-like
+            Tract ids.
+        ra, dec : array-like
+            Tract center coordinates in degrees.
+        """
+        self.tract_ids = np.asarray(tract_ids)
+        self.ra = np.asarray(ra, dtype=float)
+        self.dec = np.asarray(dec, dtype=float)
+        if len(self.tract_ids) == 0:
+            raise ValueError('TractIndex needs at least one tract.')
+        self.vecs = unit_vectors(self.ra, self.dec)
+        self._tree = cKDTree(self.vecs)
+
+    @staticmethod
+    def from_dataframe(df_tracts):
+        """Build the index from a data frame with id, ra, dec columns."""
+        return TractIndex(df_tracts['id'].to_numpy(),
+                          df_tracts['ra'].to_numpy(),
+                          df_tracts['dec'].to_numpy())
+
+    @staticmethod
+    def from_db(db_file, tract_table='Tract'):
+        """Build the index from the Tract table of an overlap db file."""
+        with sqlite3.connect(db_file) as con:
+            df_tracts = pd.read_sql(f'select id, ra, dec from {tract_table}',
+                                    con)
+        return TractIndex.from_dataframe(df_tracts)
+
+    @staticmethod
+    def from_skymap(skymap, tract_list=None):
+        """
+        Build the index from a skymap object.  If tract_list is None,
+        all of the tracts in the skymap are used.
+        """
+        if tract_list is None:
+            tract_list = [tract.getId() for tract in skymap]
+        ra, dec = [], []
+        for tract_id in tract_list:
+            coord = skymap[tract_id].getCtrCoord()
+            ra.append(coord.getLongitude().asDegrees())
+            dec.append(coord.getLatitude().asDegrees())
+        return TractIndex(tract_list, ra, dec)
+
+    def __len__(self):
+        return len(self.tract_ids)
+
+    def query_radius(self, ra, dec, max_sep):
+        """
+        Find all of the tracts with centers within max_sep degrees of
+        each of the input positions.
+
+        Returns
+        -------
+        (np.array, np.array) Indexes into the input position arrays and
+        into the tract arrays of the matching pairs, ordered by position
+        and then by tract.
+        """
+        vecs = unit_vectors(ra, dec)
+        # Query with a slightly larger radius and apply the final cut
+        # with dot products, so that pairs right at max_sep are treated
+        # consistently, independent of the k-d tree's distance
+        # rounding.
+        radius = chord_length(max_sep)*(1 + 1e-8)
+        tree = cKDTree(vecs)
+        pairs = tree.sparse_distance_matrix(self._tree, radius,
+                                            output_type='ndarray')
+        pos_index = pairs['i'].astype(int)
+        tract_index = pairs['j'].astype(int)
+        dots = np.sum(vecs[pos_index]*self.vecs[tract_index], axis=1)
+        keep = dots >= np.cos(np.radians(max_sep))
+        pos_index, tract_index = pos_index[keep], tract_index[keep]
+        order = np.lexsort((tract_index, pos_index))
+        return pos_index[order], tract_index[order]
+
+    def nearest(self, ra, dec):
+        """
+        Find the nearest tract to each of the input positions.
+
+        Returns
+        -------
+        (np.array, np.array) Indexes into the tract arrays of the
+        nearest tracts and the separations in degrees.
+        """
+        vecs = unit_vectors(ra, dec)
+        _, index = self._tree.query(vecs, k=1)
+        return index, angular_separation(vecs, self.vecs[index])
+
+    def find_overlaps(self, ra, dec, max_sep=3.15, chunk_size=10000):
+        """
+        Find the overlapping visit-tract pairs, i.e., those with centers
+        within max_sep degrees, and the closest tract for each visit,
+        processing chunk_size visits at a time.
+
+        Returns
+        -------
+        (np.array, np.array, np.array) Indexes into the visit arrays and
+        into the tract arrays of the overlapping visit-tract pairs,
+        ordered by visit and then by tract, and the index of the closest
+        tract to each visit.
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        visit_indexes, tract_indexes = [], []
+        closest = np.empty(len(ra), dtype=int)
+        for imin in range(0, len(ra), chunk_size):
+            imax = imin + chunk_size
+            rows, cols = self.query_radius(ra[imin:imax], dec[imin:imax],
+                                           max_sep)
+            visit_indexes.append(rows + imin)
+            tract_indexes.append(cols)
+            closest[imin:imax] = self.nearest(ra[imin:imax],
+                                              dec[imin:imax])[0]
+        if not visit_indexes:
+            return (np.array([], dtype=int), np.array([], dtype=int),
+                    closest)
+        return (np.concatenate(visit_indexes), np.concatenate(tract_indexes),
+                closest)
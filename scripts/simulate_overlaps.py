@@ -1,13 +1,10 @@
-import sys
-import time
 import pickle
-import multiprocessing
 import sqlite3
-import numpy as np
 import pandas as pd
 from desc.gen3_workflow.resource_estimator import SkyMapPolygons, \
     OverlapFinder, extract_coadds, unique_tuples, get_pipetask_resource_funcs, \
     tabulate_pipetask_resources, total_node_hours
+from desc.drp_tools import run_batches, compact_shards
 
 # Get skymap convex polygons.
 sky_map_file = ('/global/cscratch1/sd/jchiang8/desc/gen3_tests/gen3_repos/'
@@ -31,26 +28,16 @@ with sqlite3.connect(opsim_db_file) as con:
 overlap_finder = OverlapFinder(opsim_db_file, skymap_polygons,
                                visit_range=(min(visits), max(visits)))
 
-num_visits = len(visits)
 batch_size = 500
-num_batches = num_visits//batch_size + 1
-indexes = [int(_) for _ in np.linspace(96101, num_visits+1, num_batches)]
-
 processes = 64
+output_dir = 'overlap_shards'
 
-def write_overlaps(visits, prefix):
+def get_overlaps(visits):
     global overlap_finder
-    df = overlap_finder.get_overlaps(visits)
-    df.to_pickle(f'{prefix}.pickle')
+    return overlap_finder.get_overlaps(visits)
 
-with multiprocessing.Pool(processes=processes) as pool:
-    workers = []
-    for imin, imax in zip(indexes[:-1], indexes[1:]):
-        print(imin, imax)
-        sys.stdout.flush()
-        prefix = f'overlaps_{imin:05d}_{imax:05d}'
-        args = (visits[imin:imax], prefix)
-        workers.append(pool.apply_async(write_overlaps, args))
-    pool.close()
-    pool.join()
-    _ = [worker.get() for worker in workers]
+# Batches with shards from previous runs are skipped, so this can be
+# re-run to complete a partially failed simulation.
+run_batches(get_overlaps, visits, output_dir, batch_size=batch_size,
+            processes=processes)
+compact_shards(output_dir, 'overlaps.db', table='overlaps')
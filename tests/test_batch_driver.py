@@ -0,0 +1,119 @@
+"""
+Unit tests for the checkpointed batch driver.
+"""
+import os
+import io
+import shutil
+import sqlite3
+import tempfile
+import contextlib
+import functools
+import unittest
+import pandas as pd
+from desc.drp_tools.batch_driver import BatchManifest, run_batches, \
+    compact_shards, _shard_name
+
+
+def visit_overlaps(visits, fail_visit=None, processed=None):
+    """
+    Overlaps data frame with visit % 3 + 1 rows for each visit.  If
+    processed is given, the visits are appended to it.
+    """
+    if fail_visit in visits:
+        raise ValueError(f'visit {fail_visit} failed')
+    if processed is not None:
+        processed.extend(visits)
+    rows = [(visit, tract, visit % 189) for visit in visits
+            for tract in range(visit % 3 + 1)]
+    return pd.DataFrame(rows, columns=['visit', 'tract', 'detector'])
+
+
+class BatchDriverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'shards')
+        self.visits = list(range(100, 130))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_batches(self, processes=1, **kwds):
+        """
+        Run visit_overlaps on the visits in batches of 7, returning
+        the manifest and the visits that were processed in this run
+        if a single process is used.
+        """
+        processed = []
+        func = functools.partial(visit_overlaps, processed=processed,
+                                 **kwds)
+        with contextlib.redirect_stdout(io.StringIO()):
+            manifest = run_batches(func, self.visits, self.output_dir,
+                                   batch_size=7, processes=processes)
+        return manifest, processed
+
+    def test_resume(self):
+        """Check that only the failed batch is run again."""
+        with self.assertRaises(RuntimeError):
+            self.run_batches(processes=2, fail_visit=115)
+        manifest = BatchManifest(self.output_dir)
+        self.assertEqual(sorted((_['imin'], _['imax'])
+                                for _ in manifest.shards.values()),
+                         [(0, 7), (7, 14), (21, 28), (28, 30)])
+
+        manifest, processed = self.run_batches()
+        self.assertEqual(processed, self.visits[14:21])
+        self.assertEqual(len(manifest.shards), 5)
+        df = pd.concat([pd.read_parquet(_) for _ in manifest.shard_files()],
+                       ignore_index=True)
+        pd.testing.assert_frame_equal(df, visit_overlaps(self.visits))
+
+        _, processed = self.run_batches()
+        self.assertEqual(processed, [])
+
+    def test_is_valid(self):
+        self.run_batches()
+        manifest = BatchManifest(self.output_dir)
+        shard = _shard_name(7, 14)
+        self.assertTrue(manifest.is_valid(shard, 7, 14))
+        self.assertFalse(manifest.is_valid(shard, 7, 15))
+        self.assertFalse(manifest.is_valid(_shard_name(7, 15), 7, 15))
+
+        # A shard file with the wrong number of rows.
+        shard_file = os.path.join(self.output_dir, shard)
+        visit_overlaps(self.visits[7:13]).to_parquet(shard_file, index=False)
+        self.assertFalse(manifest.is_valid(shard, 7, 14))
+        # A missing shard file.
+        missing = _shard_name(21, 28)
+        os.remove(os.path.join(self.output_dir, missing))
+        self.assertFalse(manifest.is_valid(missing, 21, 28))
+
+        _, processed = self.run_batches()
+        self.assertEqual(processed, self.visits[7:14] + self.visits[21:28])
+        manifest = BatchManifest(self.output_dir)
+        self.assertTrue(manifest.is_valid(shard, 7, 14))
+        self.assertTrue(manifest.is_valid(missing, 21, 28))
+
+    def test_compact_shards(self):
+        manifest, _ = self.run_batches()
+        db_file = os.path.join(self.tmp_dir, 'overlaps.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            num_rows = compact_shards(self.output_dir, db_file)
+        expected = visit_overlaps(self.visits)
+        self.assertEqual(num_rows, len(expected))
+        self.assertEqual(num_rows, sum(_['num_rows'] for _ in
+                                       manifest.shards.values()))
+        with sqlite3.connect(db_file) as con:
+            df = pd.read_sql('select * from overlaps', con)
+            indexes = {row[1]: [_[2] for _ in
+                                con.execute(f'pragma index_info({row[1]})')]
+                       for row in con.execute('pragma index_list(overlaps)')}
+        con.close()
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(indexes, {'overlaps_tract_visit_idx':
+                                   ['tract', 'visit'],
+                                   'overlaps_visit_tract_idx':
+                                   ['visit', 'tract']})
+
+
+if __name__ == '__main__':
+    unittest.main()
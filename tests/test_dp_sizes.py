@@ -0,0 +1,97 @@
+"""
+Unit tests for the data product size statistics.
+"""
+import os
+import shutil
+import tempfile
+import types
+import unittest
+from collections import namedtuple
+import numpy as np
+from desc.drp_tools.dp_sizes import dataset_size_stats
+
+
+# Stand-in for lsst.daf.butler.DatasetRefURIs.
+DatasetRefURIs = namedtuple('DatasetRefURIs', ['primaryURI', 'componentURIs'])
+
+
+class LocalURI:
+    """Minimal stand-in for lsst.resources.ResourcePath."""
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+
+class DatasetRef:
+    def __init__(self, dataset_id, dstype):
+        self.id = dataset_id
+        self.dstype = dstype
+
+
+class Butler:
+    """
+    Butler with single-file datasets, disassembled composites, and
+    datasets with missing files.  If many_uris is True, the datastore
+    provides getManyURIs; otherwise, the butler provides getURIs.
+    """
+    def __init__(self, tmp_dir, many_uris=True):
+        self.tmp_dir = tmp_dir
+        self.dsrefs = []
+        self.uris = {}
+        self.sizes = {}
+        for i, (dstype, components) in enumerate(
+                [('calexp', None), ('calexp', ('image', 'mask')),
+                 ('calexp', ('image', 'mask', 'variance')),
+                 ('calexp', None), ('src', None), ('src', None)]):
+            dsref = DatasetRef(i, dstype)
+            names = [f'{i}.fits'] if components is None \
+                else [f'{i}_{_}.fits' for _ in components]
+            paths = [os.path.join(tmp_dir, _) for _ in names]
+            for j, path in enumerate(paths):
+                with open(path, 'wb') as output:
+                    output.write(bytes(1000*(i + 1) + j))
+            if components is None:
+                self.uris[i] = DatasetRefURIs(LocalURI(paths[0]), {})
+            else:
+                self.uris[i] = DatasetRefURIs(
+                    None, {component: LocalURI(path) for component, path
+                           in zip(components, paths)})
+            self.sizes[i] = sum(os.path.getsize(_) for _ in paths)/1024**3
+            self.dsrefs.append(dsref)
+        # Remove one of the component files.
+        os.remove(os.path.join(tmp_dir, '2_mask.fits'))
+        self.sizes[2] = np.nan
+        self.registry = types.SimpleNamespace(queryDatasets=lambda dstype:
+                                              [_ for _ in self.dsrefs
+                                               if _.dstype == dstype])
+        self.datastore = types.SimpleNamespace()
+        if many_uris:
+            self.datastore.getManyURIs \
+                = lambda dsrefs: {_: self.uris[_.id] for _ in dsrefs}
+        else:
+            self.getURIs = lambda dsref: self.uris[dsref.id]
+
+
+class DpSizesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disassembled_composites(self):
+        for many_uris in (True, False):
+            butler = Butler(self.tmp_dir, many_uris=many_uris)
+            stats = dataset_size_stats(butler, {'task': {'calexp', 'src'}},
+                                       threads=2)
+            for dstype, ids in (('calexp', (0, 1, 3)), ('src', (4, 5))):
+                sizes = [butler.sizes[_] for _ in ids]
+                self.assertEqual(stats[('task', dstype)].count, len(sizes))
+                self.assertAlmostEqual(stats[('task', dstype)].mean,
+                                       np.mean(sizes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,258 @@
 """
-Example unit tests for drp_tools package
+Unit tests for drp_tools package, run on the synthetic inputs of the
+benchmark suite.
 """
+import os
+import sys
+import types
+import shutil
+import tempfile
+import threading
 import unittest
-import desc.drp_tools
+import json
+import contextlib
+import importlib
+import io
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
+from fake_butler import fake_butler
+from run_benchmarks import BENCHMARKS, run_benchmarks, find_regressions
+import synthetic
+
 
 class drp_toolsTestCase(unittest.TestCase):
     def setUp(self):
-        self.message = 'Hello, world'
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp_dir, 'repo')
 
     def tearDown(self):
-        pass
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_resource_usage_outputs(self):
+        """
+        Check that the parquet outputs and the pool results match the
+        in-memory, single process results.
+        """
+        with fake_butler(), contextlib.redirect_stdout(io.StringIO()):
+            from desc.drp_tools import get_resource_usage
+            synthetic.make_fake_repo(self.repo, 200, num_tracts=1)
+            cwd = os.getcwd()
+            os.chdir(self.tmp_dir)
+            try:
+                expected = get_resource_usage(self.repo, ['fake'],
+                                              processes=1, chunk_size=30)
+                written = get_resource_usage(self.repo, ['fake'],
+                                             processes=1, chunk_size=30,
+                                             output_name='test')
+                pooled = get_resource_usage(self.repo, ['fake'],
+                                            processes=2, chunk_size=30)
+                with open('coadd_resource_usage_old.parq', 'w') as output:
+                    output.write('single file output')
+                with self.assertRaises(FileExistsError):
+                    get_resource_usage(self.repo, ['fake'], processes=1,
+                                       output_name='old')
+            finally:
+                os.chdir(cwd)
+        for df0, df1, df2 in zip(expected, written, pooled):
+            self.assertGreater(len(df0), 0)
+            columns = list(df0.columns)
+            df0 = df0.sort_values(columns, ignore_index=True)
+            pd.testing.assert_frame_equal(
+                df0, df1.sort_values(columns, ignore_index=True))
+            pd.testing.assert_frame_equal(
+                df0, df2.sort_values(columns, ignore_index=True))
+
+    def sorted_frame(self, df):
+        return df.sort_values(list(df.columns), ignore_index=True)
+
+    def test_fast_metadata(self):
+        """
+        Check that parsing the metadata files directly gives the same
+        results as reading them with the butler, including for files
+        that can only be read with the butler.
+        """
+        with fake_butler(), contextlib.redirect_stdout(io.StringIO()):
+            from desc.drp_tools import get_resource_usage
+            synthetic.make_fake_repo(self.repo, 120, num_tracts=1,
+                                     metadata_formats=('.json', '.yaml',
+                                                       '.pickle'))
+            fast = get_resource_usage(self.repo, ['fake'], processes=1,
+                                      fast_metadata=True)
+            direct = get_resource_usage(self.repo, ['fake'], processes=1,
+                                        fast_metadata=False)
+        self.assertEqual(sum(len(_) for _ in fast), 120)
+        for df_fast, df_direct in zip(fast, direct):
+            self.assertFalse(df_fast['maxRSS (GB)'].isna().any())
+            pd.testing.assert_frame_equal(self.sorted_frame(df_fast),
+                                          self.sorted_frame(df_direct))
+
+    def test_resource_usage_cache(self):
+        """
+        Check the cache misses and hits and the re-reading of the
+        datasets in the refresh collections.
+        """
+        with fake_butler(), contextlib.redirect_stdout(io.StringIO()):
+            from desc.drp_tools import get_resource_usage
+            module = importlib.import_module(
+                'desc.drp_tools.get_resource_usage')
+            synthetic.make_fake_repo(self.repo, 60, num_tracts=1,
+                                     runs=('run1', 'run2'))
+            cache_file = os.path.join(self.tmp_dir, 'cache.db')
+
+            def run(**kwds):
+                # Return the frames, the ids of the datasets read, and
+                # the cache that was used.
+                caches = []
+                cache_class = module.ResourceUsageCache
+
+                def new_cache(*args):
+                    caches.append(cache_class(*args))
+                    return caches[-1]
+
+                with mock.patch.object(module, 'harvest_records',
+                                       wraps=module.harvest_records) \
+                        as harvest, \
+                        mock.patch.object(module, 'ResourceUsageCache',
+                                          side_effect=new_cache):
+                    frames = get_resource_usage(self.repo, ['fake'],
+                                                processes=1,
+                                                cache_file=cache_file,
+                                                **kwds)
+                read_ids = {str(dsref.id) for call in harvest.call_args_list
+                            for dsref in call.args[2]}
+                return frames, read_ids, caches[0]
+
+            first, read_ids, cache = run()
+            self.assertEqual(len(read_ids), 60)
+            self.assertEqual((cache.hits, cache.misses), (0, 60))
+
+            second, read_ids, cache = run()
+            self.assertEqual(read_ids, set())
+            self.assertEqual((cache.hits, cache.misses), (60, 0))
+            for df0, df1 in zip(first, second):
+                pd.testing.assert_frame_equal(self.sorted_frame(df0),
+                                              self.sorted_frame(df1))
+
+            third, read_ids, cache = run(refresh_collections=['run1'])
+        with open(os.path.join(self.repo, 'manifest.json')) as fobj:
+            run1_ids = {_['id'] for _ in json.load(fobj)
+                        if _['dstype'].endswith('_metadata')
+                        and _['run'] == 'run1'}
+        self.assertEqual(len(run1_ids), 30)
+        self.assertEqual(read_ids, run1_ids)
+        self.assertEqual((cache.hits, cache.misses), (30, 30))
+        for df0, df1 in zip(first, third):
+            pd.testing.assert_frame_equal(self.sorted_frame(df0),
+                                          self.sorted_frame(df1))
+
+    def test_find_metadata_dataset_types(self):
+        with fake_butler(), contextlib.redirect_stdout(io.StringIO()):
+            from desc.drp_tools import find_metadata_dataset_types
+            synthetic.make_fake_repo(self.repo, 4, num_tracts=1,
+                                     tasks={'isr': 'visit'})
+            self.assertEqual(find_metadata_dataset_types(self.repo, ['fake']),
+                             ['isr_metadata'])
+            # Run another task in the collection.
+            synthetic.make_fake_repo(self.repo, 4, num_tracts=1,
+                                     tasks={'isr': 'visit',
+                                            'calibrate': 'visit'})
+            self.assertEqual(find_metadata_dataset_types(self.repo, ['fake']),
+                             ['isr_metadata'])
+            self.assertEqual(find_metadata_dataset_types(self.repo, ['fake'],
+                                                         refresh=True),
+                             ['calibrate_metadata', 'isr_metadata'])
+            self.assertEqual(find_metadata_dataset_types(self.repo, ['fake']),
+                             ['calibrate_metadata', 'isr_metadata'])
+
+    def test_merged_det_stats(self):
+        with fake_butler() as butler_class, \
+                contextlib.redirect_stdout(io.StringIO()):
+            from desc.drp_tools import get_merged_det_stats
+            module = importlib.import_module(
+                'desc.drp_tools.get_resource_usage')
+            synthetic.make_fake_repo(self.repo, 4, num_tracts=2)
+            with open(os.path.join(self.repo, 'manifest.json')) as fobj:
+                paths = sorted(os.path.join(self.repo, _['path'])
+                               for _ in json.load(fobj)
+                               if _['dstype'] == 'deepCoadd_mergeDet')
+            # Headers that can't be read, for which the catalogs are
+            # read in full.
+            errors = {paths[0]: OSError, paths[1]: ValueError}
+            read_num_rows = module.read_num_rows
+
+            def header_num_rows(uri):
+                if uri.ospath in errors:
+                    raise errors[uri.ospath](uri.ospath)
+                return read_num_rows(uri)
+
+            uri_threads = set()
+            get_uri = butler_class.getURI
+
+            def resolve_uri(butler, dsref):
+                uri_threads.add(threading.current_thread())
+                return get_uri(butler, dsref)
+
+            with mock.patch.object(module, 'read_num_rows',
+                                   side_effect=header_num_rows), \
+                    mock.patch.object(butler_class, 'getURI',
+                                      resolve_uri), \
+                    mock.patch.object(butler_class, 'getDirect',
+                                      autospec=True,
+                                      side_effect=butler_class.getDirect) \
+                    as get_direct:
+                fast = get_merged_det_stats(self.repo, 'fake', fast=True)
+            self.assertEqual(sorted(os.path.join(self.repo, call.args[1].path)
+                                    for call in get_direct.call_args_list),
+                             paths[:2])
+            self.assertEqual(uri_threads, {threading.main_thread()})
+            direct = get_merged_det_stats(self.repo, 'fake', fast=False)
+        self.assertEqual(len(fast), 98)
+        pd.testing.assert_frame_equal(self.sorted_frame(fast),
+                                      self.sorted_frame(direct))
+
+    def test_nImage_stats(self):
+        with fake_butler(), contextlib.redirect_stdout(io.StringIO()):
+            from desc.drp_tools import get_nImage_stats
+            synthetic.make_fake_repo(self.repo, 4, num_tracts=1,
+                                     nimage_shape=(31, 20))
+            df = get_nImage_stats(self.repo, 'fake', processes=1)
+        with open(os.path.join(self.repo, 'manifest.json')) as fobj:
+            datasets = [_ for _ in json.load(fobj)
+                        if _['dstype'].endswith('Coadd_nImage')]
+        self.assertEqual(len(df), len(datasets))
+        df = df.set_index(['coadd_type', 'band', 'tract', 'patch'])
+        for dataset in datasets:
+            image = np.load(os.path.join(self.repo, dataset['path']))
+            data_id = dataset['data_id']
+            key = (dataset['dstype'][:-len('Coadd_nImage')],
+                   data_id['band'], data_id['tract'], data_id['patch'])
+            self.assertEqual(df.loc[key, 'n_median'], np.median(image))
+            self.assertEqual(df.loc[key, 'n_max'], np.max(image))
+
+    def test_benchmarks(self):
+        options = types.SimpleNamespace(processes=1, max_files=200,
+                                        verbose=False)
+        with fake_butler():
+            results = run_benchmarks(list(BENCHMARKS), [200], options)
+        self.assertEqual([_['name'] for _ in results], list(BENCHMARKS))
+        for result in results:
+            self.assertGreater(result['num_items'], 0)
+            self.assertGreaterEqual(result['seconds'], 0)
 
-    def test_run(self):
-        foo = desc.drp_tools.drp_tools(self.message)
-        self.assertEqual(foo.run(), self.message)
+    def test_find_regressions(self):
+        history = [dict(results=[dict(name='a', scale=10, seconds=1.0),
+                                 dict(name='b', scale=10, seconds=1.0)]),
+                   dict(results=[dict(name='a', scale=10, seconds=2.0)])]
+        results = [dict(name='a', scale=10, seconds=1.5),
+                   dict(name='b', scale=10, seconds=1.1),
+                   dict(name='c', scale=10, seconds=9.0)]
+        self.assertEqual(find_regressions(results, history),
+                         [('a', 10, 1.5, 1.0)])
 
-    def test_failure(self):
-        self.assertRaises(TypeError, desc.drp_tools.drp_tools)
-        foo = desc.drp_tools.drp_tools(self.message)
-        self.assertRaises(RuntimeError, foo.run, True)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,302 @@
+"""
+Unit tests for the visit-tract overlap tables.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.drp_tools.tract_index import TractIndex
+from desc.drp_tools.sky_geometry import LSSTCAM_RADIUS
+from desc.drp_tools.fill_tables import fill_visit_table, \
+    fill_overlap_table, update_visit_table, update_overlap_tables, \
+    refine_overlaps
+
+
+def make_tract_centers(spacing=1.5):
+    """Rings of tract centers covering the whole sky."""
+    ra, dec = [], []
+    for dec0 in np.arange(-90 + spacing/2, 90, spacing):
+        num_tracts = max(int(360*np.cos(np.radians(dec0))/spacing), 1)
+        ra.extend(np.linspace(0, 360, num_tracts, endpoint=False))
+        dec.extend([dec0]*num_tracts)
+    return np.arange(len(ra)) + 1000, np.array(ra), np.array(dec)
+
+
+def haversine(ra0, dec0, ra, dec):
+    """Angular separation in degrees using the haversine formula."""
+    ra0, dec0, ra, dec = [np.radians(_) for _ in (ra0, dec0, ra, dec)]
+    arg = (np.sin((dec - dec0)/2)**2
+           + np.cos(dec0)*np.cos(dec)*np.sin((ra - ra0)/2)**2)
+    return np.degrees(2*np.arcsin(np.sqrt(np.clip(arg, 0, 1))))
+
+
+def per_visit_overlaps(visit_ra, visit_dec, tract_ids, tract_ra, tract_dec,
+                       max_sep):
+    """
+    Reference per-visit computation of the overlapping tracts and the
+    closest tract for each visit, with separations computed over all
+    of the tracts.
+    """
+    overlaps, closest = [], []
+    for ra0, dec0 in zip(visit_ra, visit_dec):
+        seps = haversine(ra0, dec0, tract_ra, tract_dec)
+        overlaps.append(set(tract_ids[seps <= max_sep].tolist()))
+        closest.append(tract_ids[np.argmin(seps)])
+    return overlaps, closest
+
+
+def radec_to_vectors(ra, dec):
+    ra, dec = np.radians(ra), np.radians(dec)
+    return np.stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra),
+                     np.sin(dec)), axis=-1)
+
+
+def tract_corners(tract_ra, tract_dec, half_width=0.85):
+    """
+    Vertex unit vectors of quadrilateral tracts with corners at the
+    corners of RA, Dec boxes around the tract centers.
+    """
+    dra = half_width/np.cos(np.radians(tract_dec))
+    corners = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+    return np.stack([radec_to_vectors(tract_ra + i*dra,
+                                      tract_dec + j*half_width)
+                     for i, j in corners], axis=1)
+
+
+def min_polygon_separation(center, vertices, num_samples=40):
+    """
+    Minimum angular separation (degrees) between a position and a grid
+    of points sampling the interior and edges of a convex spherical
+    quadrilateral.  The points are normalized bilinear combinations of
+    the vertex vectors, which lie within the polygon.
+    """
+    u = np.linspace(0, 1, num_samples)[:, None, None]
+    v = np.linspace(0, 1, num_samples)[None, :, None]
+    points = ((1 - u)*(1 - v)*vertices[0] + u*(1 - v)*vertices[1]
+              + u*v*vertices[2] + (1 - u)*v*vertices[3])
+    points /= np.linalg.norm(points, axis=-1, keepdims=True)
+    return np.degrees(np.arccos(np.clip(np.max(points @ center), -1, 1)))
+
+
+def make_opsim_db(opsim_db, visit_ra, visit_dec, first_visit=0):
+    """Write a Summary table of visits in the DC2 opsim db format."""
+    num_visits = len(visit_ra)
+    df = pd.DataFrame(dict(obsHistID=np.arange(num_visits) + first_visit,
+                           descDitheredRA=np.radians(visit_ra),
+                           descDitheredDec=np.radians(visit_dec),
+                           propID=54, expMJD=59580. + np.arange(num_visits),
+                           filter='r'))
+    with sqlite3.connect(opsim_db) as con:
+        df.to_sql('Summary', con, index=False, if_exists='replace')
+    con.close()
+
+
+def make_tract_table(db_file, tract_ids, tract_ra, tract_dec):
+    """Write a Tract table of tract centers."""
+    with sqlite3.connect(db_file) as con:
+        con.execute('create table Tract '
+                    '(id INTEGER PRIMARY KEY, ra REAL, dec REAL)')
+        con.executemany('insert into Tract values (?, ?, ?)',
+                        zip(tract_ids.tolist(), tract_ra.tolist(),
+                            tract_dec.tolist()))
+    con.close()
+
+
+def read_table(db_file, query):
+    with sqlite3.connect(db_file) as con:
+        df = pd.read_sql(query, con)
+    con.close()
+    return df
+
+
+class OverlapTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1234)
+        self.tract_ids, self.tract_ra, self.tract_dec = make_tract_centers()
+        num_visits = 2000
+        self.visit_ra = rng.uniform(0, 360, num_visits)
+        self.visit_dec = np.degrees(np.arcsin(rng.uniform(-1, 1,
+                                                          num_visits)))
+        # Include visits near the poles and at the RA wraparound.
+        self.visit_ra[:4] = [0.01, 359.99, 123., 45.]
+        self.visit_dec[:4] = [-30., -30., 89.5, -89.7]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_db(self, name, num_visits=None):
+        """
+        Make an overlap db file with the Tract table and with the Visit
+        table filled from an opsim db with the first num_visits visits.
+        """
+        opsim_db = os.path.join(self.tmp_dir, f'opsim_{name}.db')
+        make_opsim_db(opsim_db, self.visit_ra[:num_visits],
+                      self.visit_dec[:num_visits])
+        db_file = os.path.join(self.tmp_dir, f'{name}.db')
+        make_tract_table(db_file, self.tract_ids, self.tract_ra,
+                         self.tract_dec)
+        fill_visit_table(db_file, opsim_db)
+        return db_file
+
+    def test_vectorized_overlaps(self):
+        """
+        Compare the vectorized overlaps to the per-visit reference.
+        The closest tract is the nearest over all of the tracts, which
+        can differ from the closest tract within the RA, Dec box that
+        was searched in the original per-visit implementation.
+        """
+        max_sep = 3.15
+        index = TractIndex(self.tract_ids, self.tract_ra, self.tract_dec)
+        visit_index, tract_index, closest \
+            = index.find_overlaps(self.visit_ra, self.visit_dec,
+                                  max_sep=max_sep, chunk_size=300)
+        overlaps = [set() for _ in self.visit_ra]
+        for i, j in zip(visit_index, tract_index):
+            overlaps[i].add(self.tract_ids[j].item())
+        ref_overlaps, ref_closest \
+            = per_visit_overlaps(self.visit_ra, self.visit_dec,
+                                 self.tract_ids, self.tract_ra,
+                                 self.tract_dec, max_sep)
+        self.assertEqual(overlaps, ref_overlaps)
+        self.assertEqual(self.tract_ids[closest].tolist(), ref_closest)
+        # Pairs are ordered by visit, then by tract.
+        order = np.lexsort((tract_index, visit_index))
+        np.testing.assert_array_equal(order, np.arange(len(visit_index)))
+
+    def test_process_count_independence(self):
+        """
+        Check that the Overlap table, including the ids, and the
+        closest tracts don't depend on the number of processes.
+        """
+        tables, closest = [], []
+        for processes in (1, 3):
+            db_file = self.make_db(f'overlaps_{processes}')
+            closest.append(fill_overlap_table(db_file, processes=processes,
+                                              shard_size=250))
+            tables.append(read_table(db_file,
+                                     'select * from Overlap order by id'))
+        self.assertGreater(len(tables[0]), len(self.visit_ra))
+        pd.testing.assert_frame_equal(tables[0], tables[1])
+        self.assertEqual(closest[0], closest[1])
+        shards = read_table(db_file, 'select * from OverlapShard')
+        self.assertEqual(len(shards), 8)
+        self.assertEqual(shards['num_overlaps'].sum(), len(tables[1]))
+
+    def test_incremental_update(self):
+        """
+        Check that adding visits in two increments gives the same Visit
+        and Overlap tables as a full rebuild.
+        """
+        db_file = self.make_db('full')
+        update_visit_table(db_file, fill_overlap_table(db_file))
+
+        db_file_inc = os.path.join(self.tmp_dir, 'incremental.db')
+        make_tract_table(db_file_inc, self.tract_ids, self.tract_ra,
+                         self.tract_dec)
+        opsim_db = os.path.join(self.tmp_dir, 'opsim_increment.db')
+        for num_visits in (1200, len(self.visit_ra)):
+            make_opsim_db(opsim_db, self.visit_ra[:num_visits],
+                          self.visit_dec[:num_visits])
+            num_added = update_overlap_tables(db_file_inc, opsim_db,
+                                              batch_size=500)
+            self.assertEqual(num_added, 1200 if num_visits == 1200 else 800)
+        # A re-run finds no new visits.
+        self.assertEqual(update_overlap_tables(db_file_inc, opsim_db), 0)
+
+        for query in ('select * from Visit order by id',
+                      'select * from Overlap order by id'):
+            pd.testing.assert_frame_equal(read_table(db_file, query),
+                                          read_table(db_file_inc, query))
+
+    def test_reruns(self):
+        """
+        Check that re-running fill_visit_table skips the existing and
+        repeated visits, and that re-running fill_overlap_table on a
+        filled db fails without changing the Overlap table.
+        """
+        db_file = self.make_db('rerun', num_visits=100)
+        opsim_db = os.path.join(self.tmp_dir, 'opsim_repeats.db')
+        make_opsim_db(opsim_db, np.tile(self.visit_ra[:150], 2),
+                      np.tile(self.visit_dec[:150], 2))
+        with sqlite3.connect(opsim_db) as con:
+            con.execute('update Summary set obsHistID=obsHistID % 150')
+        con.close()
+        fill_visit_table(db_file, opsim_db)
+        visits = read_table(db_file, 'select id from Visit order by id')
+        self.assertEqual(visits['id'].tolist(), list(range(150)))
+
+        fill_overlap_table(db_file)
+        query = 'select * from Overlap order by id'
+        df_overlaps = read_table(db_file, query)
+        with self.assertRaises(RuntimeError):
+            fill_overlap_table(db_file)
+        pd.testing.assert_frame_equal(read_table(db_file, query),
+                                      df_overlaps)
+
+    def test_update_after_fill_visit_table(self):
+        """
+        Check that update_overlap_tables refuses a Visit table filled
+        by fill_visit_table, since it would skip all of those visits.
+        """
+        db_file = self.make_db('visits_only', num_visits=100)
+        opsim_db = os.path.join(self.tmp_dir, 'opsim_visits_only.db')
+        with self.assertRaises(RuntimeError):
+            update_overlap_tables(db_file, opsim_db)
+        self.assertEqual(
+            len(read_table(db_file, 'select * from Overlap')), 0)
+
+    def test_polygon_refinement(self):
+        """
+        Compare the refined overlaps with brute-force sampling of the
+        tract polygons.  Without rotation angles, the visit footprint
+        is a 16-sided polygon containing the circle of radius
+        LSSTCAM_RADIUS and contained in the circle through its
+        vertices, so pairs with tract points inside the inner circle
+        must be kept and pairs with no tract points inside the outer
+        circle must be dropped.
+        """
+        max_sep = 3.15
+        index = TractIndex(self.tract_ids, self.tract_ra, self.tract_dec)
+        visit_index, tract_index, _ \
+            = index.find_overlaps(self.visit_ra, self.visit_dec,
+                                  max_sep=max_sep)
+        vertices = tract_corners(self.tract_ra, self.tract_dec)
+        keep = refine_overlaps(self.visit_ra, self.visit_dec, visit_index,
+                               tract_index, vertices)
+        inner = LSSTCAM_RADIUS
+        outer = np.degrees(np.arctan(np.tan(np.radians(LSSTCAM_RADIUS))
+                                     /np.cos(np.pi/16)))
+        # Allow for the spacing of the sample points.
+        tol = 0.05
+        centers = radec_to_vectors(self.visit_ra, self.visit_dec)
+        num_inside, num_outside = 0, 0
+        pairs = np.random.default_rng(3).choice(len(visit_index), 3000,
+                                                replace=False)
+        for i, j, kept in zip(visit_index[pairs], tract_index[pairs],
+                              keep[pairs]):
+            sep = min_polygon_separation(centers[i], vertices[j])
+            if sep < inner:
+                num_inside += 1
+                self.assertTrue(kept)
+            elif sep > outer + tol:
+                num_outside += 1
+                self.assertFalse(kept)
+        self.assertGreater(num_inside, 50)
+        self.assertGreater(num_outside, 50)
+
+        # The footprints for specific rotation angles are contained in
+        # the rotation-independent footprints.
+        rot = np.random.default_rng(5).uniform(0, 360, len(self.visit_ra))
+        keep_rot = refine_overlaps(self.visit_ra, self.visit_dec,
+                                   visit_index, tract_index, vertices,
+                                   visit_rot=rot)
+        self.assertTrue(np.all(keep[keep_rot]))
+        self.assertLess(np.sum(keep_rot), np.sum(keep))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Unit tests for reading FITS table sizes from the file headers,
+compared to full reads of the files with astropy.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+from desc.drp_tools.fits_headers import read_num_rows
+
+
+class LocalURI:
+    """Minimal stand-in for lsst.resources.ResourcePath."""
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, size=-1):
+        with open(self.path, 'rb') as fobj:
+            return fobj.read(size)
+
+    def __str__(self):
+        return self.path
+
+
+class FitsHeadersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(11)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, name, hdus):
+        path = os.path.join(self.tmp_dir, name)
+        fits.HDUList(hdus).writeto(path)
+        return path
+
+    def table_hdu(self, num_rows, varlen=False):
+        columns = [fits.Column(name='id', format='K',
+                               array=np.arange(num_rows)),
+                   fits.Column(name='flux', format='D',
+                               array=self.rng.random(num_rows))]
+        if varlen:
+            arrays = [np.arange(self.rng.integers(0, 20), dtype=np.float32)
+                      for _ in range(num_rows)]
+            columns.append(fits.Column(name='footprint', format='PE()',
+                                       array=np.array(arrays, dtype=object)))
+        return fits.BinTableHDU.from_columns(columns)
+
+    def assert_num_rows(self, path, hdu=1, **kwds):
+        expected = len(Table.read(path, hdu=hdu))
+        self.assertEqual(read_num_rows(LocalURI(path), hdu=hdu, **kwds),
+                         expected)
+
+    def test_primary_header_sizes(self):
+        for num_cards in (0, 30, 36, 100, 500):
+            primary = fits.PrimaryHDU()
+            for i in range(num_cards):
+                primary.header[f'KEY{i}'] = (i, 'padding card')
+            num_rows = int(self.rng.integers(0, 5000))
+            path = self.write_file(f'cards_{num_cards}.fits',
+                                   [primary, self.table_hdu(num_rows)])
+            self.assert_num_rows(path)
+            # Start with a single block, so that the read size is
+            # doubled until the table header is found.
+            self.assert_num_rows(path, nbytes=2880)
+
+    def test_data_units(self):
+        """Check the skipping of image and variable-length array HDUs."""
+        image = self.rng.random((123, 45)).astype(np.float32)
+        path = self.write_file('image.fits',
+                               [fits.PrimaryHDU(image),
+                                self.table_hdu(1000, varlen=True),
+                                fits.ImageHDU(image.astype(np.int16)),
+                                self.table_hdu(77)])
+        self.assert_num_rows(path, hdu=1)
+        self.assert_num_rows(path, hdu=3)
+
+    def test_errors(self):
+        path = os.path.join(self.tmp_dir, 'not_fits.txt')
+        with open(path, 'w') as output:
+            output.write('not a FITS file')
+        with self.assertRaises(ValueError):
+            read_num_rows(LocalURI(path))
+        path = self.write_file('primary.fits', [fits.PrimaryHDU()])
+        with self.assertRaises(ValueError):
+            read_num_rows(LocalURI(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
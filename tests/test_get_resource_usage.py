@@ -0,0 +1,147 @@
+"""
+Unit tests for the vectorized resource usage and nImage functions,
+compared to reference implementations with explicit loops and to the
+numpy functions.
+"""
+import os
+import sys
+import unittest
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from desc.drp_tools import add_nImage_columns, add_merged_det_column, \
+    image_median_and_max
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
+import synthetic
+
+
+def reference_nImage_columns(df_coadd, df_nImage):
+    """Row-by-row version of add_nImage_columns."""
+    n_stats = {'deep': {}, 'goodSeeing': {}}
+    n_ugrizy = {'n_median': defaultdict(lambda: 0),
+                'n_max': defaultdict(lambda: 0)}
+    for _, row in df_nImage.iterrows():
+        n_stats[row.coadd_type][(row.band, row.tract, row.patch)] \
+            = (row.n_median, row.n_max)
+        if row.coadd_type == 'deep':
+            n_ugrizy['n_median'][(row.tract, row.patch)] += row.n_median
+            n_ugrizy['n_max'][(row.tract, row.patch)] += row.n_max
+
+    n_median, n_max = [], []
+    for _, row in df_coadd.iterrows():
+        key = row.band, row.tract, row.patch
+        if row.patch is None or np.isnan(row.patch):
+            n_median.append(None)
+            n_max.append(None)
+        elif row.task == 'makeWarp':
+            n_median.append(1)
+            n_max.append(1)
+        elif row.band is None:
+            n_median.append(n_ugrizy['n_median'][(row.tract, row.patch)])
+            n_max.append(n_ugrizy['n_max'][(row.tract, row.patch)])
+        elif row.task == 'templateGen':
+            n_median.append(n_stats['goodSeeing'][key][0])
+            n_max.append(n_stats['goodSeeing'][key][1])
+        else:
+            n_median.append(n_stats['deep'][key][0])
+            n_max.append(n_stats['deep'][key][1])
+
+    df_coadd['n_median'] = n_median
+    df_coadd['n_max'] = n_max
+    return df_coadd
+
+
+def reference_merged_det_column(df_coadd, df_merged_det):
+    """Row-by-row version of add_merged_det_column."""
+    n_det_dict = {(row.tract, row.patch): row.n_det
+                  for _, row in df_merged_det.iterrows()}
+    n_det = []
+    for _, row in df_coadd.iterrows():
+        if row.task == 'deblend':
+            n_det.append(n_det_dict[(row.tract, row.patch)])
+        else:
+            n_det.append(None)
+    df_coadd['merged detections'] = n_det
+    return df_coadd
+
+
+class CoaddColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df_coadd, self.df_nImage, self.df_merged_det \
+            = synthetic.make_coadd_frames(2000, seed=7)
+        # Tract-level rows without a patch.
+        tract_level = (self.df_coadd.index % 50 == 0) \
+            & (self.df_coadd['task'] != 'deblend')
+        self.df_coadd.loc[tract_level, 'patch'] = pd.NA
+        # Patches with no deep coadds, which contribute 0 to the sums
+        # over bands.
+        self.df_nImage = self.df_nImage.query(
+            "not (coadd_type == 'goodSeeing' and patch == 48) and "
+            "not (coadd_type == 'deep' and patch == 48)")
+        rows = self.df_coadd.query("patch == 48")
+        self.df_coadd = self.df_coadd.drop(
+            rows.index[~rows['band'].isna() & (rows['task'] != 'makeWarp')])
+
+    def reference_coadd(self):
+        # The row-by-row code was written for float patch values with
+        # NaN for the tract-level rows.
+        df = self.df_coadd.copy()
+        df['patch'] = df['patch'].astype('float64')
+        return df
+
+    def test_add_nImage_columns(self):
+        self.assertGreater(len(self.df_coadd.query(
+            "patch == 48 and band.isna() and task != 'makeWarp'")), 0)
+        df = add_nImage_columns(self.df_coadd.copy(), self.df_nImage)
+        expected = reference_nImage_columns(self.reference_coadd(),
+                                            self.df_nImage)
+        for column in ('n_median', 'n_max'):
+            np.testing.assert_array_equal(
+                df[column].to_numpy(dtype=float),
+                expected[column].to_numpy(dtype=float))
+            self.assertEqual(df[column].dtype, expected[column].dtype)
+
+    def test_add_merged_det_column(self):
+        df = add_merged_det_column(self.df_coadd.copy(), self.df_merged_det)
+        expected = reference_merged_det_column(self.reference_coadd(),
+                                               self.df_merged_det)
+        np.testing.assert_array_equal(
+            df['merged detections'].to_numpy(dtype=float),
+            expected['merged detections'].to_numpy(dtype=float))
+        self.assertEqual(df['merged detections'].dtype,
+                         expected['merged detections'].dtype)
+
+    def test_missing_keys(self):
+        df_coadd = self.df_coadd[self.df_coadd['task'] == 'deblend'].copy()
+        row = df_coadd.iloc[0]
+        df_merged_det = self.df_merged_det.query(
+            f"not (tract == {row.tract} and patch == {row.patch})")
+        with self.assertRaises(KeyError):
+            add_merged_det_column(df_coadd, df_merged_det)
+
+
+class ImageStatsTestCase(unittest.TestCase):
+    def test_image_median_and_max(self):
+        """Check the histogram median against np.median."""
+        rng = np.random.default_rng(42)
+        for shape in ((1,), (2,), (7, 9), (100, 100), (101, 99)):
+            for vmax in (1, 2, 40, 1000):
+                for dtype in (np.uint8, np.uint16, np.int32, np.uint64):
+                    if vmax > np.iinfo(dtype).max:
+                        continue
+                    array = rng.integers(0, vmax + 1, size=shape,
+                                         dtype=dtype)
+                    median, max_value = image_median_and_max(array)
+                    self.assertEqual(median, np.median(array))
+                    self.assertEqual(max_value, np.max(array))
+        for array in (np.array([[-3, 5], [2, 7]], dtype=np.int16),
+                      np.array([0, 10**9], dtype=np.int64),
+                      rng.random((10, 11)).astype(np.float32)):
+            self.assertEqual(image_median_and_max(array),
+                             (np.median(array), np.max(array)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+Unit tests for the direct parsing of task metadata files.
+"""
+import os
+import sys
+import copy
+import json
+import unittest
+import numpy as np
+import yaml
+from desc.drp_tools.metadata_extraction import parse_resource_usage, \
+    _scan_json_resource_usage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
+from synthetic import _task_metadata
+
+
+def reference_resource_usage(md):
+    """
+    Resource usage from the decoded metadata, following the loops over
+    TaskMetadata keys in extract_resource_usage.
+    """
+    def items(subtask_md):
+        for key, value in subtask_md['scalars'].items():
+            yield key, value
+        for key, value in subtask_md['arrays'].items():
+            yield key, value[-1]
+
+    subtasks = md['metadata']
+    maxRSS = max(value/1024**3 for subtask_md in subtasks.values()
+                 for key, value in items(subtask_md)
+                 if 'MaxResidentSetSize' in key)
+    quantum = dict(items(subtasks['quantum']))
+    try:
+        wall_time = (quantum['endCpuTime'] - quantum['startCpuTime'])/60.
+    except KeyError:
+        wall_time = None
+    try:
+        cpu_time = (quantum['endUserTime'] - quantum['startUserTime'])/60.
+    except KeyError:
+        cpu_time = None
+    return maxRSS, wall_time, cpu_time
+
+
+class MetadataExtractionTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1234)
+        self.metadata = []
+        for _ in range(20):
+            md = _task_metadata(rng)
+            for name, subtask_md in md['metadata'].items():
+                # As for the pipeline tasks, all of the subtasks have
+                # their own timing entries.
+                for key in ('CpuTime', 'UserTime'):
+                    subtask_md['scalars'].setdefault(f'start{key}',
+                                                     float(rng.random()))
+                    subtask_md['scalars'].setdefault(f'end{key}',
+                                                     float(rng.random()))
+                for i in range(20):
+                    subtask_md['scalars'][f'value{i}'] = float(rng.random())
+                    subtask_md['arrays'][f'array{i}'] \
+                        = rng.random(3).tolist()
+                subtask_md['scalars']['comment'] = 'a "quoted", {value}'
+            # RSS values persisted as arrays.
+            md['metadata']['task']['arrays']['prepMaxResidentSetSize'] \
+                = [int(_) for _ in rng.integers(1, 9, 3)*1024**3]
+            self.metadata.append(md)
+
+    @staticmethod
+    def layouts(md):
+        yield json.dumps(md).encode()
+        yield json.dumps(md, separators=(',', ':')).encode()
+        yield json.dumps(md, indent=2).encode()
+
+    def test_selective_scan(self):
+        """Check that the scan gives the values of the full parse."""
+        for md in self.metadata:
+            expected = reference_resource_usage(md)
+            for data in self.layouts(md):
+                self.assertEqual(_scan_json_resource_usage(data), expected)
+                self.assertEqual(parse_resource_usage(data), expected)
+
+    def test_fallbacks(self):
+        """
+        Check that files that can't be scanned are parsed in full, with
+        the same results.
+        """
+        def nested(md):
+            md['metadata']['task']['metadata']['inner'] \
+                = copy.deepcopy(md['metadata']['task:subtask'])
+
+        def reordered(md):
+            quantum = md['metadata']['quantum']
+            md['metadata']['quantum'] = dict(reversed(quantum.items()))
+
+        def missing_times(md):
+            del md['metadata']['quantum']['scalars']['endUserTime']
+
+        def rss_infix(md):
+            md['metadata']['task']['scalars']['maxMaxResidentSetSizeGB'] \
+                = 1e11
+
+        def nan_value(md):
+            md['metadata']['task']['scalars']['endMaxResidentSetSize'] \
+                = float('nan')
+
+        for modify in (nested, reordered, missing_times, rss_infix,
+                       nan_value):
+            md = copy.deepcopy(self.metadata[0])
+            modify(md)
+            expected = reference_resource_usage(md)
+            for data in self.layouts(md):
+                if modify is not nan_value:
+                    self.assertIsNone(_scan_json_resource_usage(data))
+                np.testing.assert_equal(parse_resource_usage(data),
+                                        expected)
+
+    def test_invalid_files(self):
+        md = copy.deepcopy(self.metadata[0])
+        data = json.dumps(md).encode()
+        self.assertIsNone(parse_resource_usage(data[:len(data)//2]))
+        self.assertIsNone(parse_resource_usage(data, extension='.pickle'))
+        for subtask_md in md['metadata'].values():
+            for key in ('startMaxResidentSetSize', 'endMaxResidentSetSize'):
+                subtask_md['scalars'].pop(key, None)
+        del md['metadata']['task']['arrays']['prepMaxResidentSetSize']
+        with self.assertRaises(ValueError):
+            parse_resource_usage(json.dumps(md).encode())
+
+    def test_yaml(self):
+        md = self.metadata[0]
+        self.assertEqual(parse_resource_usage(yaml.safe_dump(md).encode(),
+                                              extension='.yaml'),
+                         reference_resource_usage(md))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Unit tests for the resource usage fitting functions, compared to the
+implementations that were in resource_usage_plots.
+"""
+import unittest
+import numpy as np
+import pandas as pd
+from desc.drp_tools import resource_usage_plots
+
+
+def reference_upper_envelope(x, y):
+    df = pd.DataFrame(data=dict(x=x, y=y))
+    xvals = sorted(list(set(x)))
+    yvals = []
+    for xval in xvals:
+        yvals.append(np.max(df.query(f'x=={xval}')['y']))
+    pars = np.polyfit(xvals, yvals, 1)
+    if pars[0] <= 0:
+        pars = (0, np.polyfit(xvals, yvals, 0)[0])
+    return pars
+
+
+def reference_percentile_value(xx, percentile=0.95):
+    xvals = np.array([_ for _ in xx if _ == _])
+    index = int(percentile*len(xvals))
+    return sorted(xvals)[index]
+
+
+class ResourceFitsTestCase(unittest.TestCase):
+    def test_moved_functions(self):
+        """Check the functions still importable from resource_usage_plots."""
+        rng = np.random.default_rng(3)
+        for slope in (2., -1.):
+            x = rng.integers(1, 30, 500)
+            y = slope*x + 10*rng.random(500)
+            np.testing.assert_allclose(
+                resource_usage_plots.fit_upper_envelope(x, y),
+                reference_upper_envelope(x, y), atol=1e-12)
+        values = rng.random(1001)
+        values[::7] = np.nan
+        for percentile in (0, 0.5, 0.95):
+            self.assertEqual(
+                resource_usage_plots.get_percentile_value(values,
+                                                          percentile),
+                reference_percentile_value(values, percentile))
+        with self.assertRaises(IndexError):
+            resource_usage_plots.get_percentile_value([np.nan])
+
+
+if __name__ == '__main__':
+    unittest.main()
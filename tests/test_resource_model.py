@@ -0,0 +1,136 @@
+"""
+Unit tests for the resource model predictions.
+"""
+import os
+import io
+import json
+import shutil
+import tempfile
+import contextlib
+import unittest
+import numpy as np
+import pandas as pd
+from desc.drp_tools.resource_fits import fit_coadd_resources
+from desc.drp_tools.resource_model import ResourceModel
+
+
+class ResourceModelTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(17)
+        num_rows = 300
+        n_max = rng.integers(1, 50, num_rows).astype(float)
+        task = np.array(['assembleCoadd', 'detection'])\
+            [rng.integers(0, 2, num_rows)]
+        band = np.array(list('ugrizy'))[rng.integers(0, 6, num_rows)]
+        # forcedPhot and healSparsePropertyMaps have only rows without
+        # a standard band, so they have no envelope or band percentile
+        # fits.
+        other_tasks = ['forcedPhot']*10 + ['healSparsePropertyMaps']*10
+        df_coadd = pd.DataFrame({
+            'task': np.concatenate([task, other_tasks]),
+            'band': np.concatenate([band, ['N921', 'N964']*10]),
+            'n_max': np.concatenate([n_max, rng.integers(1, 50, 20)]),
+            'maxRSS (GB)': rng.random(num_rows + 20) + 1,
+            'cpu_time (m)': 10*rng.random(num_rows + 20)})
+        df_coadd.loc[:num_rows - 1, 'maxRSS (GB)'] += 0.1*n_max
+        self.fits = fit_coadd_resources(df_coadd)
+        self.assertTrue(self.fits.query("task in @other_tasks")['intercept']
+                        .isna().all())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.model = ResourceModel(self.fits)
+        self.quanta = pd.DataFrame({'task': ['assembleCoadd']*3
+                                    + ['detection']*2,
+                                    'n_max': [1., 10., 40., 5., 20.]})
+
+    def test_nan_fits(self):
+        self.assertEqual(self.model.skipped_tasks,
+                         ['forcedPhot', 'healSparsePropertyMaps'])
+        self.assertEqual(self.model.tasks, ['assembleCoadd', 'detection'])
+
+    def test_predict(self):
+        predicted = self.model.predict(self.quanta)
+        fits = self.fits.set_index(['task', 'column'])
+        for row in predicted.itertuples(index=False):
+            for column, value in ((ResourceModel.memory_column, row[2]),
+                                  (ResourceModel.cpu_column, row[3])):
+                slope, intercept = fits.loc[(row.task, column),
+                                            ['slope', 'intercept']]
+                self.assertAlmostEqual(value, slope*row.n_max + intercept)
+        quanta = pd.concat([self.quanta,
+                            pd.DataFrame({'task': ['forcedPhot'],
+                                          'n_max': [3.]})])
+        with self.assertRaises(KeyError) as context:
+            self.model.predict(quanta)
+        self.assertIn('NaN fits', str(context.exception))
+
+    @staticmethod
+    def simple_model():
+        """Model with envelope and percentile fits and planned quanta."""
+        memory, cpu = ResourceModel.memory_column, ResourceModel.cpu_column
+        model = ResourceModel([('taskA', memory, 0.5, 1., 'n_max', 'envelope'),
+                               ('taskA', cpu, 0., 60., None, 'percentile'),
+                               ('taskB', memory, 0., 20., None, 'percentile'),
+                               ('taskB', cpu, 2., 0., 'n_max', 'envelope')])
+        quanta = pd.DataFrame({'task': ['taskA', 'taskA', 'taskB', 'taskB'],
+                               'n_max': [2., 14., 15., 30.]})
+        return model, quanta
+
+    def test_node_hours(self):
+        model, quanta = self.simple_model()
+        summary = model.node_hours(quanta, cores_per_node=4,
+                                   memory_per_node=16)
+        # taskA: 2 and 8 GB, so 4 (the number of cores) and 2 jobs per
+        # node, and 60 m each.  taskB: 20 GB, so 1 job per node, even
+        # though the memory doesn't fit, and 30 and 60 m.
+        expected = pd.DataFrame({'num_quanta': [2, 2, 4],
+                                 'cpu_hours': [2., 1.5, 3.5],
+                                 'node_hours': [0.75, 1.5, 2.25],
+                                 'peak_memory': [8., 20., 20.],
+                                 'mean_memory': [5., 20., 12.5]},
+                                index=pd.Index(['taskA', 'taskB', 'total'],
+                                               name='task'))
+        pd.testing.assert_frame_equal(summary, expected)
+
+        summary = self.model.node_hours(self.quanta)
+        self.assertFalse(summary.isna().any().any())
+        self.assertEqual(summary.loc['total', 'num_quanta'], 5)
+        with self.assertRaises(KeyError):
+            self.model.node_hours(pd.DataFrame({'task': ['forcedPhot'],
+                                                'n_max': [3.]}))
+
+    def test_write_read(self):
+        """Check the round trip of the model through json and yaml."""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for model, quanta in ((self.model, self.quanta),
+                                  self.simple_model()):
+                for filename in ('model.json', 'model.yaml'):
+                    outfile = os.path.join(tmp_dir, filename)
+                    model.write(outfile)
+                    new_model = ResourceModel.read(outfile)
+                    self.assertEqual(new_model.to_dict(), model.to_dict())
+                    pd.testing.assert_frame_equal(new_model.fits.sort_index(),
+                                                  model.fits.sort_index(),
+                                                  check_dtype=False)
+                    pd.testing.assert_frame_equal(new_model.predict(quanta),
+                                                  model.predict(quanta))
+                    self.assertEqual(new_model.bps_overrides(quanta),
+                                     model.bps_overrides(quanta))
+                with open(os.path.join(tmp_dir, 'model.json')) as fobj:
+                    self.assertEqual(json.load(fobj), model.to_dict())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_bps_overrides(self):
+        self.assertEqual(self.model.bps_overrides(), {'pipetask': {}})
+        overrides = self.model.bps_overrides(self.quanta)['pipetask']
+        self.assertEqual(sorted(overrides), ['assembleCoadd', 'detection'])
+        peak = self.model.predict(self.quanta).groupby('task')\
+            [ResourceModel.memory_column].max()
+        for task, values in overrides.items():
+            self.assertEqual(values['requestMemory'],
+                             int(np.ceil(peak[task]*1.1*1024)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Unit tests for the single frame processing bps yaml factory.
+"""
+import os
+import contextlib
+import io
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.drp_tools.sfp_utils import SfpYamlFactory, partition_visits
+
+
+class PartitionVisitsTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1234)
+        visits = rng.choice(10000, size=300, replace=False)
+        self.costs = {int(visit): float(cost) for visit, cost
+                      in zip(visits, rng.lognormal(0, 1, len(visits)))}
+        self.quanta = {visit: int(_) for visit, _
+                       in zip(self.costs, rng.integers(1, 190, len(visits)))}
+
+    def assert_assigned_once(self, parts, costs):
+        visits = [visit for part in parts for visit in part]
+        self.assertEqual(sorted(visits), sorted(costs))
+        for part in parts:
+            self.assertEqual(part, sorted(part))
+
+    def test_balance(self):
+        """Check the parts against the bounds for LPT scheduling."""
+        for num_parts in (1, 2, 7, 16, 50):
+            parts, part_costs, part_quanta \
+                = partition_visits(self.costs, num_parts, quanta=self.quanta)
+            self.assertEqual(len(parts), num_parts)
+            self.assert_assigned_once(parts, self.costs)
+            for part, cost, nquanta in zip(parts, part_costs, part_quanta):
+                self.assertAlmostEqual(cost,
+                                       sum(self.costs[_] for _ in part))
+                self.assertEqual(nquanta, sum(self.quanta[_] for _ in part))
+            max_cost = max(self.costs.values())
+            # The last visit added to the most expensive part went to
+            # the least expensive part at the time.
+            self.assertLessEqual(max(part_costs) - min(part_costs),
+                                 max_cost + 1e-9)
+            # Graham's bound relative to a lower bound on the optimal
+            # maximum part cost.
+            optimum = max(sum(self.costs.values())/num_parts, max_cost)
+            self.assertLessEqual(max(part_costs),
+                                 (4/3 - 1/(3*num_parts))*optimum + 1e-9)
+
+    def test_max_quanta_per_part(self):
+        max_quanta = 400
+        parts, part_costs, part_quanta \
+            = partition_visits(self.costs, 4, quanta=self.quanta,
+                               max_quanta_per_part=max_quanta)
+        self.assert_assigned_once(parts, self.costs)
+        self.assertGreater(len(parts), 4)
+        self.assertLessEqual(max(part_quanta), max_quanta)
+        for part, nquanta in zip(parts, part_quanta):
+            self.assertEqual(nquanta, sum(self.quanta[_] for _ in part))
+        with self.assertRaises(ValueError):
+            partition_visits(self.costs, 4, quanta=self.quanta,
+                             max_quanta_per_part=100)
+
+    def test_degenerate_inputs(self):
+        self.assertEqual(partition_visits({}, 3),
+                         ([[], [], []], [0, 0, 0], [0, 0, 0]))
+        # Fewer visits than parts: one visit per part, and the rest of
+        # the parts are empty.
+        costs = {10: 1., 11: 5., 12: 3.}
+        parts, part_costs, part_quanta = partition_visits(costs, 5)
+        self.assertEqual(parts, [[11], [12], [10], [], []])
+        self.assertEqual(part_costs, [5., 3., 1., 0, 0])
+        self.assertEqual(part_quanta, [1, 1, 1, 0, 0])
+        # Visits with equal costs are assigned in visit order.
+        parts, _, _ = partition_visits({3: 1., 1: 1., 2: 1.}, 2)
+        self.assertEqual(parts, [[1, 3], [2]])
+
+
+class SfpYamlFactoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.overlap_db = os.path.join(self.tmp_dir, 'overlaps.db')
+        rng = np.random.default_rng(42)
+        num_rows = 5000
+        self.df = pd.DataFrame(dict(visit=rng.integers(0, 500, num_rows),
+                                    detector=rng.integers(0, 189, num_rows),
+                                    tract=rng.integers(0, 10, num_rows),
+                                    patch=rng.integers(0, 49, num_rows)))
+        with sqlite3.connect(self.overlap_db) as con:
+            self.df.to_sql('overlaps', con, index=False)
+        con.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_overlap_db_is_not_modified(self):
+        """Check that the factory only reads the overlap db."""
+        with open(self.overlap_db, 'rb') as fobj:
+            contents = fobj.read()
+        factory = SfpYamlFactory(self.overlap_db, self.tmp_dir)
+        df = factory.query_overlaps([2, 3], processed_visits=[0, 1, 2])
+        with open(self.overlap_db, 'rb') as fobj:
+            self.assertEqual(fobj.read(), contents)
+        expected = self.df[self.df['tract'].isin([2, 3]) &
+                           ~self.df['visit'].isin([0, 1, 2])]
+        self.assertEqual(sorted(df.itertuples(index=False, name=None)),
+                         sorted(expected.itertuples(index=False, name=None)))
+
+    def test_processed_visits_inputs(self):
+        """
+        Check the exclusion of the processed visits given in a list, a
+        text file, and a table in another db file.
+        """
+        visits_file = os.path.join(self.tmp_dir, 'processed_visits.txt')
+        with open(visits_file, 'w') as output:
+            output.write('0\n5\n\n7\n')
+        processed_db = os.path.join(self.tmp_dir, 'processed.db')
+        with sqlite3.connect(processed_db) as con:
+            df = pd.DataFrame(dict(visit=[7, 11, 11, 400, 1000]))
+            df.to_sql('visits', con, index=False)
+        con.close()
+        factory = SfpYamlFactory(self.overlap_db, self.tmp_dir)
+        df = factory.query_overlaps([2, 3], visit_range=(0, 450),
+                                    processed_visits=visits_file,
+                                    processed_visits_table=(processed_db,
+                                                            'visits'))
+        excluded = [0, 5, 7, 11, 400]
+        expected = self.df[self.df['tract'].isin([2, 3]) &
+                           self.df['visit'].between(0, 450) &
+                           ~self.df['visit'].isin(excluded)]
+        self.assertGreater(len(expected), 0)
+        self.assertTrue(self.df['visit'].isin(excluded).any())
+        self.assertEqual(sorted(df.itertuples(index=False, name=None)),
+                         sorted(expected.itertuples(index=False, name=None)))
+
+    def test_create_return_counts(self):
+        processed_db = os.path.join(self.tmp_dir, 'processed.db')
+        with sqlite3.connect(processed_db) as con:
+            df = pd.DataFrame(dict(visit=range(0, 500, 3)))
+            df.to_sql('visits', con, index=False)
+        con.close()
+        factory = SfpYamlFactory(self.overlap_db, self.tmp_dir)
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                visits, counts = factory.create(
+                    [2, 3, 4], num_parts=3, processed_visits=[1],
+                    processed_visits_table=(processed_db, 'visits'),
+                    return_counts=True)
+            yaml_files = sorted(_ for _ in os.listdir(self.tmp_dir)
+                                if _.endswith('.yaml'))
+        finally:
+            os.chdir(cwd)
+        expected = self.df[self.df['tract'].isin([2, 3, 4]) &
+                           (self.df['visit'] % 3 != 0) &
+                           (self.df['visit'] != 1)]
+        self.assertEqual(visits, sorted(set(expected['visit'])))
+        self.assertEqual(counts.to_dict(),
+                         {tract: len(set(group['visit'])) for tract, group
+                          in expected.groupby('tract')})
+        self.assertEqual(yaml_files,
+                         [f'bps_sfp_Y1_2_3_4_visits_part_{part:02d}.yaml'
+                          for part in range(3)])
+
+    def test_missing_overlap_db(self):
+        with self.assertRaises(FileNotFoundError):
+            SfpYamlFactory(os.path.join(self.tmp_dir, 'missing.db'),
+                           self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Unit tests for the skymap geometry cache.
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from desc.drp_tools import skymap_cache
+from desc.drp_tools.skymap_cache import load_skymap_geometry
+
+
+class Angle:
+    def __init__(self, degrees):
+        self.degrees = degrees
+
+    def asDegrees(self):
+        return self.degrees
+
+
+class Coord:
+    def __init__(self, ra, dec):
+        self.ra, self.dec = Angle(ra), Angle(dec)
+
+    def getLongitude(self):
+        return self.ra
+
+    def getLatitude(self):
+        return self.dec
+
+
+class Tract:
+    def __init__(self, tract_id, ra, dec, half_width=0.5):
+        self.tract_id = tract_id
+        self.center = Coord(ra, dec)
+        self.vertex_list = [Coord(ra + dra, dec + ddec) for dra, ddec
+                            in ((-half_width, -half_width),
+                                (half_width, -half_width),
+                                (half_width, half_width),
+                                (-half_width, half_width))]
+
+    def getId(self):
+        return self.tract_id
+
+    def getCtrCoord(self):
+        return self.center
+
+
+class Skymap:
+    """Minimal skymap with the interface used by SkymapGeometry."""
+    def __init__(self, ras, dec=-30.):
+        self.tracts = [Tract(i, ra, dec) for i, ra in enumerate(ras)]
+
+    def __iter__(self):
+        return iter(self.tracts)
+
+    def __getitem__(self, tract_id):
+        return self.tracts[tract_id]
+
+
+class SkymapCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.skymap_file = os.path.join(self.tmp_dir, 'skyMap.pickle')
+        self.cache_file = os.path.join(self.tmp_dir, 'skyMap_geometry.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_skymap(self, ras):
+        with open(self.skymap_file, 'wb') as output:
+            pickle.dump(Skymap(ras), output)
+
+    def load(self, **kwds):
+        """
+        Load the geometry, returning it and whether the cache was
+        rebuilt.
+        """
+        with mock.patch.object(skymap_cache, 'build_skymap_cache',
+                               wraps=skymap_cache.build_skymap_cache) \
+                as build:
+            geometry = load_skymap_geometry(self.skymap_file,
+                                            cache_file=self.cache_file,
+                                            **kwds)
+        return geometry, build.called
+
+    def test_cache_hit(self):
+        self.write_skymap([10., 20., 30.])
+        geometry, rebuilt = self.load()
+        self.assertTrue(rebuilt)
+        np.testing.assert_array_equal(geometry.ra, [10., 20., 30.])
+        cached, rebuilt = self.load(check_hash=True)
+        self.assertFalse(rebuilt)
+        np.testing.assert_array_equal(cached.tract_ids, geometry.tract_ids)
+        np.testing.assert_array_equal(cached.vertices, geometry.vertices)
+        # Without the skymap file, the cache is used as is.
+        os.remove(self.skymap_file)
+        cached, rebuilt = self.load()
+        self.assertFalse(rebuilt)
+        np.testing.assert_array_equal(cached.ra, [10., 20., 30.])
+
+    def test_source_changed(self):
+        self.write_skymap([10., 20., 30.])
+        self.load()
+        self.write_skymap([10., 20., 30., 40.])
+        geometry, rebuilt = self.load()
+        self.assertTrue(rebuilt)
+        np.testing.assert_array_equal(geometry.ra, [10., 20., 30., 40.])
+
+    def test_check_hash(self):
+        self.write_skymap([10., 20., 30.])
+        self.load()
+        # Change the contents, keeping the size and modification time.
+        stat = os.stat(self.skymap_file)
+        self.write_skymap([10., 20., 35.])
+        self.assertEqual(os.path.getsize(self.skymap_file), stat.st_size)
+        os.utime(self.skymap_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        geometry, rebuilt = self.load()
+        self.assertFalse(rebuilt)
+        np.testing.assert_array_equal(geometry.ra, [10., 20., 30.])
+
+        geometry, rebuilt = self.load(check_hash=True)
+        self.assertTrue(rebuilt)
+        np.testing.assert_array_equal(geometry.ra, [10., 20., 35.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Unit tests for the storage projections.
+"""
+import sys
+import json
+import types
+import uuid
+import unittest
+from unittest import mock
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from desc.drp_tools import dp_sizes
+from desc.drp_tools.dp_sizes import SizeStats, load_qgraph
+from desc.drp_tools.storage_projection import count_outputs, \
+    project_storage
+
+
+DatasetType = namedtuple('DatasetType', ['name'])
+
+
+def quantum_node(task, outputs):
+    """
+    Stand-in for a QuantumNode, with outputs given as lists of data ids
+    keyed by dataset type name.
+    """
+    outputs = {DatasetType(dstype):
+               [types.SimpleNamespace(dataId=_) for _ in data_ids]
+               for dstype, data_ids in outputs.items()}
+    return types.SimpleNamespace(
+        taskDef=types.SimpleNamespace(label=task),
+        quantum=types.SimpleNamespace(outputs=outputs))
+
+
+class QuantumGraph:
+    """
+    Stand-in for lsst.pipe.base.graph.QuantumGraph that serves the
+    nodes of a single graph file, recording the size of each load.
+    """
+    def __init__(self, nodes, has_header=True):
+        self.nodes = {uuid.UUID(int=i + 1): node
+                      for i, node in enumerate(nodes)}
+        self.has_header = has_header
+        self.loads = []
+
+    def readHeader(self, uri):
+        if not self.has_header:
+            return None
+        return json.dumps({'Nodes': [[str(_), {}] for _ in self.nodes]})
+
+    def loadUri(self, uri, universe=None, nodes=None):
+        if nodes is None:
+            nodes = list(self.nodes)
+        self.loads.append(len(nodes))
+        return [self.nodes[_] for _ in nodes]
+
+
+def size_stats(values):
+    stats = SizeStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+class StorageProjectionTestCase(unittest.TestCase):
+    def test_size_stats(self):
+        rng = np.random.default_rng(5)
+        values = rng.random(500)
+        stats = size_stats(values)
+        self.assertAlmostEqual(stats.mean, np.mean(values))
+        self.assertAlmostEqual(stats.variance, np.var(values, ddof=1))
+        self.assertAlmostEqual(stats.std, np.std(values, ddof=1))
+        self.assertTrue(np.isnan(size_stats([]).variance))
+        self.assertTrue(np.isnan(size_stats([1.]).variance))
+        self.assertEqual(size_stats([1., np.nan, 3.]).variance, 2.)
+
+    def test_batched_counts(self):
+        """Check that the output counts don't depend on the batch size."""
+        nodes = [quantum_node('calibrate', {'calexp': [dict(visit=i)],
+                                            'src': [dict(visit=i)]})
+                 for i in range(150)]
+        nodes.extend(quantum_node('deblend',
+                                  {'deepCoadd_meas': [dict(tract=t, patch=p)],
+                                   'deepCoadd_deblendedFlux':
+                                   [dict(tract=t, patch=p, band=b)
+                                    for b in 'griz']})
+                     for t in (1, 2, 3) for p in range(40))
+        task_steps = {'calibrate': 'step1', 'deblend': 'step3'}
+        expected = count_outputs(nodes, task_steps=task_steps)
+        columns = ['task', 'dataset_type', 'step', 'tract']
+        expected = expected.sort_values(columns, ignore_index=True)
+        self.assertEqual(expected['num_files'].sum(), 2*150 + 5*120)
+
+        graph_module = types.ModuleType('lsst.pipe.base.graph')
+        with mock.patch.dict(sys.modules,
+                             {'lsst.pipe.base.graph': graph_module}), \
+                mock.patch.object(dp_sizes.daf_butler, 'DimensionUniverse',
+                                  create=True):
+            for batch_size, has_header, loads in \
+                    ((1, True, [1]*270), (7, True, [7]*38 + [4]),
+                     (100, True, [100, 100, 70]), (10000, True, [270]),
+                     (None, True, [270]), (100, False, [270])):
+                graph_module.QuantumGraph \
+                    = QuantumGraph(nodes, has_header=has_header)
+                counts = count_outputs(load_qgraph('qgraph.qgraph',
+                                                   batch_size=batch_size),
+                                       task_steps=task_steps)
+                self.assertEqual(graph_module.QuantumGraph.loads, loads)
+                pd.testing.assert_frame_equal(
+                    counts.sort_values(columns, ignore_index=True),
+                    expected)
+
+    def test_project_storage(self):
+        nodes = [quantum_node('calibrate', {'calexp': [dict(visit=i)],
+                                            'src': [dict(visit=i)]})
+                 for i in range(100)]
+        nodes.extend(quantum_node('deblend', {'deepCoadd_meas':
+                                              [dict(tract=t, patch=p)]})
+                     for t in (1, 2) for p in range(10))
+        counts = count_outputs((_ for _ in nodes),
+                               task_steps={'calibrate': 'step1',
+                                           'deblend': 'step3'})
+        self.assertEqual(counts['num_files'].sum(), 220)
+
+        calexp = [1., 2., 3., 4.]
+        stats = {('calibrate', 'calexp'): size_stats(calexp),
+                 ('calibrate', 'src'): size_stats([0.5]),
+                 ('deblend', 'deepCoadd_meas'): size_stats([2., 4.])}
+        projections = project_storage(counts, stats)
+
+        task = projections['task'].set_index('task')
+        self.assertAlmostEqual(task.loc['calibrate', 'total (GB)'],
+                               100*2.5 + 100*0.5)
+        # The src variance is unknown, so the calibrate bands are too.
+        self.assertTrue(np.isnan(task.loc['calibrate', 'lower (GB)']))
+        self.assertTrue(np.isnan(task.loc['calibrate', 'upper (GB)']))
+        # The counts for each tract are summed as independent terms.
+        var = np.var([2., 4.], ddof=1)
+        sigma = np.sqrt(2*(10*var + 10**2*var/2))
+        z = 1.6448536269514722
+        self.assertAlmostEqual(task.loc['deblend', 'upper (GB)'],
+                               20*3. + z*sigma)
+        self.assertAlmostEqual(task.loc['deblend', 'lower (GB)'],
+                               max(20*3. - z*sigma, 0))
+
+        tract = projections['tract'].set_index('tract')
+        self.assertEqual(tract.loc[1, 'num_files'], 10)
+        self.assertAlmostEqual(tract.loc[1, 'upper (GB)'],
+                               30. + z*np.sqrt(10*var + 10**2*var/2))
+
+
+if __name__ == '__main__':
+    unittest.main()